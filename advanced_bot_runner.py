@@ -6,6 +6,12 @@ from ai_processor import AIProcessor
 from post_formatter import PostFormatter
 from database import get_last_messages, save_post
 from parsing_state import is_first_run, get_parsing_stats
+from rate_limiter import rate_limiter, format_rate_stats
+from pipeline import format_pipeline_stats
+from session_pool import session_pool, format_session_stats
+from digest_state import digest_state
+from post_ingest import post_ingest
+from config import RUNNING_DIGEST_ENABLED
 
 logger = logging.getLogger(__name__)
 
@@ -36,16 +42,31 @@ async def run_advanced_bot():
         ai_processor = AIProcessor()
         post_formatter = PostFormatter()
         
-        if all_messages:
+        # Накопительный дайджест дорабатывается вне loop, пост - чтение его состояния
+        running_digest = None
+        if RUNNING_DIGEST_ENABLED:
+            await post_ingest.run()
+            running_digest = await asyncio.to_thread(digest_state.build)
+        
+        if running_digest:
+            logger.info(f"   📰 Накопительный дайджест: {len(running_digest['sections'])} разделов")
+            structured_content = dict(running_digest, trends=ai_processor.rising_terms())
+            post_type = "НАКОПИТЕЛЬНЫЙ ДАЙДЖЕСТ"
+            data_source = f"за период, {total_new_messages} новых сообщений"
+        elif all_messages:
             logger.info(f"   📊 Использую {len(all_messages)} сообщений для анализа")
-            structured_content = ai_processor.structure_content(all_messages, [])
+            structured_content = ai_processor.structure_content(all_messages, [], parsing_results['labels'], parsing_results['clusters'])
             post_type = "РЕАЛЬНЫЕ ДАННЫЕ"
             data_source = f"на основе {total_new_messages} новых сообщений"
         else:
             logger.info("   🔄 Использую резервный контент")
             recent_messages = get_last_messages(limit=10)
+            labels = clusters = None
             if recent_messages:
                 texts = [msg['text'] for msg in recent_messages if msg['text']]
+                # Метки сохранены вместе с сообщениями, повторно не классифицируем
+                labels = [msg['marketplace'] or 'OTHER' for msg in recent_messages if msg['text']]
+                clusters = [msg['cluster_id'] for msg in recent_messages if msg['text']]
                 logger.info(f"   📁 Из базы: {len(texts)} сообщений")
                 data_source = "на основе данных из базы"
             else:
@@ -53,7 +74,7 @@ async def run_advanced_bot():
                 logger.info("   📝 Тестовые данные")
                 data_source = "тестовые данные"
             
-            structured_content = ai_processor.structure_content(texts, [])
+            structured_content = ai_processor.structure_content(texts, [], labels, clusters)
             post_type = "РЕЗЕРВНЫЕ ДАННЫЕ"
         
         post_content = post_formatter.format_structured_post(structured_content)
@@ -72,7 +93,8 @@ async def run_advanced_bot():
             post_type, 
             send_success,
             stats,
-            first_run
+            first_run,
+            parsing_results.get('stage_stats')
         )
         
         logger.info(f"🎯 ИТОГ: {stats_text}")
@@ -94,7 +116,7 @@ async def run_advanced_bot():
         logger.error(f"🔍 Детали: {traceback.format_exc()}")
         return f"❌ Ошибка: {str(e)}"
 
-def generate_detailed_stats(channel_stats, new_messages, total_messages, post_type, send_success, parsing_stats, first_run):
+def generate_detailed_stats(channel_stats, new_messages, total_messages, post_type, send_success, parsing_stats, first_run, stage_stats=None):
     """Генерирует детальную статистику"""
     lines = []
     lines.append(f"🎯 РЕЖИМ: {'ПЕРВЫЙ ЗАПУСК' if first_run else 'РЕГУЛЯРНЫЙ ПАРСИНГ'}")
@@ -116,6 +138,8 @@ def generate_detailed_stats(channel_stats, new_messages, total_messages, post_ty
             lines.append(f"   📝 {stat['title']}")
             lines.append(f"   📨 Новых: {stat['new_messages']}")
             lines.append(f"   📊 Обработано: {stat['total_processed']}")
+            if stat.get('account'):
+                lines.append(f"   👤 Аккаунт: {stat['account']}")
         else:
             lines.append(f"❌ {stat.get('channel', 'N/A')}")
             lines.append(f"   💥 {stat.get('error', 'Unknown error')}")
@@ -125,6 +149,21 @@ def generate_detailed_stats(channel_stats, new_messages, total_messages, post_ty
     lines.append(f"📈 ВСЕГО СООБЩЕНИЙ В БАЗЕ: {parsing_stats['total_messages_parsed']}")
     lines.append(f"🌐 ОБРАБОТАНО КАНАЛОВ: {parsing_stats['total_channels']}")
     
+    rate_lines = format_rate_stats(rate_limiter.get_stats())
+    if rate_lines:
+        lines.append("")
+        lines.append("⏳ ЛИМИТЫ TELEGRAM:")
+        lines.extend(rate_lines)
+    
+    lines.append("")
+    lines.append("👥 АККАУНТЫ:")
+    lines.extend(format_session_stats(session_pool.get_stats()))
+    
+    if stage_stats:
+        lines.append("")
+        lines.append("⏱️ СТАДИИ ОБРАБОТКИ:")
+        lines.extend(format_pipeline_stats(stage_stats))
+    
     return "\n".join(lines)
 
 def create_result_html(post_type, new_messages, total_messages, send_success, stats_text, post_content, data_source, first_run):
@@ -1,39 +1,62 @@
 import logging
+from marketplace_classifier import marketplace_classifier, count_marketplaces
+from summarizer import summarizer
+from sentiment import sentiment_analyzer, aggregate
+from inference_client import InferenceClient, top_prediction
+from trends import trend_detector
+from config import INFERENCE_URL, INFERENCE_MIN_SCORE, TRENDS_ENABLED, TREND_TOP
 
 logger = logging.getLogger(__name__)
 
+# Метки, из которых модель выбирает маркетплейс сообщения (zero-shot)
+MARKETPLACE_LABELS = ['OZON', 'WB', 'YANDEX', 'OTHER']
+
+def parse_marketplace(output):
+    """Метка из ответа модели или None, если модель не уверена"""
+    label, score = top_prediction(output)
+    label = (label or '').upper()
+    if label not in MARKETPLACE_LABELS or score < INFERENCE_MIN_SCORE:
+        return None
+    return label
+
 class AIProcessor:
-    def __init__(self):
-        pass
+    def __init__(self, model=None):
+        # Без INFERENCE_URL модели нет, маркетплейс определяют локальные правила
+        self.model = marketplace_model if model is None else model
         
     def analyze_marketplace(self, text, channel_url=""):
         """Анализирует текст и определяет маркетплейс"""
-        if not text:
-            return 'OTHER'
-            
-        text_lower = text.lower()
-        channel_lower = channel_url.lower()
-        
-        # Определяем по URL канала
-        if 'ozon' in channel_lower:
-            return 'OZON'
-        elif 'wb' in channel_lower or 'wildberr' in channel_lower:
-            return 'WB'
-        elif 'yandex' in channel_lower or 'market' in channel_lower:
-            return 'YANDEX'
-            
-        # Определяем по тексту
-        if 'ozon' in text_lower or 'озон' in text_lower:
-            return 'OZON'
-        elif 'wb' in text_lower or 'вб' in text_lower or 'wildberr' in text_lower:
-            return 'WB'
-        elif 'yandex' in text_lower or 'яндекс' in text_lower:
-            return 'YANDEX'
-        
-        return 'OTHER'
+        if self.model is None or not text:
+            return marketplace_classifier.classify(text, channel_url)
+        return marketplace_classifier.channel_label(channel_url) or self.model.predict_many([text])[0]
+
+    async def classify(self, text, channel_url=""):
+        """То же для конвейера: запросы к модели собираются в пачки, event loop не блокируется"""
+        if self.model is None or not text:
+            return marketplace_classifier.classify(text, channel_url)
+        return marketplace_classifier.channel_label(channel_url) or await self.model.apredict(text)
+
+    def classify_many(self, texts, channel_url=""):
+        """Метки для пачки сообщений одного канала, в том же порядке"""
+        channel = marketplace_classifier.channel_label(channel_url)
+        if self.model is None or channel:
+            return marketplace_classifier.classify_many(texts, channel_url)
+        return self.model.predict_many(texts)
+
+    def analyze_sentiment(self, texts):
+        """Тональность пачки текстов от -1 до 1 (словарная, см. sentiment)"""
+        return sentiment_analyzer.score_many(texts)
+
+    def structure_content(self, source_texts, discussion_texts, labels=None, clusters=None):
+        """Структурирует контент для поста.
 
-    def structure_content(self, source_texts, discussion_texts):
-        """Структурирует контент для поста"""
+        labels - метки маркетплейса, сохраненные вместе с сообщениями, в
+        порядке source_texts + discussion_texts; без них тексты
+        классифицируются здесь. clusters - кластеры почти одинаковых
+        сообщений в том же порядке. Разделы заполняются самыми
+        показательными предложениями из самих сообщений (см. summarizer),
+        раздел "Что нового" - растущими за неделю термами (см. trends).
+        """
         try:
             # Объединяем все тексты
             all_content = source_texts + discussion_texts
@@ -42,34 +65,48 @@ class AIProcessor:
                 return self._create_fallback_structure([])
 
             # Анализируем тексты
-            marketplace_stats = {'OZON': 0, 'WB': 0, 'YANDEX': 0, 'OTHER': 0}
+            if labels is None:
+                labels = self.classify_many(all_content)
+            marketplace_stats = count_marketplaces(labels)
             
-            for text in all_content:
-                marketplace = self.analyze_marketplace(text)
-                marketplace_stats[marketplace] += 1
+            sections = summarizer.summarize(all_content, labels, clusters)
+            sections.pop('OTHER', None)
+            if not sections:
+                sections = self._create_fallback_structure(all_content)['sections']
+            
+            tips = [tip for section in sections.values() for tip in section.get('tips', [])]
+            
+            tone = aggregate(self.analyze_sentiment(all_content), labels)
+            mood = ', '.join(
+                f'{label} {tone[label]["average"]:+.2f}' for label in ('OZON', 'WB', 'YANDEX') if label in tone
+            )
             
             return {
                 'title': '📊 Аналитика маркетплейсов',
-                'summary': f'Проанализировано {len(all_content)} сообщений. OZON: {marketplace_stats["OZON"]}, WB: {marketplace_stats["WB"]}',
-                'sections': {
-                    'OZON': {
-                        'key_points': ['Обновления платформы', 'Логистические улучшения'],
-                        'important': ['Следите за обновлениями'],
-                        'tips': ['Используйте инструменты аналитики']
-                    },
-                    'WB': {
-                        'key_points': ['Оптимизация процессов', 'Обновления возвратов'],
-                        'important': ['Внимание к регламентам'],
-                        'tips': ['Мониторьте статистику']
-                    }
-                },
-                'recommendations': 'Следите за официальными объявлениями'
+                'summary': f'Проанализировано {len(all_content)} сообщений. OZON: {marketplace_stats["OZON"]}, WB: {marketplace_stats["WB"]}'
+                           + (f'. Тональность: {mood}' if mood else ''),
+                'sections': sections,
+                'trends': self.rising_terms(),
+                'recommendations': tips[0] if tips else 'Следите за официальными объявлениями'
             }
                 
         except Exception as e:
             logger.error(f"❌ Ошибка структурирования: {e}")
             return self._create_fallback_structure(source_texts + discussion_texts)
 
+    def rising_terms(self, limit=TREND_TOP):
+        """Растущие термы по маркетплейсам: {'OZON': ['маркировка остатков', ...], ...}"""
+        if not TRENDS_ENABLED:
+            return {}
+        try:
+            return {
+                marketplace: [item['term'] for item in items]
+                for marketplace, items in trend_detector.top_rising(limit=limit).items()
+            }
+        except Exception as e:
+            logger.warning(f"⚠️ Тренды недоступны: {e}")
+            return {}
+
     def _create_fallback_structure(self, texts):
         """Создает резервную структуру"""
         return {
@@ -88,4 +125,10 @@ class AIProcessor:
                 }
             },
             'recommendations': 'Участвуйте в профессиональных сообществах'
-        }
\ No newline at end of file
+        }
+
+# Глобальный экземпляр
+marketplace_model = InferenceClient(
+    'marketplace', marketplace_classifier.classify_many, parse_marketplace,
+    parameters={'candidate_labels': MARKETPLACE_LABELS}
+) if INFERENCE_URL else None
@@ -1,7 +1,9 @@
 import os
-import asyncio
+import time
 import logging
-from flask import Flask
+import threading
+from flask import Flask, request, jsonify
+from telegram_runtime import telegram_runtime
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -17,6 +19,49 @@ try:
 except Exception as e:
     logger.error(f"❌ Ошибка БД: {e}")
 
+# Фоновые службы запускаются один раз на процесс
+_services_lock = threading.Lock()
+_services_started = False
+
+def start_background_services():
+    """Запускает push-прием, опрос каналов и возобновление догрузки.
+
+    Не вызывается при импорте: импорт app из скриптов и каждый воркер
+    gunicorn иначе запускали бы свои копии циклов. Точки входа -
+    python app.py и хук post_worker_init в gunicorn.conf.py; воркер
+    gunicorn должен быть один (workers = 1). Повторный вызов в том же
+    процессе ничего не делает.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+
+    # Push-режим: сообщения каналов сохраняются сразу по мере публикации
+    from config import PUSH_INGEST_ENABLED
+    if PUSH_INGEST_ENABLED:
+        from push_ingest import push_ingestor
+        telegram_runtime.submit(push_ingestor.start())
+
+    # Адаптивный опрос каналов: каждый канал в свое время по реестру
+    from config import CHANNEL_POLLING_ENABLED
+    if CHANNEL_POLLING_ENABLED:
+        from advanced_parser import channel_polling_loop
+        telegram_runtime.submit(channel_polling_loop())
+
+    # Незавершенная догрузка истории продолжается после перезапуска
+    from config import BACKFILL_AUTO_RESUME
+    if BACKFILL_AUTO_RESUME:
+        try:
+            from parsing_state import get_pending_backfills, get_pending_gaps
+            if get_pending_backfills() or get_pending_gaps():
+                from backfill import backfiller
+                telegram_runtime.submit(backfiller.run())
+                logger.info("📚 Продолжаем догрузку истории")
+        except Exception as e:
+            logger.error(f"❌ Ошибка возобновления догрузки: {e}")
+
 @app.route('/')
 def home():
     return """
@@ -29,6 +74,12 @@ def home():
         <li><a href="/test-parser">/test-parser</a> - Тест парсинга</li>
         <li><a href="/test-send">/test-send</a> - Тест отправки</li>
         <li><a href="/health">/health</a> - Проверка работы</li>
+        <li><a href="/backfill">/backfill</a> - Догрузка истории каналов</li>
+        <li><a href="/channels">/channels</a> - Реестр каналов и расписание опроса</li>
+        <li><a href="/topics">/topics</a> - Дайджест по темам за неделю</li>
+        <li><a href="/sentiment">/sentiment</a> - Тональность по маркетплейсам и дням</li>
+        <li><a href="/trends">/trends</a> - Растущие темы недели</li>
+        <li><a href="/telegram-health">/telegram-health</a> - Проверка клиентов Telegram</li>
     </ul>
     
     <h3>📊 Каналы для парсинга:</h3>
@@ -47,18 +98,26 @@ def home():
 def health():
     return "✅ Сервер работает"
 
+@app.route('/telegram-health')
+def telegram_health():
+    """Проверка постоянных клиентов Telegram с переподключением"""
+    try:
+        status = telegram_runtime.health_check()
+        lines = []
+        for kind, item in status.items():
+            state = '✅ подключен' if item['connected'] else ('❌ отключен' if item['started'] else '⚪ не запущен')
+            lines.append(f"<li>{kind}: {state}</li>")
+        return f"<h2>🔌 Клиенты Telegram</h2><ul>{''.join(lines)}</ul><a href=\"/\">← Назад</a>"
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
 @app.route('/run-advanced')
 def run_advanced():
     """Запуск улучшенного бота"""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+        # Бот выполняется в фоновом loop с уже подключенными клиентами
         from advanced_bot_runner import run_advanced_bot
-        result = loop.run_until_complete(run_advanced_bot())
-        loop.close()
-        
-        return result
+        return telegram_runtime.run(run_advanced_bot())
     except Exception as e:
         return f"❌ Ошибка: {str(e)}"
 
@@ -67,9 +126,15 @@ def parsing_stats():
     """Статистика парсинга"""
     try:
         from parsing_state import get_parsing_stats, is_first_run
+        from rate_limiter import rate_limiter, format_rate_stats
         
         stats = get_parsing_stats()
         first_run = is_first_run()
+        rate_text = "\n".join(format_rate_stats(rate_limiter.get_stats())) or "Запросов еще не было"
+        
+        from session_pool import session_pool, format_session_stats
+        sessions_text = "\n".join(format_session_stats(session_pool.get_stats()))
+        push_text = format_push_stats() if PUSH_INGEST_ENABLED else "Push-режим выключен (PUSH_INGEST_ENABLED)"
         
         return f"""
         <h2>📊 Статистика парсинга</h2>
@@ -80,6 +145,15 @@ def parsing_stats():
             <p><strong>📨 Всего сообщений в базе:</strong> {stats['total_messages_parsed']}</p>
         </div>
         
+        <h3>⏳ Лимиты Telegram:</h3>
+        <pre>{rate_text}</pre>
+        
+        <h3>👥 Аккаунты:</h3>
+        <pre>{sessions_text}</pre>
+        
+        <h3>📡 Push-режим:</h3>
+        <pre>{push_text}</pre>
+        
         <p><strong>💡 Совет:</strong> {'Запустите парсинг для наполнения базы данных' if first_run else 'База данных уже содержит исторические данные'}</p>
         
         <a href="/run-advanced">🚀 Запустить улучшенный парсинг</a> | 
@@ -88,13 +162,171 @@ def parsing_stats():
     except Exception as e:
         return f"❌ Ошибка: {str(e)}"
 
+def format_push_stats():
+    """Статистика push-режима для страницы статистики"""
+    from push_ingest import push_ingestor
+    stats = push_ingestor.get_stats()
+    latency = f"{stats['last_latency']:.1f} с" if stats['last_latency'] is not None else "нет данных"
+    return "\n".join([
+        f"Статус: {'✅ работает' if stats['running'] else '❌ остановлен'} ({stats['channels']} каналов)",
+        f"Получено: {stats['received']}, правок: {stats['edits']}, сохранено: {stats['saved']}",
+        f"Пачек записи: {stats['batches']}, в очереди: {stats['queued']}, потеряно: {stats['dropped']}",
+        f"Догрузок истории: {stats['gap_fills']}",
+        f"Задержка последнего сообщения: {latency}"
+    ])
+
+@app.route('/backfill')
+def backfill():
+    """Запуск глубокой догрузки истории: ?channel=...&days=90&priority=1"""
+    try:
+        from backfill import backfiller
+        from channel_registry import get_channel_urls
+        from config import BACKFILL_DAYS
+        
+        channels = request.args.getlist('channel') or get_channel_urls()
+        days = int(request.args.get('days', BACKFILL_DAYS))
+        priority = int(request.args.get('priority', 1))
+        
+        backfiller.request(channels, days, priority)
+        if not backfiller.running:
+            telegram_runtime.submit(backfiller.run())
+        
+        return f"""
+        <h2>📚 Догрузка истории запущена</h2>
+        <p>Каналов: {len(channels)}, глубина: {days} дней, приоритет: {priority}</p>
+        <a href="/backfill-status">📊 Прогресс</a> | <a href="/">← Назад</a>
+        """
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
+@app.route('/backfill-status')
+def backfill_status():
+    """Прогресс догрузки истории"""
+    try:
+        from backfill import backfiller
+        from parsing_state import get_backfill_stats
+        
+        lines = []
+        for item in get_backfill_stats():
+            status = '✅ готово' if item['status'] == 'done' else '⏳ в очереди'
+            lines.append(
+                f"{item['channel_url']}: {status}, загружено {item['loaded']}, "
+                f"позиция ID {item['offset_id'] or '-'}, до {item['until']}, приоритет {item['priority']}"
+            )
+        
+        return f"""
+        <h2>📚 Догрузка истории {'(выполняется)' if backfiller.running else ''}</h2>
+        <pre>{chr(10).join(lines) or 'Догрузка не запрашивалась'}</pre>
+        <a href="/">← Назад</a>
+        """
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
+@app.route('/channels')
+def channels():
+    """Реестр каналов: ?add=URL&role=main&priority=1&limit=50 или ?remove=URL"""
+    try:
+        from channel_registry import get_channels, add_channel, remove_channel
+        
+        if request.args.get('add'):
+            limit = request.args.get('limit')
+            add_channel(
+                request.args['add'],
+                request.args.get('role', 'main'),
+                int(request.args.get('priority', 1)),
+                int(limit) if limit else None
+            )
+        if request.args.get('remove'):
+            remove_channel(request.args['remove'])
+        
+        lines = []
+        for item in get_channels():
+            rate = f"{item['post_rate']:.1f}/ч" if item['post_rate'] is not None else '-'
+            interval = f"{item['poll_interval'] / 60:.0f} мин" if item['poll_interval'] else '-'
+            lines.append(
+                f"{item['channel_url']}: {item['role']}, приоритет {item['priority']}, лимит {item['fetch_limit']}, "
+                f"темп {rate}, интервал {interval}, следующий опрос {item['next_poll_at'] or 'сейчас'}"
+            )
+        
+        return f"""
+        <h2>📋 Реестр каналов</h2>
+        <pre>{chr(10).join(lines) or 'Каналов нет'}</pre>
+        <a href="/">← Назад</a>
+        """
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
+@app.route('/topics')
+def topics():
+    """Предпросмотр дайджеста по темам: ?days=7"""
+    try:
+        from topic_clustering import build_topic_digest, topic_model
+        from post_formatter import PostFormatter
+        
+        digest = build_topic_digest(int(request.args.get('days', 7)))
+        stats = topic_model.get_stats()
+        post = PostFormatter().format_structured_post(digest) if digest else 'Сообщений за период нет'
+        
+        return f"""
+        <h2>🗂️ Темы</h2>
+        <p>Тем: {stats['topics']}, сообщений в модели: {stats['documents']}</p>
+        <pre>{post}</pre>
+        <a href="/">← Назад</a>
+        """
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
+@app.route('/sentiment')
+def sentiment():
+    """Тональность сообщений по маркетплейсам и дням: ?days=7"""
+    try:
+        from sentiment import get_sentiment_by_day
+        
+        lines = [
+            f"{row['day']} {row['marketplace']:<7} {row['average']:+.3f}  "
+            f"сообщений {row['count']}, позитивных {row['positive']}, негативных {row['negative']}"
+            for row in get_sentiment_by_day(int(request.args.get('days', 7)))
+        ]
+        
+        return f"""
+        <h2>🙂 Тональность</h2>
+        <pre>{chr(10).join(lines) or 'Сообщений за период нет'}</pre>
+        <a href="/">← Назад</a>
+        """
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
+@app.route('/trends')
+def trends():
+    """Растущие термы по маркетплейсам: ?marketplace=OZON&limit=10, &format=json - JSON"""
+    try:
+        from trends import trend_detector
+        
+        marketplace = request.args.get('marketplace', '').upper() or None
+        started = time.perf_counter()
+        rising = trend_detector.top_rising(marketplace, int(request.args.get('limit', 10)))
+        elapsed = (time.perf_counter() - started) * 1000
+        
+        if request.args.get('format') == 'json':
+            return jsonify({'trends': rising, 'query_ms': round(elapsed, 2), 'stats': trend_detector.get_stats()})
+        
+        lines = [
+            f"{name:<7} {item['term']:<30} {item['count']:>5} (ожидалось {item['expected']}, x{item['growth']})"
+            for name, items in rising.items() for item in items
+        ]
+        return f"""
+        <h2>📈 Тренды</h2>
+        <pre>{chr(10).join(lines) or 'Растущих тем пока нет'}</pre>
+        <p>Запрос: {elapsed:.1f} мс</p>
+        <a href="/">← Назад</a>
+        """
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
 @app.route('/test-send')
 def test_send():
     """Тест отправки сообщения"""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         from telegram_manager import telegram_manager
         from post_formatter import PostFormatter
         
@@ -103,9 +335,7 @@ def test_send():
         test_post = formatter._create_fallback_post()
         
         # Отправляем
-        success = loop.run_until_complete(telegram_manager.send_message(test_post))
-        loop.run_until_complete(telegram_manager.cleanup())
-        loop.close()
+        success = telegram_runtime.run(telegram_manager.send_message(test_post))
         
         if success:
             return """
@@ -124,5 +354,6 @@ def test_send():
         return f"❌ Ошибка отправки: {str(e)}"
 
 if __name__ == '__main__':
+    start_background_services()
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,196 @@
+import queue
+import asyncio
+import logging
+import threading
+import database
+import parsing_state
+from storage import transaction
+
+logger = logging.getLogger(__name__)
+
+# Сколько запросов максимум объединяется в один коммит
+MAX_GROUP_SIZE = 64
+
+# Размер страницы, которую парсер отдает на запись, не дожидаясь конца чтения
+PAGE_SIZE = 100
+
+class AsyncStorage:
+    """Асинхронный фасад над базой данных.
+
+    Записи выполняются в отдельном потоке-писателе, который берет
+    запросы из очереди и коммитит накопившиеся запросы одной транзакцией
+    (group commit). Чтения идут мимо него, в потоках asyncio.to_thread со
+    своими соединениями пула, и не держат блокировку записи. Event loop
+    при этом не блокируется, поэтому загрузка сообщений из Telegram и
+    запись в базу идут параллельно.
+    """
+
+    def __init__(self, max_group_size=MAX_GROUP_SIZE):
+        self.max_group_size = max_group_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запускает поток-писатель, если он еще не запущен"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Останавливает поток-писатель после обработки очереди"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def _submit(self, func, *args):
+        """Ставит вызов в очередь и возвращает future текущего event loop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.start()
+        self._queue.put((func, args, loop, future))
+        return future
+
+    def _run(self):
+        """Цикл потока-писателя"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            group = [item]
+            while len(group) < self.max_group_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+
+            self._execute_group(group)
+
+    def _execute_group(self, group):
+        """Выполняет группу запросов в одной транзакции.
+
+        Каждый запрос открывает свою вложенную транзакцию (SAVEPOINT),
+        поэтому ошибка одного запроса не откатывает остальные.
+        """
+        results = []
+        try:
+            with transaction():
+                for func, args, _, _ in group:
+                    try:
+                        results.append((True, func(*args)))
+                    except Exception as e:
+                        results.append((False, e))
+        except Exception as e:
+            logger.error(f"❌ Ошибка групповой записи: {e}")
+            results = [(False, e)] * len(group)
+
+        for (_, _, loop, future), (ok, value) in zip(group, results):
+            try:
+                loop.call_soon_threadsafe(_resolve_future, future, ok, value)
+            except RuntimeError:
+                # Event loop уже закрыт - результат никому не нужен
+                pass
+
+    async def run(self, func, *args):
+        """Выполняет произвольную функцию работы с базой в потоке-писателе"""
+        return await self._submit(func, *args)
+
+    async def read(self, func, *args):
+        """Выполняет функцию, которая только читает, вне потока-писателя.
+
+        Результат записи отдается после фиксации, поэтому чтение после
+        await записи уже видит ее.
+        """
+        return await asyncio.to_thread(func, *args)
+
+    async def save_message(self, message_text, channel_url, marketplace='OTHER'):
+        return await self._submit(database.save_message, message_text, channel_url, marketplace)
+
+    async def message_exists(self, message_text, channel_url):
+        return await self.read(database.message_exists, message_text, channel_url)
+
+    async def save_messages_batch(self, messages, channel_url):
+        return await self._submit(database.save_messages_batch, messages, channel_url)
+
+    async def get_channel_state(self, channel_url):
+        return await self.read(parsing_state.get_channel_state, channel_url)
+
+    async def update_channel_state(self, channel_url, last_message_id, new_messages_count, gap=None):
+        return await self._submit(
+            parsing_state.update_channel_state, channel_url, last_message_id, new_messages_count, gap
+        )
+
+    async def save_channel_batch(self, messages, channel_url, last_message_id, saved_before=0, gap=None):
+        return await self._submit(
+            parsing_state.save_channel_batch, messages, channel_url, last_message_id, saved_before, gap
+        )
+
+    def channel_writer(self, channel_url, page_size=PAGE_SIZE):
+        """Создает накопитель страниц для канала"""
+        return ChannelWriter(self, channel_url, page_size)
+
+class ChannelWriter:
+    """Накопитель сообщений канала.
+
+    Заполненные страницы сразу уходят в запись, а чтение истории
+    продолжается; flush() дожидается всех страниц и возвращает новые
+    сообщения в порядке добавления. Если в flush() передан водяной знак,
+    последняя страница и обновление состояния канала пишутся одной
+    транзакцией после всех предыдущих страниц.
+    """
+
+    def __init__(self, storage, channel_url, page_size=PAGE_SIZE):
+        self.storage = storage
+        self.channel_url = channel_url
+        self.page_size = page_size
+        self.count = 0
+        self._page = []
+        self._pending = []
+
+    def add(self, message):
+        self._page.append(message)
+        self.count += 1
+        if len(self._page) >= self.page_size:
+            self._send_page()
+
+    def _send_page(self):
+        page, self._page = self._page, []
+        self._pending.append(asyncio.ensure_future(
+            self.storage.save_messages_batch(page, self.channel_url)
+        ))
+
+    async def flush(self, last_message_id=None, gap=None):
+        if last_message_id is None and self._page:
+            self._send_page()
+        pending, self._pending = self._pending, []
+        saved = list(await asyncio.gather(*pending))
+
+        if last_message_id is not None:
+            page, self._page = self._page, []
+            saved_before = sum(len(p) for p in saved)
+            saved.append(await self.storage.save_channel_batch(
+                page, self.channel_url, last_message_id, saved_before, gap
+            ))
+
+        return [message for page in saved for message in page]
+
+def _resolve_future(future, ok, value):
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+# Глобальный экземпляр
+async_storage = AsyncStorage()
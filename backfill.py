@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import itertools
+from datetime import datetime, timedelta, timezone
+from async_storage import async_storage
+from database import message_record, format_date
+from marketplace_classifier import marketplace_classifier
+from peer_cache import resolve_channel, invalidate_peer, is_stale_peer_error
+from post_ingest import post_ingest
+from parsing_state import (
+    request_backfill, get_pending_backfills, save_backfill_page, get_pending_gaps, save_gap_page
+)
+from rate_limiter import rate_limiter, client_account
+from session_pool import session_pool
+from config import BACKFILL_DAYS, BACKFILL_PAGE_SIZE, BACKFILL_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Сколько страниц за ход у разрыва в свежей истории: он важнее глубокой догрузки
+GAP_PRIORITY = 3
+
+class Backfiller:
+    """Глубокая догрузка истории каналов назад по offset_id.
+
+    Каждая страница (BACKFILL_PAGE_SIZE сообщений) пишется вместе с
+    контрольной точкой в parsing_state, поэтому в памяти не больше одной
+    страницы на канал, а после перезапуска догрузка продолжается с того же
+    места. Каналы обрабатываются по очереди с приоритетом: за один ход
+    канал загружает столько страниц, каков его приоритет, после чего
+    уступает место следующему. Запросы идут через отдельный класс лимита
+    'backfill', FloodWait приостанавливает и его, и обычный парсинг.
+
+    Разрывы, которые оставил парсер, когда новых сообщений было больше
+    лимита (gap_from_id..gap_to_id), догружаются тем же ходом: страницы
+    идут вниз от gap_to_id, после каждой разрыв сужается, закрытый
+    обнуляется.
+    """
+
+    def __init__(self):
+        self.running = False
+        self._task = None
+        self.stats = {'pages': 0, 'loaded': 0, 'saved': 0, 'finished': 0, 'errors': 0}
+
+    def request(self, channels, days=BACKFILL_DAYS, priority=1):
+        """Ставит каналы в очередь догрузки на days дней назад"""
+        until = format_date(datetime.now(timezone.utc) - timedelta(days=days))
+        for channel_url in channels:
+            request_backfill(channel_url, until, priority)
+        logger.info(f"📚 Догрузка истории запрошена: {len(channels)} каналов, {days} дней, приоритет {priority}")
+
+    def start(self, client=None):
+        """Запускает догрузку фоновой задачей текущего loop.
+
+        Ссылка на задачу хранится, пока она не закончится, а ошибки и
+        отмена попадают в лог; прерванная догрузка продолжается при
+        следующем запуске с контрольной точки.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run(client))
+            self._task.add_done_callback(self._finished)
+        return self._task
+
+    @staticmethod
+    def _finished(task):
+        if task.cancelled():
+            logger.warning("⚠️ Догрузка истории прервана, продолжится при следующем запуске")
+        elif task.exception():
+            logger.error(f"❌ Ошибка догрузки истории: {task.exception()}")
+
+    async def run(self, client=None, concurrency=BACKFILL_CONCURRENCY):
+        """Догружает все незавершенные каналы; пока идет догрузка, повторный запуск ничего не делает"""
+        if self.running:
+            logger.info("📚 Догрузка истории уже выполняется")
+            return self.stats
+        self.running = True
+
+        try:
+            pending = await async_storage.read(get_pending_backfills)
+            gaps = await async_storage.read(get_pending_gaps)
+            pending += [
+                {
+                    'channel_url': gap['channel_url'],
+                    'gap': gap['gap'],
+                    'offset_id': gap['gap'][1] + 1,
+                    'priority': GAP_PRIORITY,
+                    'loaded': 0
+                }
+                for gap in gaps
+            ]
+            if not pending:
+                return self.stats
+            logger.info(f"📚 ДОГРУЗКА ИСТОРИИ: {len(pending) - len(gaps)} каналов, разрывов: {len(gaps)}")
+
+            counter = itertools.count()
+            queue = asyncio.PriorityQueue()
+            for state in pending:
+                queue.put_nowait((-state['priority'], next(counter), state))
+
+            async def worker():
+                while True:
+                    priority, _, state = await queue.get()
+                    try:
+                        if not await self._turn(client, state):
+                            # Обратно в очередь до task_done: join дождется и этого канала
+                            queue.put_nowait((priority, next(counter), state))
+                    finally:
+                        queue.task_done()
+
+            # Воркеры ждут работу, пока хоть один канал в очереди или в ходе:
+            # на миг опустевшая очередь их не завершает
+            workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+            try:
+                await queue.join()
+            finally:
+                for task in workers:
+                    task.cancel()
+                results = await asyncio.gather(*workers, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            logger.info(f"📚 Догрузка завершена: {self.stats['saved']} новых из {self.stats['loaded']} сообщений")
+            return self.stats
+        finally:
+            self.running = False
+
+    async def _turn(self, client, state):
+        """Один ход канала: priority страниц. Возвращает True, если канал закончен"""
+        channel_url = state['channel_url']
+        try:
+            if 'client' not in state:
+                # Без явного клиента канал догружает закрепленная за ним сессия
+                if client is None:
+                    state['account'], state['client'] = await session_pool.client_for(channel_url)
+                else:
+                    state['client'] = client
+                state['peer_id'] = (await resolve_channel(state['client'], channel_url))['peer_id']
+            client = state['client']
+
+            page = self._gap_page if 'gap' in state else self._page
+            for _ in range(state['priority']):
+                if await page(client, state):
+                    self.stats['finished'] += 1
+                    if 'gap' in state:
+                        logger.info(f"   ✅ {channel_url}: разрыв закрыт ({state['loaded']} сообщений)")
+                    else:
+                        logger.info(f"   ✅ {channel_url}: история догружена ({state['loaded']} сообщений)")
+                    return True
+            return False
+        except Exception as e:
+            if state.get('account'):
+                session_pool.report_failure(state['account'], e)
+            self.stats['errors'] += 1
+
+            # Устаревшую запись кэша удаляем, и следующий ход резолвит канал заново;
+            # FloodWait, таймауты и сбои сети кэш не трогают
+            if 'client' in state and is_stale_peer_error(e):
+                await async_storage.run(invalidate_peer, channel_url, client_account(state['client']))
+            if not state.get('reresolved') and is_stale_peer_error(e):
+                state['reresolved'] = True
+                for key in ('client', 'account', 'peer_id'):
+                    state.pop(key, None)
+                logger.warning(f"   ⚠️ {channel_url}: ошибка догрузки ({e}), повтор с новым резолвом")
+                return False
+
+            # Канал остается в очереди и продолжит со своей точки при следующем запуске
+            logger.error(f"   ❌ {channel_url}: ошибка догрузки ({e})")
+            return True
+
+    async def _page(self, client, state):
+        """Загружает одну страницу назад от контрольной точки и сохраняет ее"""
+        channel_url = state['channel_url']
+        offset_id = state['offset_id']
+        if offset_id is None:
+            # Начинаем сразу под водяным знаком, новые сообщения - забота парсера
+            offset_id = state['last_message_id'] + 1 if state['last_message_id'] else 0
+
+        messages = []
+        count = 0
+        oldest_id = offset_id
+        reached_until = False
+        async for message in rate_limiter.iter_history(
+            client, state['peer_id'], limit=BACKFILL_PAGE_SIZE, offset_id=offset_id, method='backfill'
+        ):
+            if state['until'] and message.date and format_date(message.date) < state['until']:
+                reached_until = True
+                break
+            count += 1
+            oldest_id = message.id
+            if message.text and message.text.strip():
+                messages.append(message)
+
+        done = reached_until or count < BACKFILL_PAGE_SIZE or oldest_id <= 1
+        saved = await async_storage.run(
+            save_backfill_page, _records(messages, channel_url), channel_url, oldest_id, count, done
+        )
+
+        if saved:
+            post_ingest.submit()
+
+        state['offset_id'] = oldest_id
+        state['loaded'] += count
+        self.stats['pages'] += 1
+        self.stats['loaded'] += count
+        self.stats['saved'] += len(saved)
+        logger.info(f"   📄 {channel_url}: до ID {oldest_id}, +{len(saved)} новых")
+        return done
+
+    async def _gap_page(self, client, state):
+        """Загружает одну страницу разрыва вниз от offset_id и сужает разрыв"""
+        channel_url = state['channel_url']
+        gap_from_id, _ = state['gap']
+
+        messages = []
+        count = 0
+        oldest_id = state['offset_id']
+        reached_start = False
+        async for message in rate_limiter.iter_history(
+            client, state['peer_id'], limit=BACKFILL_PAGE_SIZE, offset_id=state['offset_id'], method='backfill'
+        ):
+            if message.id < gap_from_id:
+                reached_start = True
+                break
+            count += 1
+            oldest_id = message.id
+            if message.text and message.text.strip():
+                messages.append(message)
+
+        done = reached_start or count < BACKFILL_PAGE_SIZE or oldest_id <= gap_from_id
+        saved = await async_storage.run(
+            save_gap_page, _records(messages, channel_url), channel_url, state['gap'], oldest_id, done
+        )
+
+        if saved:
+            post_ingest.submit()
+
+        state['gap'] = (gap_from_id, oldest_id - 1)
+        state['offset_id'] = oldest_id
+        state['loaded'] += count
+        self.stats['pages'] += 1
+        self.stats['loaded'] += count
+        self.stats['saved'] += len(saved)
+        logger.info(f"   🧩 {channel_url}: разрыв до ID {oldest_id}, +{len(saved)} новых")
+        return done
+
+def _records(messages, channel_url):
+    """Записи для базы; вся страница классифицируется одним вызовом"""
+    labels = marketplace_classifier.classify_many([message.text for message in messages], channel_url)
+    return [message_record(message, label) for message, label in zip(messages, labels)]
+
+# Глобальный экземпляр
+backfiller = Backfiller()
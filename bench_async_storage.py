@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк записи из asyncio-парсера с имитацией сетевой задержки Telegram.
+
+Запуск: python bench_async_storage.py [каналов] [сообщений_на_канал] [задержка_мс]
+
+Сравниваются три варианта обработки истории канала:
+  - синхронная запись каждого сообщения прямо в цикле;
+  - синхронная запись страницами прямо в цикле;
+  - асинхронный фасад: страницы уходят в поток-писатель, чтение продолжается.
+Кроме времени печатается суммарная задержка event loop - сколько времени
+loop был занят вместо обработки сети (в основном записью на диск).
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+import storage
+
+class FakeClient:
+    """Клиент с историей канала и задержкой на каждую страницу из 100 сообщений"""
+
+    def __init__(self, messages_per_channel, latency):
+        self.messages_per_channel = messages_per_channel
+        self.latency = latency
+
+    async def get_chat_history(self, chat_id, limit=0):
+        total = min(limit or self.messages_per_channel, self.messages_per_channel)
+        for i in range(total):
+            if i % 100 == 0:
+                await asyncio.sleep(self.latency)
+            text = f"{chat_id} {i} OZON: новые правила модерации карточек, комиссия и логистика"
+            yield SimpleNamespace(id=total - i, text=text)
+
+async def parse_per_message_sync(client, channel_url):
+    from database import save_message
+    async for message in client.get_chat_history(channel_url):
+        save_message(message.text, channel_url)
+
+async def parse_per_page_sync(client, channel_url):
+    from database import save_messages_batch
+    page = []
+    async for message in client.get_chat_history(channel_url):
+        page.append({'text': message.text, 'marketplace': 'OTHER'})
+        if len(page) >= 100:
+            save_messages_batch(page, channel_url)
+            page = []
+    if page:
+        save_messages_batch(page, channel_url)
+
+async def parse_async_facade(client, channel_url):
+    from async_storage import async_storage
+    writer = async_storage.channel_writer(channel_url)
+    async for message in client.get_chat_history(channel_url):
+        writer.add({'text': message.text, 'marketplace': 'OTHER'})
+    await writer.flush()
+
+async def measure_loop_lag(stop_event, interval=0.005):
+    """Измеряет суммарную задержку срабатывания event loop"""
+    total_lag = 0.0
+    while not stop_event.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        total_lag += max(0.0, time.perf_counter() - started - interval)
+    return total_lag
+
+async def run_variant(parse, channels, client):
+    stop_event = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop_event))
+
+    started = time.perf_counter()
+    for channel_url in channels:
+        await parse(client, channel_url)
+    elapsed = time.perf_counter() - started
+
+    stop_event.set()
+    total_lag = await lag_task
+    return elapsed, total_lag
+
+def run(name, parse, channels, client, total):
+    from async_storage import async_storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, 'bench.db'))
+        from database import init_db
+        init_db()
+
+        elapsed, total_lag = asyncio.run(run_variant(parse, channels, client))
+        async_storage.stop()
+        storage.pool.close_all()
+
+    print(f"{name:<30} {elapsed:7.2f} с  {total / elapsed:9.0f} сообщ/с  "
+          f"блокировка loop {total_lag * 1000:7.0f} мс")
+
+def main():
+    channel_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    per_channel = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    latency = (int(sys.argv[3]) if len(sys.argv) > 3 else 50) / 1000
+
+    channels = [f"https://t.me/bench_channel_{i}" for i in range(channel_count)]
+    client = FakeClient(per_channel, latency)
+    total = channel_count * per_channel
+
+    print(f"📊 {channel_count} каналов x {per_channel} сообщений, задержка {latency * 1000:.0f} мс на страницу")
+    run("синхронно по сообщению", parse_per_message_sync, channels, client, total)
+    run("синхронно по странице", parse_per_page_sync, channels, client, total)
+    run("асинхронный фасад", parse_async_facade, channels, client, total)
+
+if __name__ == "__main__":
+    main()
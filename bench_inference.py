@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк клиента модели на локальной заглушке (inference_server.py).
+
+Запуск: python bench_inference.py [сообщений] [задержка_запроса_мс] [каналов]
+
+Сравниваются:
+  - один запрос к модели на сообщение, по очереди;
+  - InferenceClient: каналы одновременно спрашивают модель, запросы
+    собираются в пачки, одновременно идет не больше INFERENCE_MAX_IN_FLIGHT;
+  - повторный прогон тех же сообщений (ответы из кэша);
+  - заглушка, падающая на каждом втором запросе (откат на локальные правила).
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+import storage
+from bench_summarizer import generate_messages
+
+async def ask_channels(client, messages, channels):
+    """Каналы параллельно, сообщения внутри канала - по одному, как в конвейере"""
+    async def channel(part):
+        return await asyncio.gather(*(client.apredict(text) for text in part))
+
+    parts = [messages[i::channels] for i in range(channels)]
+    return await asyncio.gather(*(channel(part) for part in parts))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    channels = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, 'bench.db'))
+        from database import init_db
+        init_db()
+
+        from inference_server import start_server
+        from inference_client import InferenceClient, InferenceCache, HTTPBackend
+        from ai_processor import parse_marketplace, MARKETPLACE_LABELS
+        from marketplace_classifier import marketplace_classifier
+
+        messages = [f"{text} #{i}" for i, text in enumerate(generate_messages(count))]
+        server, model, url = start_server(delay=delay)
+        backend = HTTPBackend(url, timeout=5)
+        parameters = {'candidate_labels': MARKETPLACE_LABELS}
+        print(f"📊 Модель: {count} сообщений, {channels} каналов, задержка запроса {delay * 1000:.0f} мс")
+
+        # Один запрос на сообщение: для наглядности только часть сообщений
+        sample = messages[:min(count, 100)]
+        started = time.perf_counter()
+        for text in sample:
+            parse_marketplace(backend.predict([text], parameters)[0])
+        per_message = (time.perf_counter() - started) / len(sample)
+        print(f"по одному        ~{per_message * count:7.2f} с  (оценка по {len(sample)} сообщениям)")
+
+        client = InferenceClient(
+            'bench', marketplace_classifier.classify_many, parse_marketplace, backend=backend,
+            parameters=parameters, timeout=5, cache=InferenceCache('bench')
+        )
+        for title in ("пачками", "из кэша"):
+            model.stats.update(requests=0, texts=0, max_in_flight=0)
+            started = time.perf_counter()
+            asyncio.run(ask_channels(client, messages, channels))
+            elapsed = time.perf_counter() - started
+            print(
+                f"{title:<16} {elapsed:7.2f} с  запросов к модели {model.stats['requests']}, "
+                f"одновременно до {model.stats['max_in_flight']}"
+            )
+        print(f"   {client.get_stats()}")
+
+        server.shutdown()
+        server, model, url = start_server(delay=delay, fail_rate=0.5)
+        failing = InferenceClient(
+            'bench_failing', marketplace_classifier.classify_many, parse_marketplace,
+            backend=HTTPBackend(url, timeout=5), parameters=parameters, timeout=5,
+            cache=InferenceCache('bench_failing')
+        )
+        started = time.perf_counter()
+        asyncio.run(ask_channels(failing, messages, channels))
+        elapsed = time.perf_counter() - started
+        print(f"со сбоями        {elapsed:7.2f} с  {failing.get_stats()}")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк записи сообщений: соединение на вызов против пула соединений.
+
+Запуск: python bench_storage.py [количество_сообщений] [лимит_для_старой_схемы]
+
+Чтобы полный просмотр таблицы в старом message_exists не скрывал
+стоимость соединений, старой схеме добавляется временный индекс
+по (channel_url, message_text).
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+import storage
+
+CHANNELS = [
+    "https://t.me/ozonmarketplace",
+    "https://t.me/wbsellerofficial",
+    "https://t.me/ozon_adv",
+]
+
+WORDS = [
+    "озон", "вб", "комиссия", "логистика", "склад", "карточка", "модерация",
+    "возврат", "продавец", "маркировка", "акция", "скидка", "доставка",
+    "товар", "отзыв", "рейтинг", "тариф", "поставка", "заказ", "выкуп",
+]
+
+def generate_messages(count, seed=42):
+    """Генерирует синтетические сообщения"""
+    rnd = random.Random(seed)
+    messages = []
+    for i in range(count):
+        text = f"{i} " + " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(8, 40)))
+        messages.append((text, CHANNELS[i % len(CHANNELS)]))
+    return messages
+
+def legacy_ingest(db_path, messages):
+    """Старая схема: новое соединение на каждую проверку и вставку"""
+    def message_exists(message_text, channel_url):
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM messages
+            WHERE message_text = ? AND channel_url = ?
+        ''', (message_text, channel_url))
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count > 0
+
+    def save_message(message_text, channel_url, marketplace='OTHER'):
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO messages (message_text, channel_url, marketplace)
+            VALUES (?, ?, ?)
+        ''', (message_text, channel_url, marketplace))
+        conn.commit()
+        conn.close()
+
+    for message_text, channel_url in messages:
+        if not message_exists(message_text, channel_url):
+            save_message(message_text, channel_url)
+
+def pooled_ingest(db_path, messages):
+    """Новая схема: функции database.py поверх пула соединений"""
+    storage.configure(db_path)
+    from database import save_message
+
+    for message_text, channel_url in messages:
+        save_message(message_text, channel_url)
+
+def batched_ingest(db_path, messages, page_size=100):
+    """Пакетная запись: страница канала одной транзакцией"""
+    storage.configure(db_path)
+    from database import save_messages_batch
+
+    for start in range(0, len(messages), page_size):
+        pages = {}
+        for message_text, channel_url in messages[start:start + page_size]:
+            pages.setdefault(channel_url, []).append({'text': message_text, 'marketplace': 'OTHER'})
+        for channel_url, page in pages.items():
+            save_messages_batch(page, channel_url)
+
+def create_schema(db_path):
+    """Создает схему через init_db"""
+    storage.configure(db_path)
+    from database import init_db
+    init_db()
+    storage.get_connection().execute(
+        'CREATE INDEX bench_lookup ON messages(channel_url, message_text)'
+    )
+    storage.pool.close_all()
+
+def run(name, ingest, messages):
+    """Запускает один вариант на чистой базе и печатает результат"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        create_schema(db_path)
+
+        started = time.perf_counter()
+        ingest(db_path, messages)
+        elapsed = time.perf_counter() - started
+        storage.pool.close_all()
+
+    rate = len(messages) / elapsed if elapsed else 0
+    print(f"{name:<30} {len(messages):>8} сообщений  {elapsed:8.2f} с  {rate:10.0f} сообщ/с")
+    return rate
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    legacy_limit = int(sys.argv[2]) if len(sys.argv) > 2 else count
+
+    messages = generate_messages(count)
+    print(f"📊 Синтетический прием: {count} сообщений")
+
+    before = run("до: соединение на вызов", legacy_ingest, messages[:legacy_limit])
+    after = run("после: пул + WAL + хеш-индекс", pooled_ingest, messages)
+    batched = run("после: пакеты по 100", batched_ingest, messages)
+
+    if before:
+        print(f"⚡ Ускорение: x{after / before:.1f}, пакетами: x{batched / before:.1f}")
+
+if __name__ == "__main__":
+    main()
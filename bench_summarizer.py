@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк реферирования: сколько занимает structure_content на пачке сообщений.
+
+Запуск: python bench_summarizer.py [количество_сообщений] [повторов]
+
+Первый прогон идет с пустым кэшем стеммера, остальные - с заполненным,
+как в работающем процессе. Отдельно показано время каждого этапа.
+"""
+import sys
+import time
+import random
+
+from marketplace_classifier import marketplace_classifier
+from summarizer import summarizer, extract_sentences
+from text_processing import stem
+
+SUBJECTS = [
+    "OZON", "Wildberries", "ВБ", "Озон", "Яндекс Маркет", "Маркетплейс", "Площадка", "Склад",
+]
+VERBS = [
+    "повышает", "снижает", "меняет", "вводит", "отменяет", "запускает", "тестирует", "обновляет",
+]
+OBJECTS = [
+    "комиссию для электроники", "тарифы на логистику", "правила модерации карточек",
+    "штрафы за отмену заказов", "сроки выплат продавцам", "маркировку одежды",
+    "приемку на складах", "условия возвратов", "рекламные ставки", "рейтинг продавцов",
+]
+TAILS = [
+    "с 1 марта", "для всех категорий", "в тестовом режиме", "обязательно проверьте настройки",
+    "рекомендуем пересчитать цены", "изменения вступают в силу через неделю", "по данным поддержки",
+]
+
+def generate_messages(count, seed=42):
+    """Синтетические посты из 1-5 предложений"""
+    rnd = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        sentences = [
+            f"{rnd.choice(SUBJECTS)} {rnd.choice(VERBS)} {rnd.choice(OBJECTS)} {rnd.choice(TAILS)}."
+            for _ in range(rnd.randint(1, 5))
+        ]
+        messages.append(" ".join(sentences))
+    return messages
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    messages = generate_messages(count)
+    labels = marketplace_classifier.classify_many(messages)
+    print(f"📊 Реферирование: {count} сообщений")
+
+    for attempt in range(repeats):
+        if attempt == 0:
+            stem.cache_clear()
+
+        (sentences, tokens, sentence_labels), parse_time = timed(extract_sentences, messages, labels)
+        matrix, tfidf_time = timed(summarizer._tfidf, tokens)
+        sections, total_time = timed(summarizer.summarize, messages, labels)
+
+        kind = "холодный кэш" if attempt == 0 else "теплый кэш"
+        print(
+            f"{kind:<14} всего {total_time * 1000:7.1f} мс  "
+            f"(разбор {parse_time * 1000:6.1f} мс, TF-IDF {tfidf_time * 1000:6.1f} мс, "
+            f"ранжирование {(total_time - parse_time - tfidf_time) * 1000:6.1f} мс)  "
+            f"{len(sentences)} предложений, {matrix.shape[1]} основ"
+        )
+
+    for label, section in sections.items():
+        print(f"\n{label}:")
+        for point in section['key_points']:
+            print(f"   • {point}")
+        for point in section['important']:
+            print(f"   ▪️ {point}")
+        for point in section['tips']:
+            print(f"   ▫️ {point}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк трендов: скорость обновления эскизов и запроса растущих термов.
+
+Запуск: python bench_trends.py [сообщений_в_день] [дней]
+
+Синтетические сообщения раскладываются по дням; в последнюю неделю
+к части сообщений добавляется новая тема, ее и должен найти запрос.
+Память эскизов не зависит от числа сообщений - она печатается в конце.
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+import storage
+from bench_summarizer import generate_messages
+
+RISING = "Озон вводит платную маркировку остатков для продавцов."
+
+def main():
+    per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 35
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, 'bench.db'))
+        from database import init_db, save_messages_batch
+        init_db()
+
+        from trends import trend_detector
+        from marketplace_classifier import marketplace_classifier
+
+        rnd = random.Random(7)
+        now = datetime.utcnow()
+        texts = generate_messages(per_day * days)
+        print(f"📊 Тренды: {per_day} сообщений в день, {days} дней")
+
+        update_time = 0.0
+        for day in range(days):
+            moment = now - timedelta(days=days - 1 - day, hours=1)
+            page = []
+            for i, text in enumerate(texts[day * per_day:(day + 1) * per_day]):
+                if days - day <= 7 and rnd.random() < 0.05:
+                    text = f"{text} {RISING}"
+                page.append({
+                    'text': f"{text} #{day}-{i}",
+                    'marketplace': marketplace_classifier.classify(text),
+                    'date': moment.strftime('%Y-%m-%d %H:%M:%S')
+                })
+            save_messages_batch(page, 'https://t.me/bench')
+
+            started = time.perf_counter()
+            trend_detector.update()
+            update_time += time.perf_counter() - started
+
+        total = per_day * days
+        print(f"обновление     {update_time:7.2f} с  ({total / update_time:.0f} сообщений/с)")
+
+        trend_detector.top_rising()
+        runs = 200
+        started = time.perf_counter()
+        for _ in range(runs):
+            rising = trend_detector.top_rising()
+        print(f"запрос         {(time.perf_counter() - started) / runs * 1000:7.2f} мс")
+
+        for marketplace, items in rising.items():
+            print(f"   {marketplace}: " + ', '.join(f"{item['term']} x{item['growth']}" for item in items))
+        print(f"   {trend_detector.get_stats()}")
+
+if __name__ == "__main__":
+    main()
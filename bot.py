@@ -7,6 +7,7 @@ from database import init_db, get_last_messages, save_post
 from parser import TelegramParser
 from ai_processor import AIProcessor
 from post_formatter import PostFormatter
+from rate_limiter import rate_limiter
 from config import API_ID, API_HASH
 
 async def main():
@@ -68,22 +69,33 @@ async def create_post_with_real_parsing(parsing_results, ai_processor, post_form
         # Получаем тексты сообщений для AI обработки
         source_texts = []
         discussion_texts = []
+        source_labels = []
+        discussion_labels = []
+        source_clusters = []
+        discussion_clusters = []
         
         for result in parsing_results['results']:
             if result['new_messages'] > 0:
                 messages = result.get('messages', [])
-                for msg in messages:
+                for msg, label, cluster in zip(messages, result['labels'], result['clusters']):
                     if result['type'] == 'main':
                         source_texts.append(msg)
+                        source_labels.append(label)
+                        source_clusters.append(cluster)
                     else:
                         discussion_texts.append(msg)
+                        discussion_labels.append(label)
+                        discussion_clusters.append(cluster)
         
         print(f"📥 РЕЗУЛЬТАТЫ ПАРСИНГА:")
         print(f"   Основные каналы: {len(source_texts)} сообщений")
         print(f"   Обсуждения: {len(discussion_texts)} сообщений")
         
         # Структурируем контент через AI
-        structured_content = ai_processor.structure_content(source_texts, discussion_texts)
+        structured_content = ai_processor.structure_content(
+            source_texts, discussion_texts,
+            source_labels + discussion_labels, source_clusters + discussion_clusters
+        )
         
         # Форматируем пост
         post_content = post_formatter.format_structured_post(structured_content)
@@ -103,7 +115,10 @@ async def create_fallback_post(ai_processor, post_formatter):
     
     if recent_messages:
         texts = [msg['text'] for msg in recent_messages if msg['text']]
-        structured_content = ai_processor.structure_content(texts, [])
+        # Метки сохранены вместе с сообщениями, повторно не классифицируем
+        labels = [msg['marketplace'] or 'OTHER' for msg in recent_messages if msg['text']]
+        clusters = [msg['cluster_id'] for msg in recent_messages if msg['text']]
+        structured_content = ai_processor.structure_content(texts, [], labels, clusters)
     else:
         # Полностью резервный контент
         structured_content = {
@@ -141,7 +156,7 @@ async def send_post(client, post_content):
         if len(post_content) > max_length:
             post_content = post_content[:max_length-100] + "\n\n... (пост сокращен)"
         
-        await client.send_message("me", post_content)
+        await rate_limiter.call('send', client.send_message, "me", post_content)
         print("✅ Пост успешно отправлен в 'Сохраненные сообщения'!")
         print("=" * 40)
         print("📝 СОДЕРЖАНИЕ ПОСТА:")
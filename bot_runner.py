@@ -5,6 +5,8 @@ from telegram_manager import telegram_manager
 from ai_processor import AIProcessor
 from post_formatter import PostFormatter
 from database import get_last_messages, save_post
+from topic_clustering import build_topic_digest
+from config import TOPIC_DIGEST_ENABLED
 
 logger = logging.getLogger(__name__)
 
@@ -27,15 +29,25 @@ async def run_bot():
         ai_processor = AIProcessor()
         post_formatter = PostFormatter()
         
-        if all_messages:
+        topic_digest = build_topic_digest() if TOPIC_DIGEST_ENABLED else None
+        
+        if topic_digest:
+            logger.info(f"   🗂️ Дайджест по темам: {len(topic_digest['sections'])} разделов")
+            structured_content = topic_digest
+            post_type = "ДАЙДЖЕСТ ПО ТЕМАМ"
+        elif all_messages:
             logger.info(f"   📊 Использую {len(all_messages)} реальных сообщений")
-            structured_content = ai_processor.structure_content(all_messages, [])
+            structured_content = ai_processor.structure_content(all_messages, [], parsing_results['labels'], parsing_results['clusters'])
             post_type = "РЕАЛЬНЫЕ ДАННЫЕ"
         else:
             logger.info("   🔄 Использую резервный контент")
             recent_messages = get_last_messages(limit=8)
+            labels = clusters = None
             if recent_messages:
                 texts = [msg['text'] for msg in recent_messages if msg['text']]
+                # Метки сохранены вместе с сообщениями, повторно не классифицируем
+                labels = [msg['marketplace'] or 'OTHER' for msg in recent_messages if msg['text']]
+                clusters = [msg['cluster_id'] for msg in recent_messages if msg['text']]
                 logger.info(f"   📁 Из базы: {len(texts)} сообщений")
             else:
                 texts = [
@@ -47,7 +59,7 @@ async def run_bot():
                 ]
                 logger.info("   📝 Тестовые данные")
             
-            structured_content = ai_processor.structure_content(texts, [])
+            structured_content = ai_processor.structure_content(texts, [], labels, clusters)
             post_type = "РЕЗЕРВНЫЕ ДАННЫЕ"
         
         post_content = post_formatter.format_structured_post(structured_content)
@@ -1,14 +1,20 @@
 import asyncio
 import logging
 from auth_system import auth_system
-from pyrogram.errors import ChannelInvalid, ChannelPrivate, UsernameNotOccupied
-from database import get_last_messages, save_post, save_message, message_exists
+from database import get_last_messages, save_post
 from ai_processor import AIProcessor
 from post_formatter import PostFormatter
-from config import TARGET_CHANNEL, SOURCE_CHANNELS
+from async_storage import async_storage
+from pipeline import ingest_channels, registry_tasks
+from rate_limiter import rate_limiter, format_rate_stats
+from session_pool import session_pool, format_session_stats
+from config import TARGET_CHANNEL
 
 logger = logging.getLogger(__name__)
 
+# Сколько сообщений брать с канала при первом запуске
+FIRST_RUN_LIMIT = 25
+
 async def run_bot_fixed():
     """Исправленная версия бота с гарантированной пользовательской сессией"""
     logger.info("=" * 60)
@@ -16,55 +22,55 @@ async def run_bot_fixed():
     logger.info("=" * 60)
     
     try:
-        # 1. Получаем пользовательского клиента
-        logger.info("1. 🔐 ПОЛУЧЕНИЕ ПОЛЬЗОВАТЕЛЬСКОГО КЛИЕНТА...")
-        user_client = await auth_system.get_user_client()
-        
-        # 2. Парсинг каналов
-        logger.info("2. 🔍 ЗАПУСК ПАРСИНГА...")
-        parsing_results = await parse_channels_guaranteed(user_client)
+        # 1. Парсинг каналов: каналы делятся между пользовательскими сессиями
+        logger.info("1. 🔍 ЗАПУСК ПАРСИНГА...")
+        parsing_results = await parse_channels_guaranteed()
         
         all_parsed_messages = parsing_results['messages']
         channel_stats = parsing_results['stats']
         
-        # 3. Создание поста
+        # 2. Создание поста
         ai_processor = AIProcessor()
         post_formatter = PostFormatter()
         
         if all_parsed_messages:
-            logger.info(f"3. 🧠 СОЗДАНИЕ ПОСТА НА ОСНОВЕ {len(all_parsed_messages)} РЕАЛЬНЫХ СООБЩЕНИЙ")
-            structured_content = ai_processor.structure_content(all_parsed_messages, [])
+            logger.info(f"2. 🧠 СОЗДАНИЕ ПОСТА НА ОСНОВЕ {len(all_parsed_messages)} РЕАЛЬНЫХ СООБЩЕНИЙ")
+            structured_content = ai_processor.structure_content(all_parsed_messages, [], parsing_results['labels'], parsing_results['clusters'])
             post_type = "РЕАЛЬНЫЕ ДАННЫЕ"
         else:
-            logger.info("3. 🔄 ИСПОЛЬЗУЮ РЕЗЕРВНЫЙ КОНТЕНТ")
+            logger.info("2. 🔄 ИСПОЛЬЗУЮ РЕЗЕРВНЫЙ КОНТЕНТ")
             recent_messages = get_last_messages(limit=10)
+            labels = clusters = None
             if recent_messages:
                 texts = [msg['text'] for msg in recent_messages if msg['text']]
+                # Метки сохранены вместе с сообщениями, повторно не классифицируем
+                labels = [msg['marketplace'] or 'OTHER' for msg in recent_messages if msg['text']]
+                clusters = [msg['cluster_id'] for msg in recent_messages if msg['text']]
                 logger.info(f"   📊 Использую {len(texts)} сообщений из базы данных")
             else:
                 texts = get_fallback_messages()
                 logger.info("   📝 Использую тестовые данные")
             
-            structured_content = ai_processor.structure_content(texts, [])
+            structured_content = ai_processor.structure_content(texts, [], labels, clusters)
             post_type = "РЕЗЕРВНЫЕ ДАННЫЕ"
         
         post_content = post_formatter.format_structured_post(structured_content)
         save_post(post_content)
         
-        # 4. Отправка поста
-        logger.info("4. 📤 ОТПРАВКА ПОСТА...")
+        # 3. Отправка поста
+        logger.info("3. 📤 ОТПРАВКА ПОСТА...")
         bot_client = await auth_system.get_bot_client()
         if bot_client:
             max_length = 4096
             if len(post_content) > max_length:
                 post_content = post_content[:max_length-100] + "\n\n... (пост сокращен)"
             
-            await bot_client.send_message(TARGET_CHANNEL, post_content)
+            await rate_limiter.call('send', bot_client.send_message, TARGET_CHANNEL, post_content)
             logger.info(f"✅ ПОСТ ОПУБЛИКОВАН В {TARGET_CHANNEL}")
         else:
             logger.warning("⚠️ Бот не доступен для отправки")
         
-        # 5. Статистика
+        # 4. Статистика
         stats_message = generate_stats_message(channel_stats, len(all_parsed_messages), post_type)
         logger.info(f"🎯 ИТОГ: {stats_message}")
         
@@ -84,71 +90,31 @@ async def run_bot_fixed():
         logger.error(f"🔍 ДЕТАЛИ: {traceback.format_exc()}")
         return f"❌ Ошибка: {str(e)}"
 
-async def parse_channels_guaranteed(user_client):
-    """Гарантированный парсинг с пользовательской сессией"""
-    all_messages = []
-    channel_stats = {}
-    
-    logger.info(f"📡 ПАРСИНГ {len(SOURCE_CHANNELS)} КАНАЛОВ:")
+async def parse_channels_guaranteed(user_client=None):
+    """Гарантированный парсинг с пользовательскими сессиями.
+
+    Без user_client каналы делятся между сессиями USER_SESSIONS.
+    """
+    tasks = await async_storage.read(registry_tasks, FIRST_RUN_LIMIT)
+    logger.info(f"📡 ПАРСИНГ {len(tasks)} КАНАЛОВ:")
     logger.info("=" * 50)
     
-    for i, channel_url in enumerate(SOURCE_CHANNELS, 1):
-        channel_messages = []
-        try:
-            # Извлекаем идентификатор канала
-            if channel_url.startswith('https://t.me/'):
-                channel_id = channel_url.replace('https://t.me/', '')
-            elif channel_url.startswith('@'):
-                channel_id = channel_url[1:]
-            else:
-                channel_id = channel_url
-            
-            logger.info(f"   {i}. 🔍 Парсим: {channel_id}")
-            
-            # Получаем канал
-            chat = await user_client.get_chat(channel_id)
-            logger.info(f"      📝 Название: {chat.title}")
-            
-            # Парсим сообщения (гарантированно работает с пользователем)
-            messages_count = 0
-            new_messages_count = 0
-            
-            async for message in user_client.get_chat_history(chat.id, limit=25):
-                if message.text and message.text.strip():
-                    message_text = message.text.strip()
-                    messages_count += 1
-                    
-                    if not message_exists(message_text, channel_url):
-                        save_message(message_text, channel_url, 'OTHER')
-                        channel_messages.append(message_text)
-                        new_messages_count += 1
-            
-            all_messages.extend(channel_messages)
-            
-            channel_stats[channel_id] = {
-                'title': chat.title,
-                'total_messages': messages_count,
-                'new_messages': new_messages_count,
-                'success': True
-            }
-            
-            if new_messages_count > 0:
-                logger.info(f"      ✅ Найдено {new_messages_count} новых сообщений")
-                for j, msg in enumerate(channel_messages[:2], 1):
-                    logger.info(f"         📨 {j}. {msg[:80]}...")
-            else:
-                logger.info(f"      ⚠️ Новых сообщений: 0")
-            
-        except Exception as e:
-            logger.error(f"      ❌ Ошибка: {str(e)}")
-            channel_stats[channel_url] = {'success': False, 'error': str(e)}
+    # Каналы идут через общий конвейер, результаты в порядке реестра каналов
+    summary = await ingest_channels(user_client, tasks)
+    
+    channel_stats = {}
+    for result in summary['stats']:
+        key = result['channel'] if result['success'] else result['channel_url']
+        channel_stats[key] = result
     
     logger.info("=" * 50)
-    logger.info(f"📊 ВСЕГО НАЙДЕНО: {len(all_messages)} новых сообщений")
+    logger.info(f"📊 ВСЕГО НАЙДЕНО: {len(summary['messages'])} новых сообщений")
     
     return {
-        'messages': all_messages,
-        'stats': channel_stats
+        'messages': summary['messages'],
+        'stats': channel_stats,
+        'labels': summary['labels'],
+        'clusters': summary['clusters']
     }
 
 def generate_stats_message(channel_stats, total_messages, post_type):
@@ -171,6 +137,14 @@ def generate_stats_message(channel_stats, total_messages, post_type):
     
     stats_lines.append(f"УСПЕШНЫХ КАНАЛОВ: {successful_channels}/{len(channel_stats)}")
     
+    rate_lines = format_rate_stats(rate_limiter.get_stats())
+    if rate_lines:
+        stats_lines.append("ЛИМИТЫ TELEGRAM:")
+        stats_lines.extend(rate_lines)
+    
+    stats_lines.append("АККАУНТЫ:")
+    stats_lines.extend(format_session_stats(session_pool.get_stats()))
+    
     return "\n".join(stats_lines)
 
 def get_fallback_messages():
@@ -0,0 +1,31 @@
+import asyncio
+import logging
+from config import PARSER_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+async def gather_channels(channels, worker, on_error, limit=PARSER_CONCURRENCY):
+    """Обрабатывает каналы параллельно, не более limit одновременно.
+
+    worker(channel) - корутина обработки одного канала,
+    on_error(channel, error) - результат для канала, который упал.
+    Общего таймаута на канал нет: канал, который ждет FloodWait или
+    места в очереди конвейера, не обрывается, а зависший запрос
+    прерывает таймаут rate_limiter. Результаты возвращаются в порядке
+    channels, поэтому итоговая статистика не зависит от того, кто
+    закончил первым.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(channel):
+        async with semaphore:
+            try:
+                return await worker(channel)
+            except TimeoutError as e:
+                logger.error(f"   ⏱️ {channel}: {e}")
+                return on_error(channel, str(e))
+            except Exception as e:
+                logger.error(f"   ❌ {channel}: {e}")
+                return on_error(channel, str(e))
+
+    return await asyncio.gather(*(run(channel) for channel in channels))
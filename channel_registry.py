@@ -0,0 +1,186 @@
+import logging
+from datetime import datetime, timedelta
+from storage import get_connection, transaction
+from config import (
+    SOURCE_CHANNELS, MAIN_CHANNELS_LIMIT, DISCUSSION_CHANNELS_LIMIT,
+    POLL_TARGET_MESSAGES, POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_RATE_SMOOTHING
+)
+
+logger = logging.getLogger(__name__)
+
+# Лимит загрузки по умолчанию для каждой роли канала
+ROLE_LIMITS = {'main': MAIN_CHANNELS_LIMIT, 'discussion': DISCUSSION_CHANNELS_LIMIT}
+
+# Сколько первых каналов начального списка считаются основными
+MAIN_SEED_CHANNELS = 3
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def init_channel_registry():
+    """Инициализирует реестр каналов и переносит в него SOURCE_CHANNELS"""
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS channels (
+                channel_url TEXT PRIMARY KEY,
+                role TEXT NOT NULL DEFAULT 'main',
+                priority INTEGER NOT NULL DEFAULT 1,
+                fetch_limit INTEGER NOT NULL,
+                enabled INTEGER NOT NULL DEFAULT 1,
+                post_rate REAL,
+                poll_interval REAL,
+                last_polled_at TIMESTAMP,
+                next_poll_at TIMESTAMP,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_channels_next_poll
+            ON channels (enabled, next_poll_at)
+        ''')
+
+        # Уже известные каналы не трогаем: их настройки могли поменять
+        for i, channel_url in enumerate(SOURCE_CHANNELS):
+            role = 'main' if i < MAIN_SEED_CHANNELS else 'discussion'
+            conn.execute('''
+                INSERT OR IGNORE INTO channels (channel_url, role, fetch_limit)
+                VALUES (?, ?, ?)
+            ''', (channel_url, role, ROLE_LIMITS[role]))
+
+    logger.info("✅ Реестр каналов инициализирован")
+
+def add_channel(channel_url, role='main', priority=1, fetch_limit=None):
+    """Добавляет канал в реестр или меняет настройки уже добавленного"""
+    if role not in ROLE_LIMITS:
+        raise ValueError(f"Неизвестная роль канала: {role}")
+
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO channels (channel_url, role, priority, fetch_limit)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(channel_url) DO UPDATE SET
+                role = excluded.role,
+                priority = excluded.priority,
+                fetch_limit = excluded.fetch_limit,
+                enabled = 1
+        ''', (channel_url, role, max(1, priority), fetch_limit or ROLE_LIMITS[role]))
+
+def remove_channel(channel_url):
+    """Отключает канал; накопленная статистика опросов сохраняется"""
+    with transaction() as conn:
+        conn.execute('UPDATE channels SET enabled = 0 WHERE channel_url = ?', (channel_url,))
+
+def get_channels(due_only=False, now=None):
+    """Включенные каналы реестра, сначала более приоритетные.
+
+    due_only - только каналы, которым пора на опрос (ни разу не
+    опрошенные тоже считаются такими).
+    """
+    query = '''
+        SELECT channel_url, role, priority, fetch_limit, post_rate, poll_interval,
+               last_polled_at, next_poll_at
+        FROM channels
+        WHERE enabled = 1
+    '''
+    params = ()
+    if due_only:
+        query += ' AND (next_poll_at IS NULL OR next_poll_at <= ?)'
+        params = ((now or datetime.utcnow()).strftime(TIME_FORMAT),)
+    query += ' ORDER BY priority DESC, next_poll_at, rowid'
+
+    return [
+        {
+            'channel_url': row[0],
+            'role': row[1],
+            'priority': row[2],
+            'fetch_limit': row[3],
+            'post_rate': row[4],
+            'poll_interval': row[5],
+            'last_polled_at': row[6],
+            'next_poll_at': row[7]
+        }
+        for row in get_connection().execute(query, params).fetchall()
+    ]
+
+def get_channel_urls():
+    """URL включенных каналов в порядке приоритета"""
+    return [channel['channel_url'] for channel in get_channels()]
+
+def poll_interval(post_rate, priority=1):
+    """Интервал опроса в секундах по темпу публикаций (сообщений в час).
+
+    Канал опрашивается примерно тогда, когда в нем набирается
+    POLL_TARGET_MESSAGES сообщений; приоритет во столько же раз сокращает
+    интервал. Тихие каналы упираются в POLL_MAX_INTERVAL.
+    """
+    if not post_rate:
+        return POLL_MAX_INTERVAL
+    interval = POLL_TARGET_MESSAGES / post_rate * 3600 / max(1, priority)
+    return min(max(interval, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+
+def _next_poll(conn, channel_url, fetched, saturated, error, now):
+    row = conn.execute('''
+        SELECT priority, post_rate, poll_interval, last_polled_at
+        FROM channels WHERE channel_url = ?
+    ''', (channel_url,)).fetchone()
+    if not row:
+        return None
+
+    priority, post_rate, interval, last_polled_at = row
+    if error:
+        # Недоступный канал опрашиваем все реже
+        interval = min(max((interval or POLL_MIN_INTERVAL) * 2, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+    elif last_polled_at is None:
+        # Первый опрос забирает накопленную историю, а не темп канала:
+        # темп оценим по следующему опросу
+        interval = POLL_MIN_INTERVAL
+    else:
+        elapsed = (now - datetime.strptime(last_polled_at, TIME_FORMAT)).total_seconds()
+        observed = fetched / max(elapsed / 3600, 1 / 60)
+        if post_rate is None:
+            post_rate = observed
+        else:
+            post_rate = POLL_RATE_SMOOTHING * observed + (1 - POLL_RATE_SMOOTHING) * post_rate
+        # Уперлись в лимит - сообщений больше, чем забрали, не ждем
+        interval = POLL_MIN_INTERVAL if saturated else poll_interval(post_rate, priority)
+
+    return post_rate, interval
+
+def record_poll(channel_url, fetched, saturated=False, error=None, now=None):
+    """Учитывает опрос канала и назначает следующий.
+
+    fetched - сколько новых сообщений пришло с прошлого опроса,
+    saturated - загрузка уперлась в лимит. Темп публикаций сглаживается
+    экспоненциально, чтобы один всплеск не сбивал расписание.
+    """
+    now = now or datetime.utcnow()
+    with transaction() as conn:
+        update = _next_poll(conn, channel_url, fetched, saturated, error, now)
+        if update is None:
+            return None
+
+        post_rate, interval = update
+        next_poll_at = now + timedelta(seconds=interval)
+        conn.execute('''
+            UPDATE channels SET
+                post_rate = ?,
+                poll_interval = ?,
+                last_polled_at = CASE WHEN ? IS NULL THEN ? ELSE last_polled_at END,
+                next_poll_at = ?
+            WHERE channel_url = ?
+        ''', (post_rate, interval, error, now.strftime(TIME_FORMAT),
+              next_poll_at.strftime(TIME_FORMAT), channel_url))
+
+    return next_poll_at
+
+def record_polls(results, now=None):
+    """Учитывает опросы по итогам конвейера (результаты ingest_channels)"""
+    now = now or datetime.utcnow()
+    with transaction():
+        for result in results:
+            record_poll(
+                result['channel_url'],
+                result['total_messages'],
+                result.get('gap') is not None,
+                result['error'],
+                now
+            )
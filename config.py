@@ -9,6 +9,160 @@ API_HASH = os.getenv('API_HASH', '')
 BOT_TOKEN = os.getenv('BOT_TOKEN', '')
 TARGET_CHANNEL = os.getenv('TARGET_CHANNEL', '@mar_factor')
 
+# База данных
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'telegram_parser.db')
+
+# Инкрементальный парсинг: максимум новых сообщений за проход,
+# остальное записывается как разрыв в истории
+INCREMENTAL_MAX_MESSAGES = int(os.getenv('INCREMENTAL_MAX_MESSAGES', 200))
+
+# Параллельный парсинг: сколько каналов одновременно и таймаут одного запроса
+# к Telegram (сек); паузы FloodWait и ожидание очередей конвейера в него не входят
+PARSER_CONCURRENCY = int(os.getenv('PARSER_CONCURRENCY', 5))
+CHANNEL_TIMEOUT = float(os.getenv('CHANNEL_TIMEOUT', 60))
+
+# Лимиты запросов к Telegram по классам методов: (запросов в секунду, пачка)
+RATE_LIMITS = {
+    'resolve': (float(os.getenv('RATE_LIMIT_RESOLVE', 0.5)), 3),
+    'history': (float(os.getenv('RATE_LIMIT_HISTORY', 3)), 10),
+    'send': (float(os.getenv('RATE_LIMIT_SEND', 1)), 3),
+    'backfill': (float(os.getenv('RATE_LIMIT_BACKFILL', 1)), 3),
+    'default': (float(os.getenv('RATE_LIMIT_DEFAULT', 5)), 10),
+}
+FLOOD_WAIT_MAX_RETRIES = int(os.getenv('FLOOD_WAIT_MAX_RETRIES', 3))
+FLOOD_WAIT_MAX_SECONDS = int(os.getenv('FLOOD_WAIT_MAX_SECONDS', 300))
+
+# Кэш каналов: сколько часов доверять найденным и ненайденным каналам
+PEER_CACHE_TTL_HOURS = int(os.getenv('PEER_CACHE_TTL_HOURS', 24 * 7))
+NEGATIVE_PEER_CACHE_TTL_HOURS = int(os.getenv('NEGATIVE_PEER_CACHE_TTL_HOURS', 24))
+
+# Со скольких каналов за проход выгоднее один раз прочитать список диалогов аккаунта,
+# чем резолвить и проверять каждый канал отдельно
+DIALOG_SWEEP_MIN_CHANNELS = int(os.getenv('DIALOG_SWEEP_MIN_CHANNELS', 3))
+
+# Постоянные клиенты Telegram: как часто проверять соединение и сколько ждать ответа
+CLIENT_HEALTH_CHECK_INTERVAL = float(os.getenv('CLIENT_HEALTH_CHECK_INTERVAL', 60))
+CLIENT_HEALTH_CHECK_TIMEOUT = float(os.getenv('CLIENT_HEALTH_CHECK_TIMEOUT', 10))
+RUNTIME_TASK_TIMEOUT = float(os.getenv('RUNTIME_TASK_TIMEOUT', 110))
+
+# Конвейер загрузки: размер очередей между стадиями
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 200))
+
+# Push-режим: новые сообщения приходят обновлениями, история лишь догружает пропуски
+PUSH_INGEST_ENABLED = os.getenv('PUSH_INGEST_ENABLED', 'false').lower() == 'true'
+PUSH_QUEUE_SIZE = int(os.getenv('PUSH_QUEUE_SIZE', 1000))
+PUSH_BATCH_SIZE = int(os.getenv('PUSH_BATCH_SIZE', 50))
+PUSH_FLUSH_INTERVAL = float(os.getenv('PUSH_FLUSH_INTERVAL', 2.0))
+GAP_FILL_INTERVAL = float(os.getenv('GAP_FILL_INTERVAL', 900))
+
+# Глубокая догрузка истории: на сколько дней назад, размер страницы, сколько каналов сразу
+BACKFILL_DAYS = int(os.getenv('BACKFILL_DAYS', 90))
+BACKFILL_PAGE_SIZE = int(os.getenv('BACKFILL_PAGE_SIZE', 100))
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', 2))
+BACKFILL_AUTO_RESUME = os.getenv('BACKFILL_AUTO_RESUME', 'true').lower() == 'true'
+
+# Пользовательские сессии для парсинга (через запятую): каналы делятся между ними.
+# Аккаунт на паузе FloodWait дольше REBALANCE_FLOOD_SECONDS временно отдает свои каналы другим
+USER_SESSIONS = [name.strip() for name in os.getenv('USER_SESSIONS', 'telegram_parser').split(',') if name.strip()]
+REBALANCE_FLOOD_SECONDS = float(os.getenv('REBALANCE_FLOOD_SECONDS', 60))
+
+# Определение маркетплейса: подстроки в тексте и в адресе канала по меткам.
+# Порядок меток - приоритет, если в тексте упомянуто несколько маркетплейсов.
+# Дополнительные метки и синонимы: MARKETPLACE_EXTRA_ALIASES="OZON=озоне;MEGA=мегамаркет,megamarket"
+MARKETPLACE_ALIASES = {
+    'OZON': ['ozon', 'озон'],
+    'WB': ['wb', 'вб', 'wildberr'],
+    'YANDEX': ['yandex', 'яндекс'],
+}
+MARKETPLACE_CHANNEL_ALIASES = {
+    'OZON': ['ozon'],
+    'WB': ['wb', 'wildberr'],
+    'YANDEX': ['yandex', 'market'],
+}
+for _item in os.getenv('MARKETPLACE_EXTRA_ALIASES', '').split(';'):
+    if '=' in _item:
+        _label, _aliases = _item.split('=', 1)
+        MARKETPLACE_ALIASES.setdefault(_label.strip().upper(), []).extend(
+            alias.strip().lower() for alias in _aliases.split(',') if alias.strip()
+        )
+
+# Поиск почти одинаковых сообщений (MinHash LSH): число перестановок и полос,
+# порог сходства, за сколько дней и сколько сообщений держать индекс в памяти
+MINHASH_PERMUTATIONS = int(os.getenv('MINHASH_PERMUTATIONS', 64))
+LSH_BANDS = int(os.getenv('LSH_BANDS', 16))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.6))
+NEAR_DUPLICATE_WINDOW_DAYS = int(os.getenv('NEAR_DUPLICATE_WINDOW_DAYS', 14))
+NEAR_DUPLICATE_INDEX_SIZE = int(os.getenv('NEAR_DUPLICATE_INDEX_SIZE', 100000))
+
+# Тематическая кластеризация (мини-пакетный k-means по хешированным словам):
+# число тем, размерность хеширования, за сколько дней собирать дайджест,
+# скорость забывания старых сообщений и сколько разделов выводить в пост
+TOPIC_CLUSTERING_ENABLED = os.getenv('TOPIC_CLUSTERING_ENABLED', 'true').lower() == 'true'
+TOPIC_DIGEST_ENABLED = os.getenv('TOPIC_DIGEST_ENABLED', 'false').lower() == 'true'
+TOPIC_COUNT = int(os.getenv('TOPIC_COUNT', 12))
+TOPIC_HASH_FEATURES = int(os.getenv('TOPIC_HASH_FEATURES', 1 << 14))
+TOPIC_BATCH_SIZE = int(os.getenv('TOPIC_BATCH_SIZE', 256))
+TOPIC_WINDOW_DAYS = int(os.getenv('TOPIC_WINDOW_DAYS', 7))
+TOPIC_FORGETTING = float(os.getenv('TOPIC_FORGETTING', 0.999))
+TOPIC_SECTIONS = int(os.getenv('TOPIC_SECTIONS', 5))
+TOPIC_MIN_MESSAGES = int(os.getenv('TOPIC_MIN_MESSAGES', 3))
+
+# Модель для определения маркетплейса (Hugging Face Inference API или совместимый
+# сервер, см. inference_server.py). Без INFERENCE_URL работают локальные правила.
+# Запросы объединяются в пачки, число одновременных запросов ограничено,
+# ответы кэшируются по хешу текста
+INFERENCE_URL = os.getenv('INFERENCE_URL', '')
+HUGGINGFACE_TOKEN = os.getenv('HUGGINGFACE_TOKEN', '')
+INFERENCE_BATCH_SIZE = int(os.getenv('INFERENCE_BATCH_SIZE', 32))
+INFERENCE_MAX_WAIT = float(os.getenv('INFERENCE_MAX_WAIT', 0.02))
+INFERENCE_MAX_IN_FLIGHT = int(os.getenv('INFERENCE_MAX_IN_FLIGHT', 4))
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', 10))
+INFERENCE_MIN_SCORE = float(os.getenv('INFERENCE_MIN_SCORE', 0.5))
+INFERENCE_CACHE_SIZE = int(os.getenv('INFERENCE_CACHE_SIZE', 50000))
+INFERENCE_MEMORY_CACHE_SIZE = int(os.getenv('INFERENCE_MEMORY_CACHE_SIZE', 5000))
+
+# Накопительный дайджест: состояние по маркетплейсу и периоду (day или week)
+# обновляется после каждой загрузки, пост собирается чтением состояния.
+# Кандидатов в пункты хранится DIGEST_CANDIDATES, подтем - до DIGEST_CLUSTERS;
+# предложение открывает новую подтему, если похоже на все меньше порога
+RUNNING_DIGEST_ENABLED = os.getenv('RUNNING_DIGEST_ENABLED', 'true').lower() == 'true'
+DIGEST_PERIOD = os.getenv('DIGEST_PERIOD', 'week')
+DIGEST_CANDIDATES = int(os.getenv('DIGEST_CANDIDATES', 60))
+DIGEST_CLUSTERS = int(os.getenv('DIGEST_CLUSTERS', 8))
+DIGEST_HASH_FEATURES = int(os.getenv('DIGEST_HASH_FEATURES', 4096))
+DIGEST_NEW_CLUSTER_SIMILARITY = float(os.getenv('DIGEST_NEW_CLUSTER_SIMILARITY', 0.2))
+
+# Тренды: эскизы count-min частот слов и биграмм по маркетплейсам и дням.
+# Окно TREND_WINDOW_DAYS сравнивается с базой из TREND_BASELINE_DAYS дней до него,
+# память фиксирована: 3 маркетплейса x дни x глубина x ширина счетчиков
+TRENDS_ENABLED = os.getenv('TRENDS_ENABLED', 'true').lower() == 'true'
+TREND_WINDOW_DAYS = int(os.getenv('TREND_WINDOW_DAYS', 7))
+TREND_BASELINE_DAYS = int(os.getenv('TREND_BASELINE_DAYS', 28))
+TREND_SKETCH_WIDTH = int(os.getenv('TREND_SKETCH_WIDTH', 4096))
+TREND_SKETCH_DEPTH = int(os.getenv('TREND_SKETCH_DEPTH', 4))
+TREND_CANDIDATES = int(os.getenv('TREND_CANDIDATES', 300))
+TREND_MIN_COUNT = int(os.getenv('TREND_MIN_COUNT', 3))
+TREND_MIN_GROWTH = float(os.getenv('TREND_MIN_GROWTH', 2.0))
+TREND_TOP = int(os.getenv('TREND_TOP', 5))
+
+# Общая токенизация: сколько последних текстов и основ слов держать в памяти
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 20000))
+STEM_CACHE_SIZE = int(os.getenv('STEM_CACHE_SIZE', 100000))
+
+# Реестр каналов: сколько сообщений брать за опрос по умолчанию для основных и доп. каналов
+MAIN_CHANNELS_LIMIT = int(os.getenv('MAIN_CHANNELS_LIMIT', 50))
+DISCUSSION_CHANNELS_LIMIT = int(os.getenv('DISCUSSION_CHANNELS_LIMIT', 20))
+
+# Адаптивный опрос: интервал подбирается так, чтобы за опрос набиралось около
+# POLL_TARGET_MESSAGES сообщений, в пределах [POLL_MIN_INTERVAL, POLL_MAX_INTERVAL] секунд
+CHANNEL_POLLING_ENABLED = os.getenv('CHANNEL_POLLING_ENABLED', 'false').lower() == 'true'
+CHANNEL_POLL_TICK = int(os.getenv('CHANNEL_POLL_TICK', 60))
+POLL_TARGET_MESSAGES = float(os.getenv('POLL_TARGET_MESSAGES', 5))
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', 300))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', 6 * 3600))
+POLL_RATE_SMOOTHING = float(os.getenv('POLL_RATE_SMOOTHING', 0.3))
+
+# Начальный список каналов: переносится в реестр (таблица channels) при инициализации базы
 SOURCE_CHANNELS = [
     "https://t.me/ozonmarketplace",
     "https://t.me/wbsellerofficial", 
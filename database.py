@@ -1,132 +1,380 @@
-import sqlite3
+import hashlib
 import logging
+import threading
+from datetime import datetime, timezone
+from storage import get_connection, transaction, ensure_columns
+from text_processing import normalize_text, tokenizer, init_tokens
 
 logger = logging.getLogger(__name__)
 
+# Размер пачки для фонового заполнения хешей
+BACKFILL_BATCH_SIZE = 1000
+
+# Максимум параметров в одном IN (...) запросе
+MAX_QUERY_PARAMS = 500
+
+def content_hash(text):
+    """Возвращает хеш нормализованного текста сообщения"""
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).hexdigest()
+
 def init_db():
     """Инициализирует базу данных"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    # Таблица для сообщений
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message_text TEXT NOT NULL,
-            channel_url TEXT NOT NULL,
-            marketplace TEXT,
-            message_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица для постов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            post_content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        # Таблица для сообщений
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_text TEXT NOT NULL,
+                channel_url TEXT NOT NULL,
+                marketplace TEXT,
+                message_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                content_hash TEXT,
+                peer_id INTEGER,
+                message_id INTEGER,
+                edit_date TIMESTAMP
+            )
+        ''')
+
+        # Миграция старых баз и индексы для дедупликации
+        ensure_columns(conn, 'messages', [
+            ('content_hash', 'TEXT'),
+            ('peer_id', 'INTEGER'),
+            ('message_id', 'INTEGER'),
+            ('edit_date', 'TIMESTAMP')
+        ])
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_channel_hash
+            ON messages (channel_url, content_hash)
+        ''')
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_peer_message
+            ON messages (peer_id, message_id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_date
+            ON messages (message_date)
+        ''')
+
+        # Таблица для постов
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                post_content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
     logger.info("✅ База данных инициализирована")
 
+    # Хеши для старых записей считаем в фоне, не задерживая запуск
+    threading.Thread(target=backfill_content_hashes, daemon=True).start()
+
+    # Инициализируем состояние парсинга, кэш и реестр каналов
+    from parsing_state import init_parsing_state
+    from peer_cache import init_peer_cache
+    from channel_registry import init_channel_registry
+    from near_duplicates import init_near_duplicates
+    from topic_clustering import init_topics
+    from inference_client import init_inference_cache
+    from sentiment import init_sentiment
+    from digest_state import init_digest_state
+    from trends import init_trends
+    init_tokens()
+    init_parsing_state()
+    init_peer_cache()
+    init_channel_registry()
+    init_near_duplicates()
+    init_topics()
+    init_inference_cache()
+    init_sentiment()
+    init_digest_state()
+    init_trends()
+
 def save_message(message_text, channel_url, marketplace='OTHER'):
-    """Сохраняет сообщение в базу данных"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO messages (message_text, channel_url, marketplace)
-        VALUES (?, ?, ?)
-    ''', (message_text, channel_url, marketplace))
-    
-    conn.commit()
-    conn.close()
+    """Сохраняет сообщение, если его еще нет в базе.
+
+    Возвращает True, если сообщение новое и было сохранено.
+    """
+    with transaction() as conn:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO messages (message_text, channel_url, marketplace, content_hash)
+            VALUES (?, ?, ?, ?)
+        ''', (message_text, channel_url, marketplace, content_hash(message_text)))
+
+    return cursor.rowcount == 1
 
 def message_exists(message_text, channel_url):
     """Проверяет, существует ли сообщение уже в базе"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT COUNT(*) FROM messages 
-        WHERE message_text = ? AND channel_url = ?
-    ''', (message_text, channel_url))
-    
-    count = cursor.fetchone()[0]
-    conn.close()
-    
-    return count > 0
+    cursor = get_connection().execute('''
+        SELECT 1 FROM messages
+        WHERE channel_url = ? AND content_hash = ?
+        LIMIT 1
+    ''', (channel_url, content_hash(message_text)))
+
+    return cursor.fetchone() is not None
+
+def message_record(message, marketplace='OTHER'):
+    """Собирает словарь для save_messages_batch из сообщения Pyrogram"""
+    return {
+        'text': message.text.strip(),
+        'marketplace': marketplace,
+        'peer_id': message.chat.id if message.chat else None,
+        'message_id': message.id,
+        'date': message.date,
+        'edit_date': message.edit_date
+    }
+
+def format_date(value):
+    """Приводит дату к формату CURRENT_TIMESTAMP в UTC"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+def save_messages_batch(messages, channel_url):
+    """Сохраняет страницу сообщений канала одной транзакцией.
+
+    messages - список словарей с ключами 'text' и 'marketplace' и, если
+    сообщение пришло из Telegram, 'peer_id', 'message_id', 'date',
+    'edit_date' (см. message_record). Сообщения с ключом (peer_id,
+    message_id) сверяются с базой по ключу, отредактированные обновляются
+    на месте; остальные сверяются по хешу текста. Проверка идет одним
+    запросом, вставка - через executemany. Новые сообщения сразу
+    распределяются по кластерам почти одинаковых (ключ 'cluster_id') и
+    получают оценку тональности всей страницей (ключ 'sentiment'), а
+    вместе с текстом сохраняется его массив номеров слов (колонка tokens).
+    Переданные словари не меняются: функция работает с их копиями и
+    возвращает копии новых сообщений.
+    """
+    candidates = []
+    seen = set()
+    for message in messages:
+        message_hash = content_hash(message['text'])
+        message_id = message.get('message_id')
+        if message_hash in seen or (message_id is not None and message_id in seen):
+            continue
+        seen.add(message_hash)
+        if message_id is not None:
+            seen.add(message_id)
+        # Копия: производные поля не должны попасть в словарь вызывающего
+        candidates.append((message_hash, dict(message)))
+
+    if not candidates:
+        return []
+
+    peer_id = next((m['peer_id'] for _, m in candidates if m.get('peer_id')), None)
+    message_ids = [m['message_id'] for _, m in candidates if m.get('message_id') is not None]
+
+    with transaction() as conn:
+        known = _find_existing(conn, channel_url, [h for h, _ in candidates], peer_id, message_ids)
+        known_ids = {message_id: h for h, message_id in known if message_id is not None}
+        known_hashes = {h: message_id for h, message_id in known}
+
+        new_messages, edited, linked = [], [], []
+        for message_hash, message in candidates:
+            message_id = message.get('message_id')
+            if message_id is not None and message_id in known_ids:
+                if known_ids[message_id] != message_hash:
+                    edited.append((message_hash, message))
+            elif message_hash in known_hashes:
+                if message_id is not None and known_hashes[message_hash] is None:
+                    linked.append((message_hash, message))
+            else:
+                new_messages.append((message_hash, message))
+
+        changed = [m for _, m in new_messages + edited]
+        tokens, persisted = tokenizer.encode_persisted(conn, [m['text'] for m in changed])
+        _score_sentiment(changed, tokens)
+        if persisted:
+            for message, message_tokens in zip(changed, tokens):
+                message['tokens'] = tokenizer.to_blob(message_tokens)
+        conn.executemany('''
+            INSERT OR IGNORE INTO messages
+            (message_text, channel_url, marketplace, content_hash,
+             peer_id, message_id, message_date, edit_date, sentiment, tokens)
+            VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?)
+        ''', [
+            (m['text'], channel_url, m.get('marketplace', 'OTHER'), h,
+             m.get('peer_id'), m.get('message_id'), format_date(m.get('date')),
+             format_date(m.get('edit_date')), m['sentiment'], m.get('tokens'))
+            for h, m in new_messages
+        ])
+        _assign_clusters(conn, channel_url, new_messages)
+
+        # Отредактированные посты обновляем на месте
+        if edited:
+            conn.executemany('''
+                UPDATE OR IGNORE messages
+                SET message_text = ?, content_hash = ?, marketplace = ?, edit_date = ?,
+                    sentiment = ?, tokens = ?
+                WHERE peer_id = ? AND message_id = ?
+            ''', [
+                (m['text'], h, m.get('marketplace', 'OTHER'), format_date(m.get('edit_date')),
+                 m['sentiment'], m.get('tokens'), m['peer_id'], m['message_id'])
+                for h, m in edited
+            ])
+
+        # Старым записям без ключа проставляем ключ и реальную дату
+        if linked:
+            conn.executemany('''
+                UPDATE OR IGNORE messages
+                SET peer_id = ?, message_id = ?, message_date = COALESCE(?, message_date)
+                WHERE channel_url = ? AND content_hash = ? AND message_id IS NULL
+            ''', [
+                (m.get('peer_id'), m['message_id'], format_date(m.get('date')), channel_url, h)
+                for h, m in linked
+            ])
+
+    return [m for _, m in new_messages]
+
+def _score_sentiment(messages, tokens):
+    """Оценивает тональность страницы одним вызовом"""
+    if not messages:
+        return
+    from sentiment import sentiment_analyzer
+    scores = sentiment_analyzer.score_tokens(tokens)
+    for message, score in zip(messages, scores):
+        message['sentiment'] = round(float(score), 4)
+
+def _assign_clusters(conn, channel_url, new_messages):
+    """Находит id и даты вставленных сообщений и относит их к кластерам похожих"""
+    if not new_messages:
+        return
+    from near_duplicates import near_duplicate_index
+
+    found = {}
+    hashes = [h for h, _ in new_messages]
+    for start in range(0, len(hashes), MAX_QUERY_PARAMS):
+        chunk = hashes[start:start + MAX_QUERY_PARAMS]
+        found.update(
+            (h, (row_id, message_date)) for row_id, h, message_date in conn.execute(f'''
+                SELECT id, content_hash, message_date FROM messages
+                WHERE channel_url = ? AND content_hash IN ({','.join('?' * len(chunk))})
+            ''', [channel_url, *chunk])
+        )
+
+    rows = [(found[h][0], m['text'], found[h][1]) for h, m in new_messages if h in found]
+    clusters = near_duplicate_index.assign(conn, rows)
+    for h, m in new_messages:
+        m['cluster_id'] = clusters.get(found.get(h, (None,))[0])
+
+def _find_existing(conn, channel_url, hashes, peer_id=None, message_ids=()):
+    """Ищет в базе сообщения канала по хешам и по ключам (peer_id, message_id).
+
+    Возвращает список пар (content_hash, message_id).
+    """
+    found = []
+    if peer_id is None:
+        message_ids = []
+    step = MAX_QUERY_PARAMS // 2
+    for start in range(0, max(len(hashes), len(message_ids)), step):
+        hash_chunk = hashes[start:start + step]
+        id_chunk = message_ids[start:start + step]
+
+        queries, params = [], []
+        if hash_chunk:
+            queries.append(f'''
+                SELECT content_hash, message_id FROM messages
+                WHERE channel_url = ? AND content_hash IN ({','.join('?' * len(hash_chunk))})
+            ''')
+            params += [channel_url, *hash_chunk]
+        if id_chunk:
+            queries.append(f'''
+                SELECT content_hash, message_id FROM messages
+                WHERE peer_id = ? AND message_id IN ({','.join('?' * len(id_chunk))})
+            ''')
+            params += [peer_id, *id_chunk]
+
+        found.extend(conn.execute(' UNION ALL '.join(queries), params).fetchall())
+    return found
+
+def get_messages_between(start_date, end_date, channel_url=None):
+    """Получает сообщения за период по реальной дате публикации"""
+    query = '''
+        SELECT message_text, channel_url, marketplace, message_date, message_id
+        FROM messages
+        WHERE message_date >= ? AND message_date < ?
+    '''
+    params = [format_date(start_date), format_date(end_date)]
+    if channel_url:
+        query += ' AND channel_url = ?'
+        params.append(channel_url)
+    query += ' ORDER BY message_date'
+
+    return [
+        {
+            'text': row[0],
+            'channel': row[1],
+            'marketplace': row[2],
+            'date': row[3],
+            'message_id': row[4]
+        }
+        for row in get_connection().execute(query, params)
+    ]
+
+def backfill_content_hashes(batch_size=BACKFILL_BATCH_SIZE):
+    """Заполняет хеши для записей, сохраненных до их появления.
+
+    Работает пачками по короткой транзакции на каждую, поэтому не
+    блокирует запись новых сообщений. Повторы одного текста в канале
+    остаются без хеша - уникальный индекс уже занят первой копией.
+    """
+    last_id = 0
+    updated = 0
+    try:
+        while True:
+            rows = get_connection().execute('''
+                SELECT id, message_text FROM messages
+                WHERE content_hash IS NULL AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+
+            if not rows:
+                break
+
+            with transaction() as conn:
+                cursor = conn.executemany(
+                    'UPDATE OR IGNORE messages SET content_hash = ? WHERE id = ?',
+                    [(content_hash(text), row_id) for row_id, text in rows]
+                )
+                updated += cursor.rowcount
+
+            last_id = rows[-1][0]
+    except Exception as e:
+        logger.error(f"❌ Ошибка заполнения хешей: {e}")
+
+    if updated:
+        logger.info(f"✅ Заполнено хешей: {updated}")
+    return updated
 
 def get_last_messages(limit=10):
     """Получает последние сообщения из базы данных"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT message_text, channel_url, marketplace, created_at 
-        FROM messages 
-        ORDER BY created_at DESC 
+    cursor = get_connection().execute('''
+        SELECT message_text, channel_url, marketplace, message_date, cluster_id
+        FROM messages
+        ORDER BY message_date DESC
         LIMIT ?
     ''', (limit,))
-    
+
     messages = []
     for row in cursor.fetchall():
         messages.append({
             'text': row[0],
             'channel': row[1],
             'marketplace': row[2],
-            'date': row[3]
+            'date': row[3],
+            'cluster_id': row[4]
         })
-    
-    conn.close()
+
     return messages
 
 def save_post(post_content):
     """Сохраняет созданный пост в базу данных"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO posts (post_content)
-        VALUES (?)
-    ''', (post_content,))
-    
-    conn.commit()
-    conn.close()
-    def init_db():
-     """Инициализирует базу данных"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    # Таблица для сообщений
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message_text TEXT NOT NULL,
-            channel_url TEXT NOT NULL,
-            marketplace TEXT,
-            message_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица для постов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            post_content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("✅ База данных инициализирована")
-    
-    # Инициализируем состояние парсинга
-    from parsing_state import init_parsing_state
-    init_parsing_state()
\ No newline at end of file
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO posts (post_content)
+            VALUES (?)
+        ''', (post_content,))
@@ -2,6 +2,8 @@ import asyncio
 import logging
 from pyrogram import Client
 from config import API_ID, API_HASH, BOT_TOKEN, SOURCE_CHANNELS
+from rate_limiter import rate_limiter
+from peer_cache import channel_identifier
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,17 +27,12 @@ async def debug_channel_access():
         for i, channel_url in enumerate(SOURCE_CHANNELS, 1):
             try:
                 # Извлекаем идентификатор канала
-                if channel_url.startswith('https://t.me/'):
-                    channel_id = channel_url.replace('https://t.me/', '')
-                elif channel_url.startswith('@'):
-                    channel_id = channel_url[1:]
-                else:
-                    channel_id = channel_url
+                channel_id = channel_identifier(channel_url)
                 
                 logger.info(f"{i}. 🔍 Проверяем: {channel_id}")
                 
                 # Пробуем получить информацию о канале
-                chat = await client.get_chat(channel_id)
+                chat = await rate_limiter.call('resolve', client.get_chat, channel_id)
                 logger.info(f"   📝 Название: {chat.title}")
                 logger.info(f"   👥 Участников: {getattr(chat, 'members_count', 'N/A')}")
                 logger.info(f"   🔒 Тип: {chat.type}")
@@ -44,7 +41,7 @@ async def debug_channel_access():
                 messages_found = 0
                 message_samples = []
                 
-                async for message in client.get_chat_history(chat.id, limit=5):
+                async for message in rate_limiter.iter_history(client, chat.id, limit=5):
                     if message.text and message.text.strip():
                         messages_found += 1
                         if len(message_samples) < 2:
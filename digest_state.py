@@ -0,0 +1,340 @@
+import json
+import zlib
+import logging
+import threading
+from datetime import datetime
+from functools import lru_cache
+import numpy as np
+from storage import get_connection, transaction
+from text_processing import tokenizer
+from summarizer import extract_sentences, IMPORTANT_CUES, TIP_CUES
+from marketplace_classifier import OTHER
+from config import (
+    DIGEST_PERIOD, DIGEST_CANDIDATES, DIGEST_CLUSTERS, DIGEST_HASH_FEATURES,
+    DIGEST_NEW_CLUSTER_SIMILARITY
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько новых сообщений читать из базы за раз
+UPDATE_CHUNK = 2000
+
+# Сверх общих лучших кандидатов хранятся лучшие с маркерами "Важно" и "Советы"
+CUE_CANDIDATES = 10
+
+# Кандидат пропускается, если делит с уже взятым больше этой доли основ
+REDUNDANCY_OVERLAP = 0.6
+
+# Порядок разделов в посте
+SECTION_ORDER = ('OZON', 'WB', 'YANDEX')
+
+def init_digest_state():
+    """Таблицы накопительного дайджеста и водяного знака обработанных сообщений"""
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS digest_state (
+                marketplace TEXT NOT NULL,
+                period TEXT NOT NULL,
+                centroids BLOB NOT NULL,
+                counts BLOB NOT NULL,
+                candidates TEXT NOT NULL,
+                messages INTEGER NOT NULL,
+                sentiment_sum REAL NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (marketplace, period)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS digest_progress (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_message_id INTEGER NOT NULL
+            )
+        ''')
+
+    logger.info("✅ Накопительный дайджест инициализирован")
+
+def period_key(value=None, period=DIGEST_PERIOD):
+    """Ключ периода для даты сообщения: '2024-06-03' (day) или '2024-W23' (week)"""
+    if value is None:
+        moment = datetime.utcnow()
+    elif isinstance(value, datetime):
+        moment = value
+    else:
+        moment = datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+
+    if period == 'day':
+        return moment.strftime('%Y-%m-%d')
+    year, week, _ = moment.isocalendar()
+    return f'{year}-W{week:02d}'
+
+@lru_cache(maxsize=100000)
+def _feature(word):
+    return zlib.crc32(word.encode('utf-8')) % DIGEST_HASH_FEATURES
+
+def _vector(stems):
+    """Нормированный хешированный вектор основ: (индексы, значения)"""
+    counts = {}
+    for word in stems:
+        index = _feature(word)
+        counts[index] = counts.get(index, 0) + 1
+    indices = np.fromiter(counts, dtype=np.int32, count=len(counts))
+    values = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    norm = np.linalg.norm(values)
+    return indices, values / norm if norm else values
+
+class DigestState:
+    """Накопительное состояние дайджеста по маркетплейсу и периоду.
+
+    Для каждой пары (маркетплейс, период) хранятся центры подтем
+    (онлайн k-means по хешированным векторам предложений), число
+    предложений в каждой, лучшие предложения-кандидаты с оценками и
+    счетчики сообщений и тональности. Обновление берет только сообщения
+    после водяного знака, так что каждая загрузка дорабатывает
+    состояние, а не пересчитывает неделю; оценка кандидата - близость к
+    центру своей подтемы, умноженная на log(1 + размер подтемы).
+    Кандидат, выпавший из топа, обратно не возвращается - это плата за
+    то, что пост собирается чтением нескольких строк.
+    """
+
+    def __init__(self, period=DIGEST_PERIOD, candidates=DIGEST_CANDIDATES, clusters=DIGEST_CLUSTERS):
+        self.period = period
+        self.candidates = candidates
+        self.clusters = clusters
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _empty_state():
+        return {
+            'centroids': np.zeros((0, DIGEST_HASH_FEATURES), dtype=np.float32),
+            'counts': np.zeros(0),
+            'candidates': [],
+            'messages': 0,
+            'sentiment_sum': 0.0
+        }
+
+    @staticmethod
+    def _load(conn, marketplace, period):
+        row = conn.execute('''
+            SELECT centroids, counts, candidates, messages, sentiment_sum
+            FROM digest_state WHERE marketplace = ? AND period = ?
+        ''', (marketplace, period)).fetchone()
+        if not row:
+            return DigestState._empty_state()
+        return {
+            'centroids': np.frombuffer(row[0], dtype=np.float32).reshape(-1, DIGEST_HASH_FEATURES).copy(),
+            'counts': np.frombuffer(row[1], dtype=np.float64).copy(),
+            'candidates': json.loads(row[2]),
+            'messages': row[3],
+            'sentiment_sum': row[4]
+        }
+
+    @staticmethod
+    def _save(conn, marketplace, period, state):
+        conn.execute('''
+            INSERT OR REPLACE INTO digest_state
+            (marketplace, period, centroids, counts, candidates, messages, sentiment_sum, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (
+            marketplace, period, state['centroids'].tobytes(), state['counts'].tobytes(),
+            json.dumps(state['candidates'], ensure_ascii=False), state['messages'], state['sentiment_sum']
+        ))
+
+    def _apply(self, state, texts, sentiments, marketplace, token_arrays=None):
+        """Добавляет пачку сообщений одного маркетплейса и периода в состояние"""
+        state['messages'] += len(texts)
+        state['sentiment_sum'] += float(sum(score for score in sentiments if score is not None))
+
+        sentences, tokens, _ = extract_sentences(texts, [marketplace] * len(texts), token_arrays)
+        if not sentences:
+            return
+
+        centroids, counts = state['centroids'], state['counts']
+        known = {candidate['key'] for candidate in state['candidates']}
+        for sentence, stems in zip(sentences, tokens):
+            indices, values = _vector(stems)
+            best, similarity = -1, 0.0
+            if len(counts):
+                similarities = centroids[:, indices] @ values
+                best = int(similarities.argmax())
+                similarity = float(similarities[best])
+
+            if best < 0 or (similarity < DIGEST_NEW_CLUSTER_SIMILARITY and len(counts) < self.clusters):
+                # Новая подтема с центром в этом предложении
+                center = np.zeros((1, DIGEST_HASH_FEATURES), dtype=np.float32)
+                center[0, indices] = values
+                centroids = np.vstack([centroids, center])
+                counts = np.append(counts, 1.0)
+                cluster = len(counts) - 1
+            else:
+                # Центр подтемы сдвигается к среднему ее предложений
+                cluster = best
+                total = counts[cluster] + 1
+                centroids[cluster] *= counts[cluster] / total
+                centroids[cluster, indices] += values / total
+                norm = np.linalg.norm(centroids[cluster])
+                if norm:
+                    centroids[cluster] /= norm
+                counts[cluster] = total
+
+            key = ' '.join(stems)
+            if key not in known:
+                known.add(key)
+                cues = set(stems)
+                state['candidates'].append({
+                    'text': sentence,
+                    'key': key,
+                    'cluster': cluster,
+                    'important': bool(cues & IMPORTANT_CUES),
+                    'tip': bool(cues & TIP_CUES)
+                })
+
+        state['centroids'], state['counts'] = centroids, counts
+        self._prune(state)
+
+    def _prune(self, state):
+        """Переоценивает кандидатов по текущим подтемам и оставляет лучших"""
+        centroids, counts = state['centroids'], state['counts']
+        for candidate in state['candidates']:
+            indices, values = _vector(candidate['key'].split())
+            cluster = candidate['cluster']
+            candidate['score'] = round(float(centroids[cluster, indices] @ values) * float(np.log1p(counts[cluster])), 5)
+
+        ranked = sorted(state['candidates'], key=lambda candidate: -candidate['score'])
+        keep = {id(candidate) for candidate in ranked[:self.candidates]}
+        for flag in ('important', 'tip'):
+            keep.update(id(candidate) for candidate in [c for c in ranked if c[flag]][:CUE_CANDIDATES])
+        state['candidates'] = [candidate for candidate in ranked if id(candidate) in keep]
+
+    def update(self):
+        """Добавляет в состояние сообщения, сохраненные после прошлого обновления.
+
+        Возвращает {'messages': ..., 'states': ...} - сколько сообщений
+        обработано и сколько состояний (маркетплейс, период) изменилось.
+        """
+        processed = 0
+        touched = set()
+        with self._lock:
+            while True:
+                # Пачка за транзакцией: запись новых сообщений не ждет всю историю
+                with transaction() as conn:
+                    row = conn.execute('SELECT last_message_id FROM digest_progress WHERE id = 1').fetchone()
+                    last_id = row[0] if row else 0
+                    rows = conn.execute('''
+                        SELECT id, message_text, COALESCE(marketplace, ?), message_date, sentiment, tokens
+                        FROM messages WHERE id > ? ORDER BY id LIMIT ?
+                    ''', (OTHER, last_id, UPDATE_CHUNK)).fetchall()
+                    if not rows:
+                        break
+
+                    groups = {}
+                    for _, text, marketplace, message_date, sentiment, tokens in rows:
+                        if marketplace == OTHER:
+                            continue
+                        key = (marketplace, period_key(message_date, self.period))
+                        group = groups.setdefault(key, ([], [], []))
+                        group[0].append(text)
+                        group[1].append(sentiment)
+                        group[2].append(tokenizer.tokens_for(text, tokens))
+
+                    for (marketplace, period), (texts, sentiments, token_arrays) in groups.items():
+                        state = self._load(conn, marketplace, period)
+                        self._apply(state, texts, sentiments, marketplace, token_arrays)
+                        self._save(conn, marketplace, period, state)
+                        touched.add((marketplace, period))
+
+                    conn.execute(
+                        'INSERT OR REPLACE INTO digest_progress (id, last_message_id) VALUES (1, ?)', (rows[-1][0],)
+                    )
+                    processed += len(rows)
+
+        if processed:
+            logger.info(f"📰 Дайджест обновлен: {processed} сообщений, состояний: {len(touched)}")
+        return {'messages': processed, 'states': len(touched)}
+
+    @staticmethod
+    def _pick(candidates, count, accept, taken):
+        """До count кандидатов по убыванию оценки: сначала из разных подтем, без пересказов уже взятых"""
+        picked = []
+        words = [set(candidate['key'].split()) for candidate in candidates]
+        used_clusters = {candidates[i]['cluster'] for i in taken}
+        chosen = list(taken)
+        for distinct in (True, False):
+            for i, candidate in enumerate(candidates):
+                if len(picked) == count:
+                    return picked
+                if i in taken or i in picked or not accept(candidate):
+                    continue
+                if distinct and candidate['cluster'] in used_clusters:
+                    continue
+                if any(len(words[i] & words[j]) > REDUNDANCY_OVERLAP * len(words[i] | words[j]) for j in chosen):
+                    continue
+                picked.append(i)
+                chosen.append(i)
+                used_clusters.add(candidate['cluster'])
+        return picked
+
+    def build(self, period=None, key_points=3, important=2, tips=2):
+        """Структура поста из текущего состояния периода (по умолчанию текущего).
+
+        Только чтение нескольких строк digest_state: новые сообщения
+        дорабатывает update (см. post_ingest). Возвращает структуру для
+        PostFormatter.format_structured_post или None, если за период
+        нет ни одного раздела.
+        """
+        period = period or period_key(period=self.period)
+        rows = get_connection().execute('''
+            SELECT marketplace, candidates, messages, sentiment_sum
+            FROM digest_state WHERE period = ?
+        ''', (period,)).fetchall()
+
+        order = {label: i for i, label in enumerate(SECTION_ORDER)}
+        rows.sort(key=lambda row: (order.get(row[0], len(order)), row[0]))
+
+        sections, counts, mood = {}, {}, []
+        for marketplace, candidates, messages, sentiment_sum in rows:
+            counts[marketplace] = messages
+            if messages:
+                mood.append(f'{marketplace} {sentiment_sum / messages:+.2f}')
+
+            candidates = sorted(json.loads(candidates), key=lambda candidate: -candidate['score'])
+            main = self._pick(candidates, key_points, lambda candidate: True, set())
+            taken = set(main)
+            notes = self._pick(candidates, important, lambda candidate: candidate['important'], taken)
+            taken.update(notes)
+            advice = self._pick(candidates, tips, lambda candidate: candidate['tip'], taken)
+            if main:
+                sections[marketplace] = {
+                    'key_points': [candidates[i]['text'] for i in main],
+                    'important': [candidates[i]['text'] for i in notes],
+                    'tips': [candidates[i]['text'] for i in advice]
+                }
+
+        if not sections:
+            return None
+
+        tips_all = [tip for section in sections.values() for tip in section['tips']]
+        totals = ', '.join(f'{marketplace}: {count}' for marketplace, count in counts.items())
+        return {
+            'title': '📊 Аналитика маркетплейсов',
+            'summary': f'Дайджест за {period}: {sum(counts.values())} сообщений. {totals}'
+                       + (f'. Тональность: {", ".join(mood)}' if mood else ''),
+            'sections': sections,
+            'recommendations': tips_all[0] if tips_all else 'Следите за официальными объявлениями'
+        }
+
+    def get_stats(self, period=None):
+        """Размер состояний периода: сообщений, подтем и кандидатов по маркетплейсам"""
+        period = period or period_key(period=self.period)
+        stats = {}
+        for marketplace, counts, candidates, messages in get_connection().execute('''
+            SELECT marketplace, counts, candidates, messages FROM digest_state WHERE period = ?
+        ''', (period,)):
+            stats[marketplace] = {
+                'messages': messages,
+                'clusters': len(counts) // 8,
+                'candidates': len(json.loads(candidates))
+            }
+        return stats
+
+# Глобальный экземпляр
+digest_state = DigestState()
@@ -0,0 +1,18 @@
+import logging
+
+# Циклы push-приема, опроса каналов и догрузки живут в процессе воркера.
+# Второй воркер запустил бы их копии: каналы опрашивались бы дважды, а
+# водяные знаки и очередь догрузки писались бы наперегонки. Поэтому
+# воркер должен быть один.
+workers = 1
+timeout = 120
+
+def post_worker_init(worker):
+    """Запускает фоновые службы в воркере после загрузки приложения"""
+    if worker.cfg.workers != 1:
+        logging.getLogger(__name__).error(
+            f"❌ Фоновые службы требуют одного воркера gunicorn (сейчас {worker.cfg.workers}), не запускаем"
+        )
+        return
+    from app import start_background_services
+    start_background_services()
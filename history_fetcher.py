@@ -0,0 +1,95 @@
+import logging
+from rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+class IncrementalHistory:
+    """Загрузка только тех сообщений канала, что новее водяного знака.
+
+    Сначала запрашивается одно последнее сообщение: если оно не новее
+    last_message_id, история больше не запрашивается. Иначе по разнице
+    ID (в каналах они последовательные) известно, сколько сообщений
+    пропущено, и догружается ровно столько, но не больше max_messages.
+    Если новых сообщений больше лимита, берутся последние max_messages,
+    а недогруженный диапазон ID сохраняется в gap.
+
+    known_top_id - ID последнего сообщения, уже известный из списка
+    диалогов: тогда пробный запрос не нужен, а канал без новых
+    сообщений не стоит ни одного запроса истории.
+    """
+
+    def __init__(self, client, chat_id, last_message_id, max_messages, known_top_id=None):
+        self.client = client
+        self.chat_id = chat_id
+        self.last_message_id = last_message_id or 0
+        self.max_messages = max_messages
+        self.known_top_id = known_top_id
+        self.top_message_id = 0
+        self.gap = None
+
+    def __aiter__(self):
+        if self.known_top_id is not None:
+            return self._iterate_known()
+        return self._iterate()
+
+    async def _iterate_known(self):
+        if self.known_top_id <= self.last_message_id:
+            self.top_message_id = self.last_message_id
+            return
+
+        # Сообщения могли появиться и после списка диалогов, поэтому
+        # читаем до водяного знака, а не ровно known_top_id - last_message_id
+        count = 0
+        oldest_id = None
+        async for message in rate_limiter.iter_history(self.client, self.chat_id, limit=self.max_messages):
+            if message.id <= self.last_message_id:
+                break
+            count += 1
+            self.top_message_id = self.top_message_id or message.id
+            oldest_id = message.id
+            yield message
+        else:
+            if self.last_message_id and count == self.max_messages and oldest_id - 1 > self.last_message_id:
+                self._set_gap(oldest_id)
+
+        self.top_message_id = self.top_message_id or self.last_message_id
+
+    async def _iterate(self):
+        top = None
+        async for message in rate_limiter.iter_history(self.client, self.chat_id, limit=1):
+            top = message
+
+        if top is None or top.id <= self.last_message_id:
+            self.top_message_id = top.id if top else self.last_message_id
+            return
+
+        self.top_message_id = top.id
+        if self.last_message_id:
+            pending = top.id - self.last_message_id
+        else:
+            pending = self.max_messages
+        limit = min(pending, self.max_messages)
+
+        yield top
+        oldest_id = top.id
+
+        if limit > 1:
+            async for message in rate_limiter.iter_history(
+                self.client, self.chat_id, limit=limit - 1, offset_id=top.id
+            ):
+                if message.id <= self.last_message_id:
+                    break
+                oldest_id = message.id
+                yield message
+
+        # Новых сообщений больше лимита - между водяным знаком и
+        # загруженной частью остается разрыв
+        if self.last_message_id and oldest_id - 1 > self.last_message_id and pending > self.max_messages:
+            self._set_gap(oldest_id)
+
+    def _set_gap(self, oldest_id):
+        self.gap = (self.last_message_id + 1, oldest_id - 1)
+        logger.warning(
+            f"   ⚠️ Разрыв в истории: сообщения {self.gap[0]}-{self.gap[1]} "
+            f"не загружены (лимит {self.max_messages})"
+        )
@@ -0,0 +1,329 @@
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, InvalidStateError
+from storage import get_connection, transaction
+from database import content_hash
+from config import (
+    INFERENCE_URL, HUGGINGFACE_TOKEN, INFERENCE_BATCH_SIZE, INFERENCE_MAX_WAIT,
+    INFERENCE_MAX_IN_FLIGHT, INFERENCE_TIMEOUT, INFERENCE_CACHE_SIZE, INFERENCE_MEMORY_CACHE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько хешей в одном запросе к кэшу (лимит параметров SQLite)
+CACHE_QUERY_CHUNK = 500
+
+def init_inference_cache():
+    """Таблица кэша ответов модели"""
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS inference_cache (
+                task TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                result TEXT NOT NULL,
+                used_at REAL NOT NULL,
+                PRIMARY KEY (task, content_hash)
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_inference_cache_used
+            ON inference_cache (used_at)
+        ''')
+
+    logger.info("✅ Кэш ответов модели инициализирован")
+
+def top_prediction(output):
+    """(метка, уверенность) из ответа модели.
+
+    Понимает ответы zero-shot ({'labels': [...], 'scores': [...]}) и
+    text-classification ([{'label': ..., 'score': ...}, ...]).
+    """
+    if isinstance(output, dict) and 'labels' in output:
+        if not output['labels']:
+            return None, 0.0
+        return output['labels'][0], float(output['scores'][0])
+    if isinstance(output, dict):
+        return output.get('label'), float(output.get('score', 0))
+    if isinstance(output, list) and output:
+        best = max(output, key=lambda item: item.get('score', 0))
+        return best.get('label'), float(best.get('score', 0))
+    return None, 0.0
+
+class InferenceCache:
+    """Кэш ответов модели по хешу нормализованного текста.
+
+    Горячие записи лежат в памяти (LRU на INFERENCE_MEMORY_CACHE_SIZE),
+    все - в таблице inference_cache, где при переполнении удаляются
+    дольше всего не использованные (LRU по used_at).
+    """
+
+    def __init__(self, task, max_size=INFERENCE_CACHE_SIZE, memory_size=INFERENCE_MEMORY_CACHE_SIZE):
+        self.task = task
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, result):
+        """Кладет ответ в память; вызывать под self._lock"""
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_memory(self, key):
+        """Ответ из памяти или None, без обращения к базе"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        return None
+
+    def get_many(self, keys):
+        """Ответы для хешей из памяти и базы: {hash: result}"""
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    missing.append(key)
+
+        stored = {}
+        for start in range(0, len(missing), CACHE_QUERY_CHUNK):
+            chunk = missing[start:start + CACHE_QUERY_CHUNK]
+            rows = get_connection().execute(f'''
+                SELECT content_hash, result FROM inference_cache
+                WHERE task = ? AND content_hash IN ({', '.join('?' * len(chunk))})
+            ''', [self.task, *chunk]).fetchall()
+            stored.update((key, json.loads(result)) for key, result in rows)
+
+        if stored:
+            now = time.time()
+            with transaction() as conn:
+                conn.executemany(
+                    'UPDATE inference_cache SET used_at = ? WHERE task = ? AND content_hash = ?',
+                    [(now, self.task, key) for key in stored]
+                )
+            with self._lock:
+                for key, result in stored.items():
+                    self._remember(key, result)
+
+        found.update(stored)
+        return found
+
+    def put_many(self, results):
+        """Сохраняет ответы {hash: result} и вытесняет самые старые сверх max_size"""
+        if not results:
+            return
+        now = time.time()
+        with transaction() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO inference_cache (task, content_hash, result, used_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(self.task, key, json.dumps(result, ensure_ascii=False), now) for key, result in results.items()])
+
+            total = conn.execute('SELECT COUNT(*) FROM inference_cache').fetchone()[0]
+            if total > self.max_size:
+                conn.execute('''
+                    DELETE FROM inference_cache WHERE rowid IN (
+                        SELECT rowid FROM inference_cache ORDER BY used_at LIMIT ?
+                    )
+                ''', (total - self.max_size,))
+
+        with self._lock:
+            for key, result in results.items():
+                self._remember(key, result)
+
+class HTTPBackend:
+    """Модель за HTTP: Hugging Face Inference API или совместимый сервер.
+
+    Пачка текстов уходит одним POST {"inputs": [...], "parameters": {...}},
+    в ответ ожидается список результатов в том же порядке.
+    """
+
+    def __init__(self, url=INFERENCE_URL, token=HUGGINGFACE_TOKEN, timeout=INFERENCE_TIMEOUT):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def predict(self, texts, parameters=None):
+        body = {'inputs': texts, 'options': {'wait_for_model': True}}
+        if parameters:
+            body['parameters'] = parameters
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+
+        request = urllib.request.Request(
+            self.url, data=json.dumps(body, ensure_ascii=False).encode('utf-8'), headers=headers, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            outputs = json.loads(response.read().decode('utf-8'))
+
+        if not isinstance(outputs, list) or len(outputs) != len(texts):
+            raise ValueError(f"Модель вернула {len(outputs) if isinstance(outputs, list) else 'не список'} ответов на {len(texts)} текстов")
+        return outputs
+
+def _deliver(future, result):
+    """Отдает результат, если future еще ждет: по таймауту apredict ее отменяет"""
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+class InferenceClient:
+    """Клиент модели с объединением запросов, лимитом и кэшем.
+
+    Запросы со всех потоков и event loop попадают в одну очередь;
+    поток-сборщик ждет до INFERENCE_MAX_WAIT, набирая пачку до
+    INFERENCE_BATCH_SIZE текстов, и отдает ее в пул, где одновременно
+    идет не больше INFERENCE_MAX_IN_FLIGHT запросов к модели - когда
+    пул занят, сборщик ждет, а пачки растут. Повторы текста в пачке
+    отправляются один раз, известные ответы берутся из кэша.
+
+    parse(output) превращает ответ модели в результат или None; при
+    None, ошибке или таймауте результат дают локальные правила
+    fallback(texts), такие ответы не кэшируются.
+    """
+
+    def __init__(self, task, fallback, parse, backend=None, parameters=None,
+                 batch_size=INFERENCE_BATCH_SIZE, max_wait=INFERENCE_MAX_WAIT,
+                 max_in_flight=INFERENCE_MAX_IN_FLIGHT, timeout=INFERENCE_TIMEOUT, cache=None):
+        self.task = task
+        self.fallback = fallback
+        self.parse = parse
+        self.backend = backend or HTTPBackend(timeout=timeout)
+        self.parameters = parameters
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.cache = cache or InferenceCache(task)
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f'inference-{task}')
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'cache_hits': 0, 'batches': 0, 'model_texts': 0, 'fallbacks': 0, 'errors': 0}
+
+    def start(self):
+        """Запускает поток-сборщик, если он еще не запущен"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'inference-{self.task}', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """Цикл сборщика: пачка по размеру или по времени ожидания"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Пока все слоты заняты, очередь копит следующую пачку
+            self._slots.acquire()
+            self._executor.submit(self._call, batch)
+
+    def _call(self, batch):
+        """Запрос к модели для пачки (text, hash, future)"""
+        try:
+            waiting = OrderedDict()
+            for text, key, future in batch:
+                waiting.setdefault(key, (text, []))[1].append(future)
+
+            results = self.cache.get_many(list(waiting))
+            self.stats['cache_hits'] += sum(len(waiting[key][1]) for key in results)
+
+            missing = [key for key in waiting if key not in results]
+            if missing:
+                texts = [waiting[key][0] for key in missing]
+                parsed = [None] * len(missing)
+                try:
+                    outputs = self.backend.predict(texts, self.parameters)
+                    parsed = [self.parse(output) for output in outputs]
+                    self.stats['batches'] += 1
+                    self.stats['model_texts'] += len(texts)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.warning(f"⚠️ Модель {self.task} недоступна ({e}), работают локальные правила")
+
+                self.cache.put_many({key: result for key, result in zip(missing, parsed) if result is not None})
+
+                unanswered = [i for i, result in enumerate(parsed) if result is None]
+                if unanswered:
+                    self.stats['fallbacks'] += len(unanswered)
+                    local = self.fallback([texts[i] for i in unanswered])
+                    for i, result in zip(unanswered, local):
+                        parsed[i] = result
+                results.update(zip(missing, parsed))
+
+            for key, (_, futures) in waiting.items():
+                for future in futures:
+                    _deliver(future, results[key])
+        except Exception as e:
+            logger.error(f"❌ Ошибка пачки модели {self.task}: {e}")
+            for text, _, future in batch:
+                if not future.done():
+                    _deliver(future, self.fallback([text])[0])
+        finally:
+            self._slots.release()
+
+    def submit(self, text):
+        """Ставит текст в очередь и возвращает concurrent.futures.Future"""
+        self.stats['requests'] += 1
+        key = content_hash(text)
+        future = Future()
+        cached = self.cache.get_memory(key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            future.set_result(cached)
+            return future
+
+        self.start()
+        self._queue.put((text, key, future))
+        return future
+
+    def _wait_limit(self):
+        # Запас на ожидание пачки и очередь к занятым слотам
+        return self.timeout * 2 + self.max_wait + 1
+
+    def predict_many(self, texts):
+        """Результаты для пачки текстов в том же порядке (блокирующий вызов)"""
+        futures = [self.submit(text) for text in texts]
+        deadline = time.monotonic() + self._wait_limit()
+        results = []
+        for text, future in zip(texts, futures):
+            try:
+                results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+            except Exception:
+                self.stats['fallbacks'] += 1
+                results.append(self.fallback([text])[0])
+        return results
+
+    async def apredict(self, text):
+        """Результат для одного текста, не блокируя event loop"""
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.submit(text)), self._wait_limit())
+        except asyncio.TimeoutError:
+            self.stats['fallbacks'] += 1
+            return self.fallback([text])[0]
+
+    def get_stats(self):
+        """Счетчики запросов: попадания в кэш, пачки, средний размер пачки, откаты"""
+        stats = dict(self.stats)
+        stats['average_batch'] = round(stats['model_texts'] / stats['batches'], 1) if stats['batches'] else 0
+        return stats
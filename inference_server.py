@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Локальная замена модели для проверок и бенчмарков.
+
+Запуск: python inference_server.py [порт] [задержка_запроса_с] [задержка_на_текст_с]
+
+Отвечает на POST {"inputs": [...]} как zero-shot классификатор Hugging Face
+({"labels": [...], "scores": [...]} на каждый текст), метки ставит по
+локальным правилам marketplace_classifier. Задержки имитируют время
+работы модели: постоянную часть запроса и часть на каждый текст пачки.
+GET /stats - сколько пришло запросов и текстов и сколько шло одновременно.
+"""
+import sys
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from marketplace_classifier import marketplace_classifier
+
+LABELS = ['OZON', 'WB', 'YANDEX', 'OTHER']
+
+class StandInModel:
+    """Состояние сервера: задержки, доля сбоев и счетчики"""
+
+    def __init__(self, delay=0.05, per_text_delay=0.002, fail_rate=0.0):
+        self.delay = delay
+        self.per_text_delay = per_text_delay
+        self.fail_rate = fail_rate
+        self._random = random.Random(42)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'texts': 0, 'in_flight': 0, 'max_in_flight': 0, 'failed': 0}
+
+    def predict(self, texts):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['texts'] += len(texts)
+            self.stats['in_flight'] += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+            failing = self._random.random() < self.fail_rate
+        try:
+            time.sleep(self.delay + self.per_text_delay * len(texts))
+            if failing:
+                with self._lock:
+                    self.stats['failed'] += 1
+                return None
+            outputs = []
+            for text in texts:
+                label = marketplace_classifier.classify(text)
+                others = [other for other in LABELS if other != label]
+                outputs.append({
+                    'sequence': text,
+                    'labels': [label, *others],
+                    'scores': [0.91, 0.03, 0.03, 0.03]
+                })
+            return outputs
+        finally:
+            with self._lock:
+                self.stats['in_flight'] -= 1
+
+def make_handler(model):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/stats':
+                self._reply(200, model.stats)
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                inputs = body['inputs']
+            except (ValueError, KeyError):
+                self._reply(400, {'error': 'expected {"inputs": [...]}'})
+                return
+
+            single = isinstance(inputs, str)
+            outputs = model.predict([inputs] if single else inputs)
+            if outputs is None:
+                self._reply(503, {'error': 'model is currently loading'})
+            else:
+                self._reply(200, outputs[0] if single else outputs)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def start_server(port=0, delay=0.05, per_text_delay=0.002, fail_rate=0.0):
+    """Запускает сервер в фоновом потоке; возвращает (server, model, url)"""
+    model = StandInModel(delay, per_text_delay, fail_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(model))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='inference-server', daemon=True).start()
+    return server, model, f'http://127.0.0.1:{server.server_address[1]}/'
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    per_text_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.002
+
+    server, _, url = start_server(port, delay, per_text_delay)
+    print(f"🤖 Модель-заглушка: {url} (INFERENCE_URL={url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import logging
+from config import MARKETPLACE_ALIASES, MARKETPLACE_CHANNEL_ALIASES
+
+logger = logging.getLogger(__name__)
+
+# Метка для текстов без упоминания маркетплейсов
+OTHER = 'OTHER'
+
+def _compile(aliases):
+    """Таблица (метка, синонимы) в порядке приоритета, синонимы в нижнем регистре"""
+    return tuple(
+        (label, tuple(word.lower() for word in words))
+        for label, words in aliases.items() if words
+    )
+
+def _match(table, text):
+    for label, words in table:
+        for word in words:
+            if word in text:
+                return label
+    return None
+
+class MarketplaceClassifier:
+    """Определение маркетплейса по адресу канала и тексту сообщения.
+
+    Синонимы собираются в таблицу один раз при создании, текст
+    приводится к нижнему регистру один раз и проверяется поиском
+    подстрок (на CPython он быстрее общего регулярного выражения).
+    Адрес канала важнее текста; если в тексте упомянуто несколько
+    маркетплейсов, выигрывает стоящий раньше в MARKETPLACE_ALIASES.
+    """
+
+    def __init__(self, aliases=MARKETPLACE_ALIASES, channel_aliases=MARKETPLACE_CHANNEL_ALIASES):
+        self.table = _compile(aliases)
+        self.channel_table = _compile(channel_aliases)
+        self._channels = {}
+
+    def channel_label(self, channel_url):
+        """Метка по адресу канала (кэшируется: каналов немного)"""
+        if channel_url not in self._channels:
+            self._channels[channel_url] = _match(self.channel_table, (channel_url or '').lower())
+        return self._channels[channel_url]
+
+    def classify(self, text, channel_url=""):
+        """Метка маркетплейса для одного сообщения"""
+        if not text:
+            return OTHER
+        return self.channel_label(channel_url) or _match(self.table, text.lower()) or OTHER
+
+    def classify_many(self, texts, channel_url=""):
+        """Метки для пачки сообщений одного канала, в том же порядке"""
+        channel = self.channel_label(channel_url)
+        table = self.table
+        return [
+            OTHER if not text else (channel or _match(table, text.lower()) or OTHER)
+            for text in texts
+        ]
+
+def count_marketplaces(labels):
+    """Сколько сообщений у каждого маркетплейса: {'OZON': 3, 'WB': 1, ...}"""
+    stats = {'OZON': 0, 'WB': 0, 'YANDEX': 0, OTHER: 0}
+    for label in labels:
+        stats[label] = stats.get(label, 0) + 1
+    return stats
+
+# Глобальный экземпляр
+marketplace_classifier = MarketplaceClassifier()
@@ -0,0 +1,281 @@
+import zlib
+import heapq
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from storage import get_connection, transaction, ensure_columns, on_commit
+from text_processing import stem_tokens
+from config import (
+    MINHASH_PERMUTATIONS, LSH_BANDS, NEAR_DUPLICATE_THRESHOLD,
+    NEAR_DUPLICATE_WINDOW_DAYS, NEAR_DUPLICATE_INDEX_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Шинглы - тройки соседних основ слов: правка пары слов меняет лишь несколько шинглов
+SHINGLE_SIZE = 3
+
+# Хеш-функции (a * x + b) mod p с фиксированными коэффициентами: подписи
+# хранятся в базе и должны совпадать между перезапусками
+MERSENNE_PRIME = (1 << 61) - 1
+_random = np.random.RandomState(20240601)
+HASH_A = _random.randint(1, 1 << 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+HASH_B = _random.randint(0, 1 << 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+
+def _window_start():
+    """Начало окна поиска похожих в формате message_date"""
+    return (datetime.utcnow() - timedelta(days=NEAR_DUPLICATE_WINDOW_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+
+def init_near_duplicates():
+    """Колонки подписи и кластера у сообщений и таблица полос LSH"""
+    with transaction() as conn:
+        ensure_columns(conn, 'messages', [
+            ('minhash', 'BLOB'),
+            ('cluster_id', 'INTEGER')
+        ])
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                row_id INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lsh_buckets
+            ON lsh_buckets (band, bucket)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lsh_buckets_row
+            ON lsh_buckets (row_id)
+        ''')
+        # Дата сообщения у корзин: по ней корзины старше окна удаляются
+        ensure_columns(conn, 'lsh_buckets', [
+            ('message_date', 'TIMESTAMP')
+        ])
+        conn.execute('''
+            UPDATE lsh_buckets
+            SET message_date = (SELECT message_date FROM messages WHERE messages.id = lsh_buckets.row_id)
+            WHERE message_date IS NULL
+        ''')
+        conn.execute('DELETE FROM lsh_buckets WHERE message_date IS NULL')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lsh_buckets_date
+            ON lsh_buckets (message_date)
+        ''')
+
+    logger.info("✅ Индекс похожих сообщений инициализирован")
+
+def shingles(text):
+    """Множество шинглов текста в виде 32-битных хешей"""
+    stems = stem_tokens(text)
+    if len(stems) < SHINGLE_SIZE:
+        grams = stems
+    else:
+        grams = [' '.join(stems[i:i + SHINGLE_SIZE]) for i in range(len(stems) - SHINGLE_SIZE + 1)]
+    return np.fromiter({zlib.crc32(gram.encode('utf-8')) for gram in grams}, dtype=np.uint64)
+
+def minhash(text):
+    """Подпись MinHash текста (uint32 на каждую перестановку) или None для пустого"""
+    values = shingles(text)
+    if not len(values):
+        return None
+    hashed = (HASH_A[:, None] * values[None, :] + HASH_B[:, None]) % MERSENNE_PRIME
+    return (hashed.min(axis=1) & 0xFFFFFFFF).astype(np.uint32)
+
+def band_keys(signature, bands=LSH_BANDS):
+    """Ключи корзин по полосам подписи (знаковые 64-битные для SQLite)"""
+    return [
+        int.from_bytes(hashlib.blake2b(part.tobytes(), digest_size=8).digest(), 'big', signed=True)
+        for part in np.array_split(signature, bands)
+    ]
+
+def similarity(left, right):
+    """Оценка сходства Жаккара по доле совпавших компонент подписей"""
+    return float(np.count_nonzero(left == right)) / len(left)
+
+class NearDuplicateIndex:
+    """Индекс LSH почти одинаковых сообщений.
+
+    Подпись MinHash делится на LSH_BANDS полос; сообщения, совпавшие
+    хотя бы в одной полосе, становятся кандидатами и сверяются по
+    подписи. Поиск идет только по корзинам нового сообщения, а не по
+    всей базе. Корзины лежат в памяти (последние сообщения за
+    NEAR_DUPLICATE_WINDOW_DAYS, не больше max_size) и в таблице
+    lsh_buckets, откуда индекс поднимается после перезапуска. Из памяти
+    сообщения вытесняются и по размеру, и по дате: старые уходят из
+    кучи дат по мере сдвига окна.
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD, max_size=NEAR_DUPLICATE_INDEX_SIZE):
+        self.threshold = threshold
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.entries = OrderedDict()
+        self.buckets = {}
+        # Куча (дата сообщения, id) для вытеснения по окну
+        self._expiry = []
+
+    def _add(self, row_id, signature, cluster_id, keys, message_date):
+        """Добавляет сообщение в корзины; вызывать под self._lock"""
+        self.entries[row_id] = (signature, cluster_id, keys, message_date)
+        for band, key in enumerate(keys):
+            self.buckets.setdefault((band, key), []).append(row_id)
+        heapq.heappush(self._expiry, (message_date, row_id))
+
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+
+        # В куче копятся записи уже вытесненных по размеру: пересобираем ее
+        if len(self._expiry) > 2 * self.max_size:
+            self._expiry = [(entry[3], row_id) for row_id, entry in self.entries.items()]
+            heapq.heapify(self._expiry)
+
+    def _remove(self, row_id):
+        """Убирает сообщение из корзин; вызывать под self._lock"""
+        _, _, keys, _ = self.entries.pop(row_id)
+        for band, key in enumerate(keys):
+            bucket = self.buckets.get((band, key))
+            if bucket:
+                bucket.remove(row_id)
+                if not bucket:
+                    del self.buckets[(band, key)]
+
+    def _expire(self, since):
+        """Вытесняет сообщения старше начала окна; вызывать под self._lock"""
+        while self._expiry and self._expiry[0][0] < since:
+            message_date, row_id = heapq.heappop(self._expiry)
+            entry = self.entries.get(row_id)
+            if entry and entry[3] == message_date:
+                self._remove(row_id)
+
+    def load(self):
+        """Поднимает индекс из базы: подписи и корзины сообщений за окно"""
+        since = _window_start()
+        rows = get_connection().execute('''
+            SELECT id, minhash, cluster_id, message_date FROM messages
+            WHERE minhash IS NOT NULL AND message_date >= ?
+            ORDER BY id DESC LIMIT ?
+        ''', (since, self.max_size)).fetchall()
+
+        keys = {}
+        if rows:
+            first_id = rows[-1][0]
+            for band, bucket, row_id in get_connection().execute(
+                'SELECT band, bucket, row_id FROM lsh_buckets WHERE row_id >= ?', (first_id,)
+            ):
+                keys.setdefault(row_id, {})[band] = bucket
+
+        with self._lock:
+            self.entries.clear()
+            self.buckets.clear()
+            self._expiry = []
+            for row_id, blob, cluster_id, message_date in reversed(rows):
+                signature = np.frombuffer(blob, dtype=np.uint32)
+                row_keys = keys.get(row_id)
+                if row_keys is None or len(row_keys) != LSH_BANDS:
+                    row_keys = dict(enumerate(band_keys(signature)))
+                self._add(row_id, signature, cluster_id, [row_keys[band] for band in range(LSH_BANDS)], message_date)
+            self._loaded = True
+
+        logger.info(f"📚 Индекс похожих сообщений: {len(rows)} сообщений за {NEAR_DUPLICATE_WINDOW_DAYS} дней")
+
+    def _best_match(self, signature, keys, pending):
+        """Самое похожее сообщение выше порога: (row_id, cluster_id) или None"""
+        candidates = set()
+        with self._lock:
+            for band, key in enumerate(keys):
+                candidates.update(self.buckets.get((band, key), ()))
+            known = {row_id: self.entries[row_id] for row_id in candidates}
+        for band, key in enumerate(keys):
+            candidates.update(pending['buckets'].get((band, key), ()))
+
+        if not candidates:
+            return None
+
+        # Все кандидаты сверяются одной операцией над матрицей подписей
+        row_ids = list(candidates)
+        entries = [known.get(row_id) or pending['entries'][row_id] for row_id in row_ids]
+        scores = np.count_nonzero(np.stack([entry[0] for entry in entries]) == signature, axis=1) / len(signature)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return row_ids[best], entries[best][1]
+
+    def assign(self, conn, rows):
+        """Назначает кластеры новым сообщениям внутри текущей транзакции.
+
+        rows - тройки (id, текст, message_date). Кластер - id первого
+        сообщения группы почти одинаковых; новое сообщение без похожих
+        открывает свой. Корзины сохраняются только у сообщений внутри
+        окна (старые из догрузки истории сверяются лишь друг с другом в
+        пределах записи). В память корзины попадают только после
+        фиксации транзакции, а в таблице в той же записи удаляются
+        корзины старше окна. Возвращает {id: cluster_id}.
+        """
+        if not self._loaded:
+            self.load()
+
+        since = _window_start()
+        with self._lock:
+            self._expire(since)
+
+        pending = {'entries': {}, 'buckets': {}}
+        clusters, updates, bucket_rows = {}, [], []
+        for row_id, text, message_date in rows:
+            signature = minhash(text)
+            if signature is None:
+                clusters[row_id] = row_id
+                updates.append((None, row_id, row_id))
+                continue
+
+            keys = band_keys(signature)
+            match = self._best_match(signature, keys, pending)
+            cluster_id = match[1] if match else row_id
+            clusters[row_id] = cluster_id
+
+            pending['entries'][row_id] = (signature, cluster_id, keys, message_date)
+            for band, key in enumerate(keys):
+                pending['buckets'].setdefault((band, key), []).append(row_id)
+                # Корзины старых сообщений (догрузка истории) load все равно не поднимет
+                if message_date >= since:
+                    bucket_rows.append((band, key, row_id, message_date))
+            updates.append((signature.tobytes(), cluster_id, row_id))
+
+        conn.executemany('UPDATE messages SET minhash = ?, cluster_id = ? WHERE id = ?', updates)
+        conn.executemany(
+            'INSERT INTO lsh_buckets (band, bucket, row_id, message_date) VALUES (?, ?, ?, ?)', bucket_rows
+        )
+        conn.execute('DELETE FROM lsh_buckets WHERE message_date < ?', (since,))
+
+        def publish():
+            with self._lock:
+                since = _window_start()
+                self._expire(since)
+                for row_id, entry in pending['entries'].items():
+                    if entry[3] >= since:
+                        self._add(row_id, *entry)
+        on_commit(publish)
+
+        return clusters
+
+    def get_stats(self):
+        """Размер индекса в памяти"""
+        with self._lock:
+            clusters = {entry[1] for entry in self.entries.values()}
+            return {'messages': len(self.entries), 'clusters': len(clusters), 'buckets': len(self.buckets)}
+
+def representatives(texts, clusters):
+    """Индексы текстов, по одному на кластер (самый длинный), в исходном порядке"""
+    best = {}
+    for i, (text, cluster_id) in enumerate(zip(texts, clusters)):
+        key = cluster_id if cluster_id is not None else ('text', i)
+        if key not in best or len(text or '') > len(texts[best[key]] or ''):
+            best[key] = i
+    return sorted(best.values())
+
+# Глобальный экземпляр
+near_duplicate_index = NearDuplicateIndex()
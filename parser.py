@@ -1,8 +1,7 @@
-import asyncio
 from pyrogram import Client
-from database import save_message, message_exists
+from async_storage import async_storage
 from ai_processor import AIProcessor
-from config import SOURCE_CHANNELS, MAIN_CHANNELS_LIMIT, DISCUSSION_CHANNELS_LIMIT
+from pipeline import ingest_channels, channel_task, registry_tasks
 
 class TelegramParser:
     def __init__(self, client: Client):
@@ -11,116 +10,39 @@ class TelegramParser:
         
     async def parse_channel(self, channel_url, limit=20):
         """Парсит указанный канал и возвращает новые сообщения"""
-        try:
-            print(f"🔍 Парсим {channel_url} (лимит: {limit})...")
-            
-            # Извлекаем username/id канала из URL
-            if channel_url.startswith('https://t.me/'):
-                channel_identifier = channel_url.replace('https://t.me/', '')
-            elif channel_url.startswith('@'):
-                channel_identifier = channel_url[1:]
-            else:
-                channel_identifier = channel_url
-                
-            messages = []
-            new_messages_count = 0
-            duplicate_count = 0
-            
-            try:
-                async for message in self.client.get_chat_history(channel_identifier, limit=limit):
-                    if message.text and message.text.strip():
-                        message_text = message.text.strip()
-                        
-                        # Проверяем, есть ли уже такое сообщение в базе
-                        if not message_exists(message_text, channel_url):
-                            # Определяем маркетплейс
-                            marketplace = self.ai_processor.analyze_marketplace(message_text, channel_url)
-                            
-                            # Сохраняем в базу
-                            save_message(message_text, channel_url, marketplace)
-                            messages.append(message_text)
-                            new_messages_count += 1
-                        else:
-                            duplicate_count += 1
-            except Exception as e:
-                print(f"⚠️ Ошибка доступа к каналу {channel_url}: {e}")
-                return {
-                    'channel': channel_url,
-                    'new_messages': 0,
-                    'duplicates': 0,
-                    'messages': [],
-                    'marketplace_stats': {},
-                    'error': str(e)
-                }
-            
-            # Статистика по маркетплейсам для новых сообщений
-            marketplace_stats = {}
-            if new_messages_count > 0:
-                for msg in messages:
-                    marketplace = self.ai_processor.analyze_marketplace(msg, channel_url)
-                    marketplace_stats[marketplace] = marketplace_stats.get(marketplace, 0) + 1
-                
-                print(f"✅ {channel_url}: {new_messages_count} новых, {duplicate_count} дубликатов")
-                if marketplace_stats:
-                    print(f"   📊 Распределение: {marketplace_stats}")
-            else:
-                print(f"✅ {channel_url}: {new_messages_count} новых, {duplicate_count} дубликатов")
-            
-            return {
-                'channel': channel_url,
-                'new_messages': new_messages_count,
-                'duplicates': duplicate_count,
-                'messages': messages,
-                'marketplace_stats': marketplace_stats
-            }
-            
-        except Exception as e:
-            print(f"❌ Ошибка парсинга {channel_url}: {e}")
-            return {
-                'channel': channel_url,
-                'new_messages': 0,
-                'duplicates': 0,
-                'messages': [],
-                'marketplace_stats': {},
-                'error': str(e)
-            }
+        print(f"🔍 Парсим {channel_url} (лимит: {limit})...")
+        summary = await ingest_channels(
+            self.client, [channel_task(channel_url, limit)], self.ai_processor.classify
+        )
+        result = summary['stats'][0]
+        print(f"✅ {channel_url}: {result['new_messages']} новых, {result['duplicates']} дубликатов")
+        return result
 
     async def parse_all_channels(self):
         """Парсит все каналы из конфигурации"""
-        print("📋 ОСНОВНЫЕ КАНАЛЫ (лимит: {}):".format(MAIN_CHANNELS_LIMIT))
+        # Роль и лимит каждого канала берутся из реестра, каналы парсятся
+        # параллельно, результаты идут в порядке приоритета
+        summary = await ingest_channels(
+            self.client,
+            await async_storage.read(registry_tasks),
+            self.ai_processor.classify
+        )
         
-        results = []
-        total_new_messages = 0
-        total_duplicates = 0
-        marketplace_totals = {'OZON': 0, 'WB': 0, 'YANDEX': 0, 'OTHER': 0}
+        results = summary['stats']
+        total_new_messages = summary['total_new_messages']
+        marketplace_totals = summary['marketplace_totals']
         
-        # Основные каналы (первые 3)
-        main_channels = SOURCE_CHANNELS[:3]
-        for channel in main_channels:
-            result = await self.parse_channel(channel, MAIN_CHANNELS_LIMIT)
-            result['type'] = 'main'
-            results.append(result)
-            total_new_messages += result['new_messages']
-            total_duplicates += result['duplicates']
-            
-            # Суммируем статистику по маркетплейсам
-            for marketplace, count in result['marketplace_stats'].items():
-                marketplace_totals[marketplace] += count
-        
-        print("\n💬 ДОП. КАНАЛЫ (лимит: {}):".format(DISCUSSION_CHANNELS_LIMIT))
-        
-        # Дополнительные каналы (остальные)
-        discussion_channels = SOURCE_CHANNELS[3:]
-        for channel in discussion_channels:
-            result = await self.parse_channel(channel, DISCUSSION_CHANNELS_LIMIT)
-            result['type'] = 'discussion'
-            results.append(result)
-            total_new_messages += result['new_messages']
-            total_duplicates += result['duplicates']
-            
-            # Суммируем статистику по маркетплейсам
-            for marketplace, count in result['marketplace_stats'].items():
-                marketplace_totals[marketplace] += count
+        # Результаты по группам каналов; лимит каждого канала задает реестр
+        for channel_type, title in (('main', '📋 ОСНОВНЫЕ КАНАЛЫ'), ('discussion', '💬 ДОП. КАНАЛЫ')):
+            group = [r for r in results if r['type'] == channel_type]
+            if not group:
+                continue
+            print(f"\n{title}:")
+            for r in group:
+                if r['success']:
+                    print(f"✅ {r['channel_url']}: {r['new_messages']} новых, {r['duplicates']} дубликатов")
+                else:
+                    print(f"❌ Ошибка парсинга {r['channel_url']}: {r['error']}")
         
         # Выводим итоги
         print("\n📈 ИТОГИ ПАРСИНГА:")
@@ -138,6 +60,6 @@ class TelegramParser:
         return {
             'results': results,
             'total_new_messages': total_new_messages,
-            'total_duplicates': total_duplicates,
+            'total_duplicates': summary['total_duplicates'],
             'marketplace_totals': marketplace_totals
         }
\ No newline at end of file
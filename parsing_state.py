@@ -1,91 +1,237 @@
-import sqlite3
 import logging
 from datetime import datetime
+from storage import get_connection, transaction, ensure_columns
 
 logger = logging.getLogger(__name__)
 
 def init_parsing_state():
     """Инициализирует таблицу для отслеживания состояния парсинга"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS parsing_state (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            channel_url TEXT UNIQUE NOT NULL,
-            last_message_id INTEGER DEFAULT 0,
-            last_parsed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            total_parsed INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS parsing_state (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel_url TEXT UNIQUE NOT NULL,
+                last_message_id INTEGER DEFAULT 0,
+                last_parsed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                total_parsed INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                gap_from_id INTEGER,
+                gap_to_id INTEGER,
+                backfill_status TEXT,
+                backfill_offset_id INTEGER,
+                backfill_until TIMESTAMP,
+                backfill_priority INTEGER DEFAULT 1,
+                backfill_loaded INTEGER DEFAULT 0
+            )
+        ''')
+        ensure_columns(conn, 'parsing_state', [
+            ('gap_from_id', 'INTEGER'),
+            ('gap_to_id', 'INTEGER'),
+            ('backfill_status', 'TEXT'),
+            ('backfill_offset_id', 'INTEGER'),
+            ('backfill_until', 'TIMESTAMP'),
+            ('backfill_priority', 'INTEGER DEFAULT 1'),
+            ('backfill_loaded', 'INTEGER DEFAULT 0')
+        ])
+
     logger.info("✅ Таблица состояния парсинга инициализирована")
 
 def is_first_run():
     """Проверяет, первый ли это запуск парсинга"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM parsing_state')
+    cursor = get_connection().execute('SELECT COUNT(*) FROM parsing_state')
     count = cursor.fetchone()[0]
-    
-    conn.close()
+
     return count == 0
 
 def get_channel_state(channel_url):
     """Получает состояние парсинга для канала"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT last_message_id, total_parsed FROM parsing_state 
+    cursor = get_connection().execute('''
+        SELECT last_message_id, total_parsed, gap_from_id, gap_to_id FROM parsing_state
         WHERE channel_url = ?
     ''', (channel_url,))
-    
+
     result = cursor.fetchone()
-    conn.close()
-    
+
     if result:
         return {
             'last_message_id': result[0],
             'total_parsed': result[1],
+            'gap': (result[2], result[3]) if result[2] is not None else None,
             'is_first_run': False
         }
     else:
         return {
             'last_message_id': 0,
             'total_parsed': 0,
+            'gap': None,
             'is_first_run': True
         }
 
-def update_channel_state(channel_url, last_message_id, new_messages_count):
-    """Обновляет состояние парсинга для канала"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT OR REPLACE INTO parsing_state 
-        (channel_url, last_message_id, total_parsed, last_parsed_date)
-        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-    ''', (channel_url, last_message_id, new_messages_count))
-    
-    conn.commit()
-    conn.close()
+def update_channel_state(channel_url, last_message_id, new_messages_count, gap=None):
+    """Обновляет состояние парсинга для канала.
+
+    Водяной знак last_message_id только растет, total_parsed накапливается,
+    новый разрыв в истории объединяется с уже сохраненным.
+    """
+    gap_from_id, gap_to_id = gap if gap else (None, None)
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO parsing_state
+            (channel_url, last_message_id, total_parsed, last_parsed_date, gap_from_id, gap_to_id)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
+            ON CONFLICT(channel_url) DO UPDATE SET
+                last_message_id = MAX(last_message_id, excluded.last_message_id),
+                total_parsed = total_parsed + excluded.total_parsed,
+                last_parsed_date = excluded.last_parsed_date,
+                gap_from_id = COALESCE(MIN(gap_from_id, excluded.gap_from_id), excluded.gap_from_id, gap_from_id),
+                gap_to_id = COALESCE(MAX(gap_to_id, excluded.gap_to_id), excluded.gap_to_id, gap_to_id)
+        ''', (channel_url, last_message_id, new_messages_count, gap_from_id, gap_to_id))
+
+def save_channel_batch(messages, channel_url, last_message_id, saved_before=0, gap=None):
+    """Сохраняет последнюю страницу сообщений канала и сдвигает водяной знак.
+
+    Запись страницы и обновление состояния идут одной транзакцией, поэтому
+    водяной знак никогда не опережает сохраненные сообщения. saved_before -
+    число новых сообщений из уже записанных страниц этого прохода.
+    """
+    from database import save_messages_batch
+
+    with transaction():
+        new_messages = save_messages_batch(messages, channel_url)
+        update_channel_state(channel_url, last_message_id, saved_before + len(new_messages), gap)
+
+    return new_messages
+
+def request_backfill(channel_url, until_date, priority=1):
+    """Ставит канал в очередь глубокой догрузки истории до until_date.
+
+    Уже начатая догрузка продолжается с сохраненной позиции: меняются
+    только граница по дате и приоритет.
+    """
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO parsing_state (channel_url, backfill_status, backfill_until, backfill_priority)
+            VALUES (?, 'pending', ?, ?)
+            ON CONFLICT(channel_url) DO UPDATE SET
+                backfill_status = 'pending',
+                backfill_until = excluded.backfill_until,
+                backfill_priority = excluded.backfill_priority
+        ''', (channel_url, until_date, priority))
+
+def get_pending_backfills():
+    """Каналы с незавершенной догрузкой, сначала более приоритетные"""
+    cursor = get_connection().execute('''
+        SELECT channel_url, last_message_id, backfill_offset_id, backfill_until,
+               backfill_priority, backfill_loaded
+        FROM parsing_state
+        WHERE backfill_status = 'pending'
+        ORDER BY backfill_priority DESC, channel_url
+    ''')
+
+    return [
+        {
+            'channel_url': row[0],
+            'last_message_id': row[1] or 0,
+            'offset_id': row[2],
+            'until': row[3],
+            'priority': max(1, row[4] or 1),
+            'loaded': row[5] or 0
+        }
+        for row in cursor.fetchall()
+    ]
+
+def get_pending_gaps():
+    """Каналы с недогруженным разрывом между водяным знаком и новыми сообщениями"""
+    cursor = get_connection().execute('''
+        SELECT channel_url, gap_from_id, gap_to_id
+        FROM parsing_state
+        WHERE gap_from_id IS NOT NULL AND gap_to_id IS NOT NULL
+        ORDER BY channel_url
+    ''')
+
+    return [
+        {
+            'channel_url': row[0],
+            'gap': (row[1], row[2])
+        }
+        for row in cursor.fetchall()
+    ]
+
+def save_gap_page(messages, channel_url, gap, oldest_id, done):
+    """Сохраняет страницу разрыва и сужает разрыв до еще не загруженной части.
+
+    gap - разрыв (from, to), с которым работала страница; если за это
+    время парсер записал новый разрыв и они объединились, сохраненный
+    разрыв не трогается - объединенный догрузится следующим проходом.
+    Закрытый разрыв обнуляется.
+    """
+    from database import save_messages_batch
+
+    gap_from_id, gap_to_id = gap
+    remaining_to = None if done else oldest_id - 1
+    with transaction() as conn:
+        new_messages = save_messages_batch(messages, channel_url)
+        conn.execute('''
+            UPDATE parsing_state SET
+                gap_from_id = CASE WHEN ? IS NULL THEN NULL ELSE gap_from_id END,
+                gap_to_id = ?,
+                total_parsed = total_parsed + ?
+            WHERE channel_url = ? AND gap_from_id = ? AND gap_to_id = ?
+        ''', (remaining_to, remaining_to, len(new_messages), channel_url, gap_from_id, gap_to_id))
+
+    return new_messages
+
+def save_backfill_page(messages, channel_url, offset_id, loaded, done):
+    """Сохраняет страницу догрузки вместе с позицией, с которой продолжать.
+
+    Страница и контрольная точка пишутся одной транзакцией: после падения
+    догрузка продолжится со следующей страницы, ничего не потеряв.
+    """
+    from database import save_messages_batch
+
+    with transaction() as conn:
+        new_messages = save_messages_batch(messages, channel_url)
+        conn.execute('''
+            UPDATE parsing_state SET
+                backfill_offset_id = ?,
+                backfill_loaded = backfill_loaded + ?,
+                backfill_status = ?,
+                total_parsed = total_parsed + ?
+            WHERE channel_url = ?
+        ''', (offset_id, loaded, 'done' if done else 'pending', len(new_messages), channel_url))
+
+    return new_messages
+
+def get_backfill_stats():
+    """Прогресс догрузки истории по каналам"""
+    cursor = get_connection().execute('''
+        SELECT channel_url, backfill_status, backfill_offset_id, backfill_until,
+               backfill_priority, backfill_loaded
+        FROM parsing_state
+        WHERE backfill_status IS NOT NULL
+        ORDER BY backfill_priority DESC, channel_url
+    ''')
+
+    return [
+        {
+            'channel_url': row[0],
+            'status': row[1],
+            'offset_id': row[2],
+            'until': row[3],
+            'priority': row[4],
+            'loaded': row[5] or 0
+        }
+        for row in cursor.fetchall()
+    ]
 
 def get_parsing_stats():
     """Получает общую статистику парсинга"""
-    conn = sqlite3.connect('telegram_parser.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) as channels, SUM(total_parsed) as total FROM parsing_state')
+    cursor = get_connection().execute(
+        'SELECT COUNT(*) as channels, SUM(total_parsed) as total FROM parsing_state'
+    )
     result = cursor.fetchone()
-    
-    conn.close()
-    
+
     return {
         'total_channels': result[0] or 0,
         'total_messages_parsed': result[1] or 0
-    }
\ No newline at end of file
+    }
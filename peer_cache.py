@@ -0,0 +1,231 @@
+import logging
+from datetime import datetime, timedelta
+from pyrogram.errors import (
+    ChannelPrivate, ChannelInvalid, UsernameNotOccupied, UsernameInvalid, PeerIdInvalid, ChatIdInvalid
+)
+from storage import get_connection, transaction
+from async_storage import async_storage
+from rate_limiter import rate_limiter, client_account, DEFAULT_ACCOUNT
+from config import PEER_CACHE_TTL_HOURS, NEGATIVE_PEER_CACHE_TTL_HOURS
+
+logger = logging.getLogger(__name__)
+
+# Статусы отрицательных результатов и исключения, которые им соответствуют
+NEGATIVE_STATUSES = {
+    'private': ChannelPrivate,
+    'invalid': ChannelInvalid,
+    'username_invalid': UsernameInvalid,
+    'not_occupied': UsernameNotOccupied,
+}
+
+# Ошибки, после которых запись кэша могла устареть (миграция канала,
+# новый access_hash): ее стоит удалить и зарезолвить канал заново
+STALE_PEER_ERRORS = (ChannelInvalid, PeerIdInvalid, ChatIdInvalid)
+
+def init_peer_cache():
+    """Инициализирует таблицу кэша каналов.
+
+    access_hash у каждого аккаунта свой, поэтому записи хранятся по паре
+    (аккаунт, канал). Старая таблица без аккаунта - это только кэш, ее
+    проще пересоздать.
+    """
+    with transaction() as conn:
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(peer_cache)').fetchall()]
+        if columns and 'account' not in columns:
+            conn.execute('DROP TABLE peer_cache')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS peer_cache (
+                account TEXT NOT NULL,
+                channel_url TEXT NOT NULL,
+                username TEXT,
+                peer_id INTEGER,
+                access_hash INTEGER,
+                title TEXT,
+                chat_type TEXT,
+                status TEXT NOT NULL,
+                error TEXT,
+                resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account, channel_url)
+            )
+        ''')
+
+    logger.info("✅ Таблица кэша каналов инициализирована")
+
+def channel_identifier(channel_url):
+    """Извлекает username канала из URL"""
+    if channel_url.startswith('https://t.me/'):
+        return channel_url.replace('https://t.me/', '')
+    elif channel_url.startswith('@'):
+        return channel_url[1:]
+    return channel_url
+
+def get_cached_peer(channel_url, account=DEFAULT_ACCOUNT):
+    """Возвращает запись кэша, если она не устарела"""
+    row = get_connection().execute('''
+        SELECT username, peer_id, access_hash, title, chat_type, status, error, resolved_at
+        FROM peer_cache WHERE account = ? AND channel_url = ?
+    ''', (account, channel_url)).fetchone()
+
+    if not row:
+        return None
+
+    status = row[5]
+    ttl = PEER_CACHE_TTL_HOURS if status == 'ok' else NEGATIVE_PEER_CACHE_TTL_HOURS
+    resolved_at = datetime.strptime(row[7], '%Y-%m-%d %H:%M:%S')
+    if datetime.utcnow() - resolved_at > timedelta(hours=ttl):
+        return None
+
+    return {
+        'channel_url': channel_url,
+        'username': row[0],
+        'peer_id': row[1],
+        'access_hash': row[2],
+        'title': row[3],
+        'type': row[4],
+        'status': status,
+        'error': row[6]
+    }
+
+def save_peer(channel_url, peer, account=DEFAULT_ACCOUNT):
+    """Сохраняет результат резолва канала (в том числе отрицательный)"""
+    with transaction() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO peer_cache
+            (account, channel_url, username, peer_id, access_hash, title, chat_type, status, error, resolved_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (
+            account, channel_url, peer.get('username'), peer.get('peer_id'), peer.get('access_hash'),
+            peer.get('title'), peer.get('type'), peer['status'], peer.get('error')
+        ))
+
+def save_peers(peers, account=DEFAULT_ACCOUNT):
+    """Сохраняет несколько каналов одной транзакцией: {channel_url: peer}"""
+    with transaction():
+        for channel_url, peer in peers.items():
+            save_peer(channel_url, peer, account)
+
+def invalidate_peer(channel_url, account=None):
+    """Удаляет канал из кэша (всех аккаунтов или одного), чтобы он резолвился заново"""
+    with transaction() as conn:
+        if account is None:
+            conn.execute('DELETE FROM peer_cache WHERE channel_url = ?', (channel_url,))
+        else:
+            conn.execute('DELETE FROM peer_cache WHERE account = ? AND channel_url = ?', (account, channel_url))
+
+def is_stale_peer_error(error):
+    """Ошибка похожа на устаревшую запись кэша, а не на закрытый канал"""
+    return isinstance(error, STALE_PEER_ERRORS) and not getattr(error, 'peer_checked', False)
+
+async def resolve_channel(client, channel_url):
+    """Возвращает данные канала, по возможности без запроса к Telegram.
+
+    Живые записи кэша отдаются сразу, а peer подкладывается в хранилище
+    сессии Pyrogram, чтобы история запрашивалась по числовому ID без
+    повторного поиска по username. Отрицательные записи (приватный,
+    несуществующий канал) поднимают то же исключение, что и Telegram,
+    с атрибутом peer_checked: такой ответ повторный резолв не исправит.
+    """
+    cached = await async_storage.read(get_cached_peer, channel_url, client_account(client))
+
+    if cached and cached['status'] != 'ok':
+        error = NEGATIVE_STATUSES.get(cached['status'], ChannelInvalid)()
+        error.peer_checked = True
+        raise error
+
+    if cached and await _ensure_session_peer(client, cached):
+        return cached
+
+    return await _resolve_remote(client, channel_url)
+
+async def _ensure_session_peer(client, peer):
+    """Проверяет, что peer есть в хранилище сессии, и добавляет его при необходимости"""
+    try:
+        await client.storage.get_peer_by_id(peer['peer_id'])
+        return True
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning(f"⚠️ Хранилище сессии недоступно: {e}")
+        return False
+
+    if not peer.get('access_hash'):
+        return False
+
+    try:
+        await client.storage.update_peers([
+            (peer['peer_id'], peer['access_hash'], peer.get('type') or 'channel', peer.get('username'), None)
+        ])
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось добавить peer в сессию: {e}")
+        return False
+
+async def _resolve_remote(client, channel_url):
+    """Резолвит канал через Telegram и кэширует результат"""
+    username = channel_identifier(channel_url)
+    try:
+        chat = await rate_limiter.call('resolve', client.get_chat, username)
+    except tuple(NEGATIVE_STATUSES.values()) as e:
+        status = next(name for name, error in NEGATIVE_STATUSES.items() if isinstance(e, error))
+        await async_storage.run(save_peer, channel_url, {
+            'username': username, 'status': status, 'error': str(e)
+        }, client_account(client))
+        e.peer_checked = True
+        raise
+
+    peer = await _chat_peer(client, channel_url, chat)
+    await async_storage.run(save_peer, channel_url, peer, client_account(client))
+    return peer
+
+async def _chat_peer(client, channel_url, chat):
+    """Запись кэша по объекту чата; access_hash берется из хранилища сессии"""
+    username = channel_identifier(channel_url)
+    access_hash = None
+    try:
+        input_peer = await client.resolve_peer(chat.id)
+        access_hash = getattr(input_peer, 'access_hash', None)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось получить access_hash для {username}: {e}")
+
+    chat_type = getattr(chat.type, 'value', chat.type)
+    return {
+        'channel_url': channel_url,
+        'username': getattr(chat, 'username', None) or username,
+        'peer_id': chat.id,
+        'access_hash': access_hash,
+        'title': chat.title,
+        'type': chat_type if isinstance(chat_type, str) else 'channel',
+        'status': 'ok',
+        'error': None
+    }
+
+async def sweep_dialogs(client, channel_urls):
+    """Находит каналы в диалогах аккаунта одним постраничным проходом.
+
+    Каналы, на которые аккаунт подписан, попадают в кэш без get_chat
+    на каждый, а вместе с ними приходит ID последнего сообщения.
+    Возвращает {channel_url: top_message_id} для найденных каналов;
+    остальные резолвятся как обычно через resolve_channel. Проход
+    останавливается, как только найдены все каналы.
+    """
+    wanted = {channel_identifier(channel_url).lower(): channel_url for channel_url in channel_urls}
+    found = {}
+    async for dialog in rate_limiter.iter_dialogs(client):
+        username = (getattr(dialog.chat, 'username', None) or '').lower()
+        channel_url = wanted.get(username)
+        if channel_url is None or channel_url in found:
+            continue
+        found[channel_url] = dialog
+        if len(found) == len(wanted):
+            break
+
+    peers = {}
+    tops = {}
+    for channel_url, dialog in found.items():
+        peers[channel_url] = await _chat_peer(client, channel_url, dialog.chat)
+        tops[channel_url] = dialog.top_message.id if dialog.top_message else None
+
+    await async_storage.run(save_peers, peers, client_account(client))
+    logger.info(f"📇 Диалоги ({client_account(client)}): найдено {len(found)} из {len(wanted)} каналов")
+    return tops
@@ -0,0 +1,501 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from pyrogram.errors import ChannelPrivate, ChannelInvalid, UsernameNotOccupied
+from async_storage import async_storage
+from database import message_record, content_hash
+from marketplace_classifier import marketplace_classifier
+from ai_processor import AIProcessor, marketplace_model
+from history_fetcher import IncrementalHistory
+from channel_fanout import gather_channels
+from peer_cache import resolve_channel, sweep_dialogs, channel_identifier, invalidate_peer, is_stale_peer_error
+from rate_limiter import client_account
+from session_pool import session_pool
+from backfill import backfiller
+from channel_registry import get_channels, record_polls
+from post_ingest import post_ingest
+from config import (
+    PIPELINE_QUEUE_SIZE, INCREMENTAL_MAX_MESSAGES, DIALOG_SWEEP_MIN_CHANNELS,
+    INFERENCE_BATCH_SIZE, INFERENCE_MAX_IN_FLIGHT
+)
+
+logger = logging.getLogger(__name__)
+
+# Маркер конца потока в очереди между стадиями
+END = object()
+
+# Сколько сообщений одновременно ждут ответа модели в стадии classify
+CLASSIFY_WINDOW = INFERENCE_BATCH_SIZE * INFERENCE_MAX_IN_FLIGHT
+
+# Ошибки доступа к каналу: текст для статистики и для лога
+CHANNEL_ERRORS = (
+    (ChannelPrivate, 'Private channel', 'Канал приватный: нет доступа'),
+    (ChannelInvalid, 'Invalid channel', 'Неверный канал: не существует'),
+    (UsernameNotOccupied, 'Username not occupied', 'Канал не существует'),
+)
+
+class Pipeline:
+    """Конвейер из асинхронных стадий, соединенных очередями.
+
+    Стадия - функция, которая принимает асинхронный итератор входных
+    элементов и возвращает асинхронный генератор выходных. Каждая стадия
+    работает в своей задаче, между стадиями стоят очереди на queue_size
+    элементов: если запись не успевает, загрузка останавливается на put,
+    а не копит сообщения в памяти. Для каждой стадии считается
+    собственное время работы без ожидания соседей.
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.stats = {}
+
+    def replace(self, name, stage):
+        """Подменяет стадию по имени"""
+        self.stages = [(n, stage if n == name else s) for n, s in self.stages]
+        return self
+
+    def insert_after(self, name, new_name, stage):
+        """Вставляет стадию после указанной"""
+        index = [n for n, _ in self.stages].index(name) + 1
+        self.stages.insert(index, (new_name, stage))
+        return self
+
+    async def run(self, items):
+        """Прогоняет items через все стадии и возвращает выход последней"""
+        self.stats = {name: _empty_stats() for name, _ in self.stages}
+        queues = [asyncio.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        results = []
+
+        tasks = [asyncio.ensure_future(self._feed(items, queues[0]))]
+        for i, (name, stage) in enumerate(self.stages):
+            tasks.append(asyncio.ensure_future(
+                self._run_stage(name, stage, queues[i], queues[i + 1])
+            ))
+        tasks.append(asyncio.ensure_future(self._collect(queues[-1], results)))
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Ошибка одной стадии останавливает весь конвейер
+            for task in tasks:
+                task.cancel()
+
+        return results
+
+    async def _feed(self, items, outbox):
+        for item in items:
+            await outbox.put(item)
+        await outbox.put(END)
+
+    async def _collect(self, inbox, results):
+        while True:
+            item = await inbox.get()
+            if item is END:
+                return
+            results.append(item)
+
+    async def _run_stage(self, name, stage, inbox, outbox):
+        stats = self.stats[name]
+        started = time.perf_counter()
+        try:
+            async for item in stage(self._read(inbox, stats)):
+                waited = time.perf_counter()
+                await outbox.put(item)
+                stats['wait_time'] += time.perf_counter() - waited
+                stats['items_out'] += 1
+            await outbox.put(END)
+        finally:
+            stats['total_time'] = time.perf_counter() - started
+
+    async def _read(self, inbox, stats):
+        """Читает вход стадии, не засчитывая ожидание в ее время"""
+        while True:
+            waited = time.perf_counter()
+            item = await inbox.get()
+            stats['wait_time'] += time.perf_counter() - waited
+            if item is END:
+                return
+            stats['items_in'] += 1
+            yield item
+
+def _empty_stats():
+    return {'items_in': 0, 'items_out': 0, 'total_time': 0.0, 'wait_time': 0.0}
+
+def format_pipeline_stats(stats):
+    """Форматирует время стадий конвейера для отчетов"""
+    lines = []
+    for name, item in stats.items():
+        busy = max(0.0, item['total_time'] - item['wait_time'])
+        lines.append(
+            f"   {name}: {item['items_in']} → {item['items_out']}, "
+            f"работа {busy:.2f} с, ожидание {item['wait_time']:.2f} с"
+        )
+    return lines
+
+def channel_task(channel_url, limit, channel_type='main', regular_limit=INCREMENTAL_MAX_MESSAGES):
+    """Описание канала для конвейера: limit - при первом запуске, regular_limit - потом"""
+    return {
+        'channel_url': channel_url,
+        'limit': limit,
+        'regular_limit': regular_limit,
+        'type': channel_type
+    }
+
+def registry_tasks(initial_limit=None, due_only=False):
+    """Задачи конвейера по реестру каналов.
+
+    У каждого канала свой лимит загрузки fetch_limit; initial_limit, если
+    задан, ограничивает только первый запуск. due_only - только каналы,
+    которым по расписанию пора на опрос.
+    """
+    return [
+        channel_task(
+            channel['channel_url'],
+            initial_limit or channel['fetch_limit'],
+            channel['role'],
+            regular_limit=channel['fetch_limit']
+        )
+        for channel in get_channels(due_only)
+    ]
+
+def _done_event(task, error=None):
+    """Событие завершения канала"""
+    return {
+        'event': 'done',
+        'channel_url': task['channel_url'],
+        'channel': channel_identifier(task['channel_url']),
+        'type': task['type'],
+        'account': None,
+        'title': None,
+        'is_first_run': None,
+        'top_message_id': None,
+        'gap': None,
+        'error': error
+    }
+
+def fetch_stage(client=None):
+    """Загрузка новых сообщений каналов параллельно через gather_channels.
+
+    Для каждого сообщения выдает событие 'message', по завершении
+    канала - событие 'done' с водяным знаком и разрывом истории. Без
+    client каналы распределяются по сессиям session_pool; если аккаунт
+    заблокирован или надолго ушел в FloodWait, канал переходит на
+    следующий аккаунт.
+
+    При DIALOG_SWEEP_MIN_CHANNELS и больше каналов каждый аккаунт один
+    раз читает свой список диалогов: подписанные каналы резолвятся из
+    него, а каналы, у которых последнее сообщение не новее водяного
+    знака, пропускаются без запроса истории.
+    """
+    async def stage(tasks):
+        tasks = [task async for task in tasks]
+        output = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        by_url = {task['channel_url']: task for task in tasks}
+        sweeps = {}
+
+        async def sweep(channel_client):
+            try:
+                return await sweep_dialogs(channel_client, list(by_url))
+            except Exception as e:
+                logger.warning(f"⚠️ Список диалогов недоступен ({e}), каналы резолвятся по одному")
+                return {}
+
+        async def dialog_tops(account, channel_client):
+            if len(by_url) < DIALOG_SWEEP_MIN_CHANNELS:
+                return {}
+            # Один проход на аккаунт, остальные каналы ждут его результата
+            if account not in sweeps:
+                sweeps[account] = asyncio.ensure_future(sweep(channel_client))
+            return await asyncio.shield(sweeps[account])
+
+        async def fetch(channel_client, task, done):
+            channel_url = task['channel_url']
+            tops = await dialog_tops(done['account'], channel_client)
+            peer = await resolve_channel(channel_client, channel_url)
+            done['title'] = peer['title']
+
+            channel_state = await async_storage.get_channel_state(channel_url)
+            done['is_first_run'] = channel_state['is_first_run']
+            limit = task['limit'] if channel_state['is_first_run'] else task['regular_limit']
+
+            history = IncrementalHistory(
+                channel_client, peer['peer_id'], channel_state['last_message_id'], limit, tops.get(channel_url)
+            )
+            async for message in history:
+                await output.put({'event': 'message', 'channel_url': channel_url, 'message': message})
+
+            done['top_message_id'] = history.top_message_id or None
+            done['gap'] = history.gap
+
+        async def worker(channel_url):
+            task = by_url[channel_url]
+            done = _done_event(task)
+            logger.info(f"🔍 Парсим: {done['channel']}")
+            tried = set()
+            reresolved = False
+            while True:
+                if client is not None:
+                    account, channel_client = client_account(client), client
+                else:
+                    account, channel_client = await session_pool.client_for(channel_url, tried)
+                done['account'] = account
+
+                try:
+                    await fetch(channel_client, task, done)
+                    break
+                except Exception as e:
+                    # Запись кэша устарела: удаляем ее и один раз резолвим канал заново.
+                    # FloodWait, таймауты и сбои сети кэш не трогают
+                    if is_stale_peer_error(e):
+                        await async_storage.run(invalidate_peer, channel_url, account)
+                    if not reresolved and is_stale_peer_error(e):
+                        reresolved = True
+                        logger.warning(f"   ⚠️ {done['channel']}: кэш канала устарел ({e}), резолвим заново")
+                        continue
+
+                    channel_error = next(
+                        ((text, description) for error, text, description in CHANNEL_ERRORS if isinstance(e, error)), None
+                    )
+                    if channel_error:
+                        logger.error(f"   ❌ {done['channel']}: {channel_error[1]}")
+                        done['error'] = channel_error[0]
+                        break
+                    if client is None and session_pool.report_failure(account, e):
+                        # Уже загруженное не дублируется: запись идет по (peer_id, message_id)
+                        tried.add(account)
+                        continue
+                    raise
+            await output.put(done)
+
+        def on_error(channel_url, error):
+            return {'channel_url': channel_url, 'error': error}
+
+        async def run_channels():
+            try:
+                failed = await gather_channels(list(by_url), worker, on_error)
+                # Для упавших каналов событие 'done' не отправлено
+                for item in failed:
+                    if item:
+                        await output.put(_done_event(by_url[item['channel_url']], item['error']))
+            finally:
+                await output.put(END)
+
+        runner = asyncio.ensure_future(run_channels())
+        try:
+            while True:
+                item = await output.get()
+                if item is END:
+                    break
+                yield item
+            await runner
+        finally:
+            runner.cancel()
+            for future in sweeps.values():
+                future.cancel()
+
+    return stage
+
+def normalize_stage():
+    """Отбрасывает сообщения без текста и собирает записи для базы"""
+    async def stage(items):
+        counts = {}
+        async for item in items:
+            channel_url = item['channel_url']
+            if item['event'] == 'done':
+                item['total_messages'] = counts.pop(channel_url, 0)
+                yield item
+                continue
+
+            message = item['message']
+            if not message.text or not message.text.strip():
+                continue
+            counts[channel_url] = counts.get(channel_url, 0) + 1
+            yield {'event': 'message', 'channel_url': channel_url, 'record': message_record(message)}
+
+    return stage
+
+def dedup_stage():
+    """Убирает повторы текста внутри одного канала еще до записи в базу"""
+    async def stage(items):
+        seen = set()
+        async for item in items:
+            if item['event'] == 'message':
+                key = (item['channel_url'], content_hash(item['record']['text']))
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield item
+
+    return stage
+
+def classify_stage(classifier=None, window=CLASSIFY_WINDOW):
+    """Определяет маркетплейс; classifier(text, channel_url) можно подменить.
+
+    Асинхронный classifier (модель через AIProcessor.classify) вызывается
+    для window сообщений сразу, чтобы их запросы успели собраться в
+    пачки; порядок элементов на выходе не меняется.
+    """
+    if classifier is None:
+        classifier = AIProcessor().classify if marketplace_model else marketplace_classifier.classify
+
+    if not asyncio.iscoroutinefunction(classifier):
+        async def stage(items):
+            async for item in items:
+                if item['event'] == 'message':
+                    item['record']['marketplace'] = classifier(item['record']['text'], item['channel_url'])
+                yield item
+
+        return stage
+
+    async def stage(items):
+        pending = deque()
+        async for item in items:
+            task = None
+            if item['event'] == 'message':
+                task = asyncio.ensure_future(classifier(item['record']['text'], item['channel_url']))
+            pending.append((item, task))
+
+            while pending and (len(pending) >= window or pending[0][1] is None or pending[0][1].done()):
+                ready, task = pending.popleft()
+                if task is not None:
+                    ready['record']['marketplace'] = await task
+                yield ready
+
+        while pending:
+            ready, task = pending.popleft()
+            if task is not None:
+                ready['record']['marketplace'] = await task
+            yield ready
+
+    return stage
+
+def persist_stage(storage=async_storage):
+    """Пишет записи страницами; новый водяной знак - вместе с последней страницей"""
+    async def stage(items):
+        writers = {}
+        async for item in items:
+            channel_url = item['channel_url']
+            if channel_url not in writers:
+                writers[channel_url] = storage.channel_writer(channel_url)
+            writer = writers[channel_url]
+
+            if item['event'] == 'message':
+                writer.add(item['record'])
+                continue
+
+            del writers[channel_url]
+            if item['error'] or item['top_message_id'] is None:
+                # Загруженное сохраняем, но водяной знак не двигаем
+                saved = await writer.flush()
+            else:
+                saved = await writer.flush(item['top_message_id'], item['gap'])
+            item['saved'] = saved
+            yield item
+
+    return stage
+
+def emit_stage():
+    """Собирает итог по каждому каналу"""
+    async def stage(items):
+        async for item in items:
+            saved = item.get('saved', [])
+            marketplace_stats = {}
+            for message in saved:
+                marketplace_stats[message['marketplace']] = marketplace_stats.get(message['marketplace'], 0) + 1
+
+            total = item.get('total_messages', 0)
+            result = {
+                'channel': item['channel'],
+                'channel_url': item['channel_url'],
+                'title': item['title'],
+                'type': item['type'],
+                'account': item['account'],
+                'is_first_run': item['is_first_run'],
+                'new_messages': len(saved),
+                'total_messages': total,
+                'total_processed': total,
+                'duplicates': total - len(saved),
+                'messages': [message['text'] for message in saved],
+                'labels': [message['marketplace'] for message in saved],
+                'clusters': [message.get('cluster_id') for message in saved],
+                'marketplace_stats': marketplace_stats,
+                'gap': item['gap'],
+                'success': item['error'] is None,
+                'error': item['error']
+            }
+
+            if result['success']:
+                logger.info(f"   ✅ {result['channel']}: {result['new_messages']} новых из {total} сообщений")
+                for i, text in enumerate(result['messages'][:2], 1):
+                    logger.info(f"      📨 {i}. {text[:80]}...")
+            yield result
+
+    return stage
+
+def default_stages(client=None, classifier=None):
+    """Стадии по умолчанию: fetch → normalize → dedup → classify → persist → emit"""
+    return [
+        ('fetch', fetch_stage(client)),
+        ('normalize', normalize_stage()),
+        ('dedup', dedup_stage()),
+        ('classify', classify_stage(classifier)),
+        ('persist', persist_stage()),
+        ('emit', emit_stage()),
+    ]
+
+async def ingest_channels(client, tasks, classifier=None, pipeline=None):
+    """Загружает каналы через конвейер и возвращает сводку.
+
+    tasks - список channel_task(); client=None - каналы делятся между
+    сессиями USER_SESSIONS. Результаты каналов идут в порядке tasks,
+    независимо от того, какой канал закончился раньше.
+    """
+    if pipeline is None:
+        pipeline = Pipeline(default_stages(client, classifier))
+
+    results = await pipeline.run(tasks)
+    order = {task['channel_url']: i for i, task in enumerate(tasks)}
+    results.sort(key=lambda result: order[result['channel_url']])
+
+    marketplace_totals = {'OZON': 0, 'WB': 0, 'YANDEX': 0, 'OTHER': 0}
+    for result in results:
+        for marketplace, count in result['marketplace_stats'].items():
+            marketplace_totals[marketplace] = marketplace_totals.get(marketplace, 0) + count
+
+    # Темп публикаций каналов определяет, когда их опрашивать снова
+    await async_storage.run(record_polls, results)
+
+    # Разрывы истории (новых сообщений было больше лимита) догружаются в фоне
+    gaps = [result['channel_url'] for result in results if result.get('gap')]
+    if gaps and not backfiller.running:
+        logger.info(f"🧩 Разрывы в истории: {len(gaps)} каналов, запускаем догрузку")
+        backfiller.start(client)
+
+    messages = [text for result in results for text in result['messages']]
+    labels = [label for result in results for label in result['labels']]
+    clusters = [cluster for result in results for cluster in result['clusters']]
+
+    # Темы, дайджест и тренды дорабатываются вне транзакций потока-писателя
+    if messages:
+        await post_ingest.run()
+
+    stage_lines = format_pipeline_stats(pipeline.stats)
+    logger.info("⏱️ Стадии конвейера:")
+    for line in stage_lines:
+        logger.info(line)
+
+    return {
+        'messages': messages,
+        'labels': labels,
+        'clusters': clusters,
+        'stats': results,
+        'total_new_messages': len(messages),
+        'total_messages': len(messages),
+        'total_duplicates': sum(result['duplicates'] for result in results),
+        'successful_channels': sum(1 for result in results if result['success']),
+        'total_channels': len(results),
+        'marketplace_totals': marketplace_totals,
+        'stage_stats': pipeline.stats
+    }
@@ -81,6 +81,14 @@ class PostFormatter:
             
             lines.append("")
         
+        # Что нового: растущие за неделю термы
+        trends = data.get('trends', {})
+        if trends:
+            lines.append("📈 **Что нового:**")
+            for marketplace, terms in trends.items():
+                lines.append(f"{self._get_marketplace_emoji(marketplace)} {marketplace}: {', '.join(terms)}")
+            lines.append("")
+        
         # Рекомендации
         recommendations = data.get('recommendations', '')
         if recommendations:
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from topic_clustering import topic_model
+from digest_state import digest_state
+from trends import trend_detector
+from config import TOPIC_CLUSTERING_ENABLED, RUNNING_DIGEST_ENABLED, TRENDS_ENABLED
+
+logger = logging.getLogger(__name__)
+
+class PostIngest:
+    """Доработка производных состояний после записи новых сообщений.
+
+    Общий шаг для всех путей записи: конвейер дожидается обновления,
+    push-прием и догрузка истории ставят его в очередь и идут дальше.
+    Темы, накопительный дайджест и эскизы трендов обновляются в
+    отдельном потоке, а не в потоке-писателе async_storage: там вызов
+    попал бы в групповую транзакцию, и вся догонка держала бы блокировку
+    записи. Здесь каждая пачка обновления - своя транзакция, и запись
+    сообщений идет между пачками. Запросы, пришедшие, пока обновление
+    ждет очереди, объединяются в одно.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='post-ingest')
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def submit(self):
+        """Ставит обновление в очередь и возвращает concurrent.futures.Future,
+        которого можно не дожидаться"""
+        with self._lock:
+            if self._pending is None:
+                self._pending = self._executor.submit(self._run)
+            return self._pending
+
+    async def run(self):
+        """Обновляет состояния и дожидается результата"""
+        return await asyncio.wrap_future(self.submit())
+
+    def _run(self):
+        # С этого момента новые сообщения требуют следующего обновления
+        with self._lock:
+            self._pending = None
+
+        summary = {}
+
+        # Новые сообщения сразу размечаются темами: дайджест не пересчитывает историю
+        if TOPIC_CLUSTERING_ENABLED:
+            try:
+                summary['topics'] = topic_model.update()
+            except Exception as e:
+                logger.error(f"❌ Ошибка разметки тем: {e}")
+
+        # И дорабатывают накопительный дайджест: пост потом только читает состояние
+        if RUNNING_DIGEST_ENABLED:
+            try:
+                summary['digest'] = digest_state.update()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления дайджеста: {e}")
+
+        # И эскизы трендов: запрос растущих термов только складывает дни
+        if TRENDS_ENABLED:
+            try:
+                summary['trends'] = trend_detector.update()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления трендов: {e}")
+
+        return summary
+
+# Глобальный экземпляр
+post_ingest = PostIngest()
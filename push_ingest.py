@@ -0,0 +1,263 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from pyrogram import filters
+from pyrogram.handlers import MessageHandler, EditedMessageHandler
+from async_storage import async_storage
+from database import message_record
+from marketplace_classifier import marketplace_classifier
+from peer_cache import resolve_channel
+from post_ingest import post_ingest
+from pipeline import ingest_channels, channel_task
+from telegram_manager import telegram_manager
+from channel_registry import get_channel_urls
+from config import (
+    PUSH_QUEUE_SIZE, PUSH_BATCH_SIZE,
+    PUSH_FLUSH_INTERVAL, GAP_FILL_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений догружать при первом опросе нового канала
+GAP_FILL_FIRST_RUN_LIMIT = 10
+
+class PushIngestor:
+    """Прием новых сообщений каналов через обновления Telegram.
+
+    Пользовательский клиент подписывается на новые и отредактированные
+    сообщения каналов из реестра каналов. Обработчик только кладет
+    сообщение в очередь, а отдельная задача пишет их пачками по
+    PUSH_BATCH_SIZE или раз в PUSH_FLUSH_INTERVAL секунд.
+
+    Водяной знак канала push двигает только по непрерывной цепочке ID:
+    если сообщение пришло с пропуском (клиент был отключен, очередь
+    переполнилась), знак стоит на месте, и пропуск догружает
+    периодический опрос истории через общий конвейер.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.channels = {}
+        self.watermarks = {}
+        self.queue = None
+        self.tasks = []
+        self.handlers = []
+        self._gap_fill_needed = None
+        self.stats = {
+            'received': 0,
+            'edits': 0,
+            'saved': 0,
+            'dropped': 0,
+            'batches': 0,
+            'gap_fills': 0,
+            'last_latency': None,
+            'last_message_at': None
+        }
+
+    @property
+    def running(self):
+        return bool(self.tasks)
+
+    async def start(self):
+        """Подписывается на обновления и запускает запись и опрос пропусков"""
+        if self.running:
+            return
+
+        self.queue = asyncio.Queue(PUSH_QUEUE_SIZE)
+        self._gap_fill_needed = asyncio.Event()
+        await self._attach(await telegram_manager.get_user_client())
+
+        self.tasks = [
+            asyncio.ensure_future(self._consume()),
+            asyncio.ensure_future(self._gap_fill_loop())
+        ]
+        logger.info(f"📡 Push-режим запущен: {len(self.channels)} каналов")
+
+    async def stop(self):
+        """Отписывается от обновлений и дописывает очередь"""
+        tasks, self.tasks = self.tasks, []
+        self._detach()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Все, что успело прийти, сохраняем
+        batch = []
+        while self.queue and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await self._persist(batch)
+        logger.info("🛑 Push-режим остановлен")
+
+    async def _attach(self, client):
+        """Резолвит каналы и вешает обработчики на клиента"""
+        self._detach()
+        self.client = client
+        self.channels = {}
+
+        for channel_url in await async_storage.read(get_channel_urls):
+            try:
+                peer = await resolve_channel(client, channel_url)
+                self.channels[peer['peer_id']] = channel_url
+            except Exception as e:
+                logger.error(f"   ❌ {channel_url}: не удалось подписаться ({e})")
+
+        for channel_url in self.channels.values():
+            state = await async_storage.get_channel_state(channel_url)
+            self.watermarks[channel_url] = max(self.watermarks.get(channel_url, 0), state['last_message_id'])
+
+        if not self.channels:
+            return
+
+        chat_filter = filters.chat(list(self.channels))
+        self.handlers = [
+            client.add_handler(MessageHandler(self._on_message, chat_filter)),
+            client.add_handler(EditedMessageHandler(self._on_edit, chat_filter))
+        ]
+
+    def _detach(self):
+        if self.client:
+            for handler, group in self.handlers:
+                try:
+                    self.client.remove_handler(handler, group)
+                except Exception:
+                    pass
+        self.handlers = []
+
+    async def _on_message(self, client, message):
+        self._enqueue(message, edited=False)
+
+    async def _on_edit(self, client, message):
+        self._enqueue(message, edited=True)
+
+    def _enqueue(self, message, edited):
+        """Кладет сообщение в очередь, не блокируя диспетчер обновлений"""
+        self.stats['edits' if edited else 'received'] += 1
+        try:
+            self.queue.put_nowait((message, edited))
+        except asyncio.QueueFull:
+            # Потерянное сообщение догрузит опрос истории
+            self.stats['dropped'] += 1
+            self._gap_fill_needed.set()
+
+    async def _consume(self):
+        """Собирает сообщения из очереди в пачки и пишет их"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + PUSH_FLUSH_INTERVAL
+            while len(batch) < PUSH_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._persist(batch)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи push-сообщений: {e}")
+                self._gap_fill_needed.set()
+
+    async def _persist(self, batch):
+        """Пишет пачку: по каналу - одна транзакция вместе с водяным знаком"""
+        by_channel = {}
+        for message, edited in batch:
+            channel_url = self.channels.get(message.chat.id if message.chat else None)
+            if channel_url:
+                by_channel.setdefault(channel_url, []).append((message, edited))
+
+        for channel_url, items in by_channel.items():
+            text_messages = []
+            new_ids = []
+            for message, edited in items:
+                if not edited:
+                    new_ids.append(message.id)
+                if message.text and message.text.strip():
+                    text_messages.append(message)
+
+            labels = marketplace_classifier.classify_many([message.text for message in text_messages], channel_url)
+            records = [message_record(message, label) for message, label in zip(text_messages, labels)]
+
+            last_message_id = self._next_watermark(channel_url, new_ids)
+            if last_message_id:
+                saved = await async_storage.save_channel_batch(records, channel_url, last_message_id)
+                # Знак в памяти двигается только после фиксации записи
+                self.watermarks[channel_url] = max(self.watermarks.get(channel_url, 0), last_message_id)
+            elif records:
+                saved = await async_storage.save_messages_batch(records, channel_url)
+            else:
+                saved = []
+
+            self.stats['batches'] += 1
+            self.stats['saved'] += len(saved)
+            if saved:
+                newest = max(saved, key=lambda m: m['message_id'] or 0)
+                if newest['date']:
+                    self.stats['last_latency'] = (datetime.now(timezone.utc) - newest['date'].astimezone(timezone.utc)).total_seconds()
+                self.stats['last_message_at'] = time.time()
+                logger.info(f"   📥 {channel_url}: +{len(saved)} новых (push)")
+                # Темы, дайджест и тренды дорабатываются в фоне, как после опроса
+                post_ingest.submit()
+
+    def _next_watermark(self, channel_url, message_ids):
+        """Новый водяной знак по непрерывной цепочке ID или None; при разрыве - опрос"""
+        watermark = self.watermarks.get(channel_url, 0)
+        advanced = watermark
+        for message_id in sorted(set(message_ids)):
+            if message_id <= advanced:
+                continue
+            if watermark and message_id == advanced + 1:
+                advanced = message_id
+            else:
+                self._gap_fill_needed.set()
+                break
+
+        return advanced if advanced > watermark else None
+
+    async def _gap_fill_loop(self):
+        """Опрос истории от водяного знака: при старте, по таймеру и после разрывов"""
+        while True:
+            try:
+                await self.gap_fill()
+            except Exception as e:
+                logger.error(f"❌ Ошибка догрузки пропусков: {e}")
+
+            self._gap_fill_needed.clear()
+            try:
+                await asyncio.wait_for(self._gap_fill_needed.wait(), GAP_FILL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def gap_fill(self):
+        """Догружает пропущенные сообщения через конвейер и обновляет водяные знаки"""
+        client = await telegram_manager.get_user_client()
+        if client is not self.client:
+            # Клиент пересоздан - обработчики нужно повесить заново
+            logger.info("🔄 Клиент переподключен, подписываемся заново")
+            await self._attach(client)
+
+        if not self.channels:
+            return
+
+        tasks = [channel_task(channel_url, GAP_FILL_FIRST_RUN_LIMIT) for channel_url in self.channels.values()]
+        summary = await ingest_channels(client, tasks)
+        self.stats['gap_fills'] += 1
+        self.stats['saved'] += summary['total_new_messages']
+
+        for channel_url in self.channels.values():
+            state = await async_storage.get_channel_state(channel_url)
+            self.watermarks[channel_url] = max(self.watermarks.get(channel_url, 0), state['last_message_id'])
+
+        if summary['total_new_messages']:
+            logger.info(f"🧩 Догружено пропущенных сообщений: {summary['total_new_messages']}")
+
+    def get_stats(self):
+        """Статистика push-режима"""
+        return dict(self.stats, running=self.running, channels=len(self.channels), queued=self.queue.qsize() if self.queue else 0)
+
+# Глобальный экземпляр
+push_ingestor = PushIngestor()
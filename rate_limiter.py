@@ -0,0 +1,260 @@
+import time
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from pyrogram.errors import FloodWait
+from config import RATE_LIMITS, FLOOD_WAIT_MAX_RETRIES, FLOOD_WAIT_MAX_SECONDS, CHANNEL_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Pyrogram запрашивает историю страницами по 100 сообщений
+HISTORY_PAGE_SIZE = 100
+
+# и список диалогов - страницами по 100 диалогов
+DIALOGS_PAGE_SIZE = 100
+
+# Аккаунт для вызовов, у которых нельзя определить клиента
+DEFAULT_ACCOUNT = 'default'
+
+class TokenBucket:
+    """Ведро токенов: rate запросов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Забирает токен и возвращает, сколько секунд нужно подождать"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class RateLimiter:
+    """Общий ограничитель запросов к Telegram для всех клиентов.
+
+    Лимиты Telegram действуют на аккаунт, поэтому состояние ведется
+    отдельно для каждой сессии (по имени клиента Pyrogram). У каждого
+    класса методов (resolve - поиск по username, history - история,
+    send - отправка) свое ведро токенов. FloodWait от сервера ставит на
+    паузу все запросы этого аккаунта, после паузы вызов повторяется.
+    Для каждого класса копится время ожидания, чтобы лимиты можно было
+    поднимать до границы, за которой начинаются FloodWait.
+
+    Таймаут request_timeout действует на каждый сетевой запрос (вызов,
+    очередное сообщение истории или диалог), а не на работу с каналом
+    целиком: паузы FloodWait, ожидание токена и медленный потребитель
+    сообщений в него не входят.
+    """
+
+    def __init__(self, limits=RATE_LIMITS, request_timeout=CHANNEL_TIMEOUT):
+        self._lock = threading.Lock()
+        self.limits = limits
+        self.request_timeout = request_timeout
+        self.accounts = {}
+
+    @asynccontextmanager
+    async def _request(self):
+        """Таймаут одного сетевого запроса"""
+        try:
+            async with asyncio.timeout(self.request_timeout):
+                yield
+        except TimeoutError:
+            raise TimeoutError(f"Telegram не ответил за {self.request_timeout:g} с") from None
+
+    async def _next(self, iterator):
+        """Следующий элемент потока ответов Telegram; None - поток закончился"""
+        async with self._request():
+            try:
+                return await iterator.__anext__()
+            except StopAsyncIteration:
+                return None
+
+    @staticmethod
+    def _empty_stats():
+        return {'calls': 0, 'wait_time': 0.0, 'flood_waits': 0, 'flood_wait_time': 0.0}
+
+    def _method(self, method):
+        return method if method in self.limits else 'default'
+
+    def _account(self, account):
+        """Состояние аккаунта; вызывать под self._lock"""
+        if account not in self.accounts:
+            self.accounts[account] = {
+                'buckets': {method: TokenBucket(rate, capacity) for method, (rate, capacity) in self.limits.items()},
+                'paused_until': 0.0,
+                'stats': {method: self._empty_stats() for method in self.limits}
+            }
+        return self.accounts[account]
+
+    async def acquire(self, method, account=DEFAULT_ACCOUNT):
+        """Дожидается паузы аккаунта после FloodWait и токена своего класса"""
+        method = self._method(method)
+        started = time.monotonic()
+
+        while True:
+            with self._lock:
+                pause = self._account(account)['paused_until'] - time.monotonic()
+            if pause <= 0:
+                break
+            await asyncio.sleep(pause)
+
+        with self._lock:
+            delay = self._account(account)['buckets'][method].reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        with self._lock:
+            stats = self._account(account)['stats'][method]
+            stats['calls'] += 1
+            stats['wait_time'] += time.monotonic() - started
+
+    def on_flood_wait(self, method, seconds, account=DEFAULT_ACCOUNT):
+        """Ставит все запросы аккаунта на паузу по FloodWait"""
+        method = self._method(method)
+        with self._lock:
+            state = self._account(account)
+            state['paused_until'] = max(state['paused_until'], time.monotonic() + seconds)
+            stats = state['stats'][method]
+            stats['flood_waits'] += 1
+            stats['flood_wait_time'] += seconds
+        logger.warning(f"⏳ FloodWait {seconds} с на {method} ({account}): запросы аккаунта приостановлены")
+
+    def paused_for(self, account=DEFAULT_ACCOUNT):
+        """Сколько секунд аккаунт еще стоит на паузе после FloodWait"""
+        with self._lock:
+            return max(0.0, self._account(account)['paused_until'] - time.monotonic())
+
+    def _check_flood_wait(self, method, error, attempt, account=DEFAULT_ACCOUNT):
+        """Регистрирует FloodWait; пробрасывает ошибку, если ждать бессмысленно"""
+        seconds = error.value
+        self.on_flood_wait(method, seconds, account)
+        if attempt >= FLOOD_WAIT_MAX_RETRIES or seconds > FLOOD_WAIT_MAX_SECONDS:
+            raise error
+
+    async def call(self, method, func, *args, **kwargs):
+        """Вызывает метод клиента с учетом лимитов и повтором после FloodWait"""
+        account = client_account(getattr(func, '__self__', None))
+        attempt = 0
+        while True:
+            await self.acquire(method, account)
+            try:
+                async with self._request():
+                    return await func(*args, **kwargs)
+            except FloodWait as e:
+                attempt += 1
+                self._check_flood_wait(method, e, attempt, account)
+
+    async def iter_history(self, client, chat_id, limit=0, offset_id=0, method='history'):
+        """get_chat_history с токеном на каждую страницу.
+
+        После FloodWait чтение продолжается с последнего полученного
+        сообщения, уже отданные сообщения не повторяются. method - класс
+        лимита (у догрузки истории свой, чтобы она не съедала лимит
+        регулярного парсинга).
+        """
+        account = client_account(client)
+        yielded = 0
+        attempt = 0
+        while True:
+            await self.acquire(method, account)
+            try:
+                remaining = limit - yielded if limit else 0
+                history = client.get_chat_history(chat_id, limit=remaining, offset_id=offset_id).__aiter__()
+                while (message := await self._next(history)) is not None:
+                    yielded += 1
+                    offset_id = message.id
+                    yield message
+                    if yielded % HISTORY_PAGE_SIZE == 0:
+                        await self.acquire(method, account)
+                return
+            except FloodWait as e:
+                attempt += 1
+                self._check_flood_wait(method, e, attempt, account)
+
+    async def iter_dialogs(self, client, method='resolve'):
+        """get_dialogs с токеном на каждую страницу.
+
+        У get_dialogs нет смещения, поэтому после FloodWait список
+        читается заново, а уже отданные диалоги пропускаются.
+        """
+        account = client_account(client)
+        seen = set()
+        attempt = 0
+        while True:
+            await self.acquire(method, account)
+            try:
+                read = 0
+                dialogs = client.get_dialogs().__aiter__()
+                while (dialog := await self._next(dialogs)) is not None:
+                    read += 1
+                    if read % DIALOGS_PAGE_SIZE == 0:
+                        await self.acquire(method, account)
+                    if dialog.chat.id in seen:
+                        continue
+                    seen.add(dialog.chat.id)
+                    yield dialog
+                return
+            except FloodWait as e:
+                attempt += 1
+                self._check_flood_wait(method, e, attempt, account)
+
+    def get_stats(self):
+        """Возвращает статистику ожидания по классам методов (по всем аккаунтам)"""
+        totals = {method: self._empty_stats() for method in self.limits}
+        with self._lock:
+            for state in self.accounts.values():
+                for method, stats in state['stats'].items():
+                    for key, value in stats.items():
+                        totals[method][key] += value
+        return totals
+
+    def get_account_stats(self):
+        """Возвращает счетчики запросов по аккаунтам"""
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for account, state in self.accounts.items():
+                item = self._empty_stats()
+                for stats in state['stats'].values():
+                    for key, value in stats.items():
+                        item[key] += value
+                item['paused_for'] = max(0.0, state['paused_until'] - now)
+                result[account] = item
+        return result
+
+def client_account(client):
+    """Имя аккаунта для лимитов - имя сессии клиента Pyrogram"""
+    return getattr(client, 'name', None) or DEFAULT_ACCOUNT
+
+def format_rate_stats(stats):
+    """Форматирует статистику ограничителя для отчетов"""
+    lines = []
+    for method, item in stats.items():
+        if not item['calls'] and not item['flood_waits']:
+            continue
+        lines.append(
+            f"   {method}: {item['calls']} запросов, ожидание {item['wait_time']:.1f} с, "
+            f"FloodWait {item['flood_waits']} ({item['flood_wait_time']:.0f} с)"
+        )
+    return lines
+
+def format_account_stats(stats):
+    """Форматирует счетчики по аккаунтам для отчетов"""
+    lines = []
+    for account, item in stats.items():
+        line = (
+            f"   {account}: {item['calls']} запросов, ожидание {item['wait_time']:.1f} с, "
+            f"FloodWait {item['flood_waits']} ({item['flood_wait_time']:.0f} с)"
+        )
+        if item['paused_for'] > 0:
+            line += f", пауза еще {item['paused_for']:.0f} с"
+        lines.append(line)
+    return lines
+
+# Глобальный экземпляр
+rate_limiter = RateLimiter()
@@ -1,5 +1,4 @@
 import os
-import asyncio
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
@@ -11,13 +10,10 @@ def scheduled_post():
     try:
         logger.info("🕐 Запуск запланированной публикации...")
         
-        # Запускаем асинхронную функцию в отдельном event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+        # Запускаем бота в общем фоновом loop с постоянными клиентами
+        from telegram_runtime import telegram_runtime
         from bot_runner import run_bot
-        result = loop.run_until_complete(run_bot())
-        loop.close()
+        result = telegram_runtime.run(run_bot(), timeout=None)
         
         logger.info(f"✅ Запланированная публикация завершена: {result}")
     except Exception as e:
@@ -0,0 +1,195 @@
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+from scipy import sparse
+from storage import get_connection, transaction, ensure_columns
+from text_processing import tokenizer, stem
+
+logger = logging.getLogger(__name__)
+
+# Тональный словарь: слово -> вес от -1 (резко негативно) до 1 (резко позитивно).
+# Слова приводятся к основам, поэтому формы ("штрафы", "штрафов") учитываются сами
+LEXICON = {
+    # Позитив
+    'рост': 0.5, 'растет': 0.5, 'выросли': 0.5, 'увеличили': 0.3, 'прибыль': 0.6, 'выгодно': 0.7,
+    'выгодный': 0.7, 'выгода': 0.6, 'скидка': 0.4, 'бесплатно': 0.6, 'бесплатный': 0.6, 'бонус': 0.5,
+    'кешбэк': 0.4, 'снижение': 0.2, 'снизили': 0.3, 'снижает': 0.3, 'отменили': 0.3, 'отменяет': 0.3,
+    'упростили': 0.6, 'упрощает': 0.6, 'удобно': 0.6, 'удобный': 0.6, 'быстро': 0.5, 'быстрый': 0.5,
+    'ускорили': 0.6, 'успех': 0.8, 'успешно': 0.7, 'хорошо': 0.6, 'хороший': 0.6, 'отлично': 0.9,
+    'отличный': 0.9, 'лучше': 0.5, 'лучший': 0.7, 'рекорд': 0.6, 'рекордный': 0.6, 'поддержка': 0.3,
+    'помощь': 0.3, 'льгота': 0.6, 'льготный': 0.6, 'компенсация': 0.4, 'компенсируют': 0.4,
+    'возможность': 0.3, 'новинка': 0.3, 'улучшение': 0.6, 'улучшили': 0.6, 'развитие': 0.4,
+    'стабильно': 0.4, 'надежный': 0.5, 'доверие': 0.5, 'рады': 0.7, 'радует': 0.7, 'спасибо': 0.6,
+    'благодарим': 0.6, 'довольны': 0.7, 'качественный': 0.5, 'прозрачный': 0.4, 'вырос': 0.5,
+    'выручка': 0.3, 'акция': 0.3, 'подарок': 0.5, 'запустили': 0.3, 'доступно': 0.4,
+    # Негатив
+    'штраф': -0.7, 'штрафуют': -0.8, 'блокировка': -0.8, 'заблокировали': -0.8, 'блокируют': -0.8,
+    'запрет': -0.6, 'запрещено': -0.6, 'запрещают': -0.6, 'повышение': -0.3, 'повысили': -0.4,
+    'подорожание': -0.6, 'дорожает': -0.6, 'дороже': -0.5, 'дорого': -0.6,
+    'убыток': -0.8, 'убытки': -0.8, 'потеря': -0.6, 'потери': -0.6, 'падение': -0.6, 'упали': -0.6,
+    'проблема': -0.6, 'проблемы': -0.6, 'проблем': -0.6, 'ошибка': -0.5, 'сбой': -0.7,
+    'задержка': -0.5, 'задерживают': -0.6, 'опоздание': -0.4, 'жалоба': -0.6, 'жалобы': -0.6,
+    'недовольны': -0.7, 'плохо': -0.6, 'плохой': -0.6, 'хуже': -0.5, 'ужасно': -0.9, 'ужас': -0.8,
+    'обман': -0.9, 'мошенники': -0.9, 'мошенничество': -0.9, 'кризис': -0.7, 'риск': -0.4,
+    'риски': -0.4, 'угроза': -0.6, 'ограничение': -0.4, 'ограничили': -0.5, 'ограничат': -0.5,
+    'отказ': -0.5, 'отказали': -0.6, 'возврат': -0.2, 'брак': -0.6, 'поломка': -0.6, 'сложно': -0.4,
+    'сложности': -0.4, 'неудобно': -0.5, 'медленно': -0.4, 'ухудшение': -0.6, 'ухудшили': -0.6,
+    'санкции': -0.5, 'долги': -0.5, 'долг': -0.4, 'банкротство': -0.9, 'увольнение': -0.6,
+    'закрывается': -0.5, 'закрыли': -0.5, 'дефицит': -0.5, 'очередь': -0.3, 'очереди': -0.3,
+    'пропал': -0.5, 'пропали': -0.5, 'утеряли': -0.7, 'списали': -0.5, 'списание': -0.4,
+    'невозможно': -0.6, 'критично': -0.6, 'осторожно': -0.3, 'негатив': -0.7,
+}
+
+# Отрицание переворачивает и ослабляет вес следующего значимого слова
+NEGATIONS = frozenset(['не', 'нет', 'ни', 'без'])
+NEGATION_FACTOR = -0.7
+
+# Сообщения с тональностью по модулю меньше порога считаются нейтральными
+NEUTRAL_THRESHOLD = 0.1
+
+def init_sentiment():
+    """Колонка тональности у сообщений"""
+    with transaction() as conn:
+        ensure_columns(conn, 'messages', [
+            ('sentiment', 'REAL')
+        ])
+
+    logger.info("✅ Тональность сообщений инициализирована")
+
+class SentimentAnalyzer:
+    """Словарная оценка тональности для пачек сообщений.
+
+    Словарь один раз компилируется в таблицу основа -> номер столбца и
+    вектор весов; у каждой основы есть второй столбец для формы с
+    отрицанием. Тексты приходят массивами номеров слов общего
+    токенизатора, и номер слова переводится в столбец одной выборкой
+    numpy по таблице, которая достраивается для новых слов словаря.
+    Пачка превращается в разреженную матрицу попаданий (сообщения x
+    столбцы), и все оценки считаются двумя умножениями на вектор: сумма
+    весов и сумма их модулей. Оценка - их отношение со сглаживанием,
+    от -1 до 1.
+    """
+
+    def __init__(self, lexicon=LEXICON, smoothing=1.0):
+        self.smoothing = smoothing
+        self.columns = {}
+        weights = []
+        for word, weight in lexicon.items():
+            word_stem = stem(word)
+            if word_stem not in self.columns:
+                self.columns[word_stem] = len(weights)
+                weights.append(weight)
+
+        base = np.array(weights, dtype=np.float32)
+        self.size = len(base)
+        self.weights = np.concatenate([base, base * NEGATION_FACTOR])
+        self.magnitudes = np.abs(self.weights)
+        self._word_columns = np.zeros(0, dtype=np.int32)
+        self._word_negations = np.zeros(0, dtype=bool)
+        self._generation = tokenizer.generation
+
+    def _tables(self):
+        """Столбец и признак отрицания для каждого слова словаря токенизатора"""
+        if self._generation != tokenizer.generation:
+            self._word_columns = np.zeros(0, dtype=np.int32)
+            self._word_negations = np.zeros(0, dtype=bool)
+            self._generation = tokenizer.generation
+        columns, negations = self._word_columns, self._word_negations
+        known, total = len(columns), len(tokenizer.words)
+        if known < total:
+            words = tokenizer.words[known:total]
+            stems, stem_of = tokenizer.stems, tokenizer.stem_of
+            columns = np.concatenate([columns, np.fromiter(
+                (self.columns.get(stems[stem_of[word_id]], -1) if word else -1
+                 for word_id, word in enumerate(words, known)),
+                dtype=np.int32, count=len(words)
+            )])
+            negations = np.concatenate([negations, np.fromiter(
+                (word in NEGATIONS for word in words), dtype=bool, count=len(words)
+            )])
+            self._word_columns, self._word_negations = columns, negations
+        return columns, negations
+
+    def hits(self, token_arrays):
+        """Матрица попаданий в словарь (сообщения x столбцы)"""
+        columns, negations = self._tables()
+        lengths = np.fromiter((len(tokens) for tokens in token_arrays), dtype=np.int64, count=len(token_arrays))
+        flat = np.concatenate(token_arrays) if len(token_arrays) else np.zeros(0, dtype=np.uint32)
+        rows = np.repeat(np.arange(len(token_arrays)), lengths)
+
+        # Границы предложений не мешают отрицанию, как и раньше при разборе всего текста
+        words = flat != tokenizer.BOUNDARY
+        flat, rows = flat[words], rows[words]
+
+        # Отрицание действует на следующее слово, но не через границу сообщений
+        negated = np.zeros(len(flat), dtype=bool)
+        negated[1:] = negations[flat[:-1]] & (rows[1:] == rows[:-1])
+
+        hit = columns[flat]
+        found = hit >= 0
+        rows = rows[found]
+        columns_hit = hit[found] + np.where(negated[found], self.size, 0)
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns_hit)),
+            shape=(len(token_arrays), len(self.weights))
+        )
+
+    def score_tokens(self, token_arrays):
+        """Тональность по массивам номеров слов, от -1 до 1, в том же порядке"""
+        if not len(token_arrays):
+            return np.zeros(0, dtype=np.float32)
+        matrix = self.hits(token_arrays)
+        return (matrix @ self.weights) / (matrix @ self.magnitudes + self.smoothing)
+
+    def score_many(self, texts):
+        """Тональность каждого текста от -1 до 1, массив в том же порядке"""
+        return self.score_tokens(tokenizer.encode_many(texts))
+
+    def score(self, text):
+        return float(self.score_many([text])[0])
+
+def aggregate(scores, labels):
+    """Сводка по меткам: {'OZON': {'count', 'average', 'positive', 'negative'}, ...}"""
+    scores = np.asarray(scores, dtype=np.float32)
+    labels = np.asarray(labels)
+    summary = {}
+    for label in dict.fromkeys(labels.tolist()):
+        values = scores[labels == label]
+        summary[label] = {
+            'count': int(len(values)),
+            'average': round(float(values.mean()), 3),
+            'positive': int((values > NEUTRAL_THRESHOLD).sum()),
+            'negative': int((values < -NEUTRAL_THRESHOLD).sum())
+        }
+    return summary
+
+def get_sentiment_by_day(days=7):
+    """Средняя тональность по маркетплейсам и дням за период.
+
+    Возвращает [{'day', 'marketplace', 'count', 'average', 'positive',
+    'negative'}, ...] по возрастанию дня.
+    """
+    since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    rows = get_connection().execute('''
+        SELECT date(message_date) AS day, COALESCE(marketplace, 'OTHER'), COUNT(*), AVG(sentiment),
+               SUM(sentiment > ?), SUM(sentiment < ?)
+        FROM messages
+        WHERE message_date >= ? AND sentiment IS NOT NULL
+        GROUP BY day, COALESCE(marketplace, 'OTHER')
+        ORDER BY day, COALESCE(marketplace, 'OTHER')
+    ''', (NEUTRAL_THRESHOLD, -NEUTRAL_THRESHOLD, since)).fetchall()
+
+    return [
+        {
+            'day': row[0],
+            'marketplace': row[1],
+            'count': row[2],
+            'average': round(row[3], 3),
+            'positive': row[4],
+            'negative': row[5]
+        }
+        for row in rows
+    ]
+
+# Глобальный экземпляр
+sentiment_analyzer = SentimentAnalyzer()
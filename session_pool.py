@@ -0,0 +1,138 @@
+import bisect
+import hashlib
+import logging
+from collections import Counter
+from pyrogram.errors import (
+    FloodWait, UserDeactivated, UserDeactivatedBan, AuthKeyUnregistered,
+    SessionRevoked, SessionExpired
+)
+from rate_limiter import rate_limiter
+from telegram_manager import telegram_manager
+from config import USER_SESSIONS, REBALANCE_FLOOD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых аккаунт больше не используется до перезапуска
+BAN_ERRORS = (UserDeactivated, UserDeactivatedBan, AuthKeyUnregistered, SessionRevoked, SessionExpired)
+
+# Виртуальных точек на кольце на один аккаунт
+RING_REPLICAS = 64
+
+def _ring_hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class SessionPool:
+    """Распределение каналов между пользовательскими сессиями.
+
+    Канал закрепляется за аккаунтом консистентным хешированием: при
+    выбывании одного аккаунта переезжают только его каналы, остальные
+    остаются на своих сессиях (и в кэше каналов, где access_hash у
+    каждого аккаунта свой). Аккаунт на долгой паузе FloodWait временно
+    пропускается, заблокированный - до перезапуска процесса.
+    """
+
+    def __init__(self, sessions=USER_SESSIONS, replicas=RING_REPLICAS):
+        self.sessions = list(sessions)
+        self.banned = {}
+        # Аккаунт, который последним получил канал: повторы и ретраи не удваивают счет
+        self.owners = {}
+        self.ring = sorted(
+            (_ring_hash(f"{name}#{i}"), name)
+            for name in self.sessions
+            for i in range(replicas)
+        )
+        self._points = [point for point, _ in self.ring]
+
+    def available(self):
+        """Аккаунты, которым сейчас можно отдавать каналы"""
+        alive = [name for name in self.sessions if name not in self.banned]
+        ready = [name for name in alive if rate_limiter.paused_for(name) < REBALANCE_FLOOD_SECONDS]
+        # Если на паузе все, лучше дождаться паузы, чем не парсить вовсе
+        return ready or alive
+
+    def account_for(self, channel_url, exclude=()):
+        """Аккаунт канала: первый доступный по кольцу после хеша канала"""
+        candidates = set(self.available()) - set(exclude)
+        if not candidates:
+            return None
+
+        start = bisect.bisect(self._points, _ring_hash(channel_url))
+        for i in range(len(self.ring)):
+            name = self.ring[(start + i) % len(self.ring)][1]
+            if name in candidates:
+                return name
+        return None
+
+    def assign(self, channels):
+        """Распределение каналов по аккаунтам: {аккаунт: [каналы]}"""
+        shards = {}
+        for channel_url in channels:
+            shards.setdefault(self.account_for(channel_url), []).append(channel_url)
+        return shards
+
+    async def client_for(self, channel_url, exclude=()):
+        """Возвращает (аккаунт, клиент) для канала; недоступные сессии пропускает"""
+        exclude = set(exclude)
+        while True:
+            name = self.account_for(channel_url, exclude)
+            if name is None:
+                raise RuntimeError("Нет доступных пользовательских сессий")
+            try:
+                client = await telegram_manager.get_user_client(name)
+            except Exception as e:
+                self.report_failure(name, e)
+                exclude.add(name)
+                continue
+
+            self.owners[channel_url] = name
+            return name, client
+
+    def report_failure(self, name, error):
+        """Учитывает ошибку аккаунта. Возвращает True, если канал стоит переназначить"""
+        if isinstance(error, BAN_ERRORS):
+            if name not in self.banned:
+                self.banned[name] = str(error)
+                logger.error(f"🚫 Сессия {name} заблокирована или отозвана: {error}")
+            return True
+        if isinstance(error, FloodWait):
+            logger.warning(f"⏳ Сессия {name} на паузе FloodWait, каналы переходят на другие аккаунты")
+            return True
+        if name not in telegram_manager.clients:
+            logger.error(f"❌ Сессия {name} не запустилась: {error}")
+            return True
+        return False
+
+    def get_stats(self):
+        """Состояние аккаунтов: каналы, пауза, блокировка, запросы"""
+        accounts = rate_limiter.get_account_stats()
+        channels = Counter(self.owners.values())
+        stats = {}
+        for name in self.sessions:
+            item = accounts.get(name, {})
+            stats[name] = {
+                'channels': channels[name],
+                'calls': item.get('calls', 0),
+                'flood_waits': item.get('flood_waits', 0),
+                'paused_for': rate_limiter.paused_for(name),
+                'banned': self.banned.get(name)
+            }
+        return stats
+
+def format_session_stats(stats):
+    """Форматирует состояние аккаунтов для отчетов"""
+    lines = []
+    for name, item in stats.items():
+        if item['banned']:
+            state = "🚫 заблокирован"
+        elif item['paused_for'] > 0:
+            state = f"⏳ пауза {item['paused_for']:.0f} с"
+        else:
+            state = "✅"
+        lines.append(
+            f"   {name}: {state}, каналов {item['channels']}, "
+            f"запросов {item['calls']}, FloodWait {item['flood_waits']}"
+        )
+    return lines
+
+# Глобальный экземпляр
+session_pool = SessionPool()
@@ -1,134 +1,60 @@
-import asyncio
 import logging
-from pyrogram import Client
-from pyrogram.errors import ChannelPrivate, ChannelInvalid, UsernameNotOccupied
-from database import save_message, message_exists
-from config import API_ID, API_HASH, SOURCE_CHANNELS
+from async_storage import async_storage
+from pipeline import ingest_channels, channel_task, registry_tasks
 
 logger = logging.getLogger(__name__)
 
+# Сколько сообщений брать с канала при первом запуске
+FIRST_RUN_LIMIT = 15
+
 async def parse_single_channel(client, channel_url):
     """Парсит один канал"""
-    try:
-        # Извлекаем username из URL
-        if channel_url.startswith('https://t.me/'):
-            channel_id = channel_url.replace('https://t.me/', '')
-        else:
-            channel_id = channel_url
-        
-        logger.info(f"🔍 Парсим: {channel_id}")
-        
-        # Получаем информацию о канале
-        chat = await client.get_chat(channel_id)
-        logger.info(f"   📝 Канал: {chat.title}")
-        
-        # Парсим сообщения
-        messages_count = 0
-        new_messages_count = 0
-        parsed_messages = []
-        
-        async for message in client.get_chat_history(chat.id, limit=15):
-            if message.text and message.text.strip():
-                message_text = message.text.strip()
-                messages_count += 1
-                
-                # Проверяем на дубликаты
-                if not message_exists(message_text, channel_url):
-                    save_message(message_text, channel_url, 'OTHER')
-                    parsed_messages.append(message_text)
-                    new_messages_count += 1
-        
-        logger.info(f"   ✅ Найдено {new_messages_count} новых из {messages_count} сообщений")
-        
-        # Логируем примеры сообщений
-        if new_messages_count > 0:
-            for i, msg in enumerate(parsed_messages[:2], 1):
-                logger.info(f"      📨 Пример {i}: {msg[:80]}...")
-        
-        return {
-            'channel': channel_id,
-            'title': chat.title,
-            'new_messages': new_messages_count,
-            'total_messages': messages_count,
-            'messages': parsed_messages,
-            'success': True
-        }
-        
-    except ChannelPrivate:
-        logger.error(f"   ❌ Канал приватный: нет доступа")
-        return {'success': False, 'error': 'Private channel'}
-    except ChannelInvalid:
-        logger.error(f"   ❌ Неверный канал: не существует")
-        return {'success': False, 'error': 'Invalid channel'}
-    except UsernameNotOccupied:
-        logger.error(f"   ❌ Канал не существует")
-        return {'success': False, 'error': 'Username not occupied'}
-    except Exception as e:
-        logger.error(f"   ❌ Ошибка: {str(e)}")
-        return {'success': False, 'error': str(e)}
+    summary = await ingest_channels(client, [channel_task(channel_url, FIRST_RUN_LIMIT)])
+    return summary['stats'][0]
+
+async def parse_all_channels_simple(client=None):
+    """Парсит все каналы (упрощенная версия).
 
-async def parse_all_channels_simple():
-    """Парсит все каналы (упрощенная версия)"""
+    client - уже запущенный пользовательский клиент; по умолчанию каналы
+    делятся между постоянными сессиями USER_SESSIONS.
+    """
     logger.info("🚀 ЗАПУСК УПРОЩЕННОГО ПАРСЕРА")
     logger.info("=" * 50)
-    
-    client = None
+
     try:
-        # Используем пользовательскую сессию
-        client = Client(
-            "telegram_parser",
-            api_id=API_ID,
-            api_hash=API_HASH,
-            workdir="/opt/render/project/src"
+        summary = await ingest_channels(
+            client, await async_storage.read(registry_tasks, FIRST_RUN_LIMIT)
         )
-        
-        await client.start()
-        me = await client.get_me()
-        logger.info(f"✅ Аутентифицирован как: {me.first_name} (@{me.username})")
-        logger.info(f"   Тип: {'Бот' if me.is_bot else 'Пользователь'}")
-        
-        # Парсим каналы
-        all_messages = []
-        channel_stats = []
-        
-        for channel_url in SOURCE_CHANNELS:
-            result = await parse_single_channel(client, channel_url)
-            channel_stats.append(result)
-            
-            if result['success'] and result['messages']:
-                all_messages.extend(result['messages'])
-                logger.info(f"   ➕ Добавлено {len(result['messages'])} сообщений из {result['channel']}")
-        
+        channel_stats = summary['stats']
+
         logger.info("=" * 50)
-        logger.info(f"📊 ВСЕГО НАЙДЕНО: {len(all_messages)} новых сообщений")
-        
-        # Логируем общую статистику
+        logger.info(f"📊 ВСЕГО НАЙДЕНО: {summary['total_messages']} новых сообщений")
+
+        # Успешным считается канал, в котором нашлись новые сообщения
         successful_channels = sum(1 for stat in channel_stats if stat['success'] and stat['new_messages'] > 0)
-        total_new_messages = sum(stat['new_messages'] for stat in channel_stats if stat['success'])
-        
         logger.info(f"📈 Успешных каналов: {successful_channels}/{len(channel_stats)}")
-        logger.info(f"📨 Всего новых сообщений: {total_new_messages}")
-        
+
         return {
-            'messages': all_messages,
+            'messages': summary['messages'],
             'stats': channel_stats,
-            'total_messages': len(all_messages),
+            'total_messages': summary['total_messages'],
             'successful_channels': successful_channels,
-            'total_new_messages': total_new_messages
+            'total_new_messages': summary['total_new_messages'],
+            'labels': summary['labels'],
+            'clusters': summary['clusters']
         }
-        
+
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}")
         import traceback
         logger.error(f"🔍 Детали ошибки: {traceback.format_exc()}")
         return {
-            'messages': [], 
-            'stats': [], 
-            'total_messages': 0, 
+            'messages': [],
+            'labels': [],
+            'clusters': [],
+            'stats': [],
+            'total_messages': 0,
             'successful_channels': 0,
             'total_new_messages': 0,
             'error': str(e)
         }
-    finally:
-        if client:
-            await client.stop()
\ No newline at end of file
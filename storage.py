@@ -0,0 +1,192 @@
+import atexit
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from config import DATABASE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Настройки SQLite для частой записи: WAL позволяет читать во время записи,
+# synchronous=NORMAL в режиме WAL не делает fsync на каждый коммит
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Размер кэша подготовленных выражений на одно соединение
+STATEMENT_CACHE_SIZE = 256
+
+# Сколько секунд поток ждет своей очереди на запись (как busy_timeout)
+WRITE_TURN_TIMEOUT = 5.0
+
+class WriteTurn:
+    """Очередь потоков процесса на запись.
+
+    SQLite не гарантирует порядок: поток, который пишет пачку за пачкой,
+    снова берет блокировку сразу после COMMIT, пока другой спит в
+    обработчике busy_timeout. Здесь потоки получают запись по порядку
+    обращения, а SQLite разбирается только с другими процессами.
+    """
+
+    def __init__(self, timeout=WRITE_TURN_TIMEOUT):
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._next = 0
+        self._serving = 0
+        self._abandoned = set()
+
+    def acquire(self):
+        """Ждет очереди; по таймауту - sqlite3.OperationalError, как при занятой базе"""
+        with self._cond:
+            ticket = self._next
+            self._next += 1
+            if not self._cond.wait_for(lambda: self._serving == ticket, self.timeout):
+                self._abandoned.add(ticket)
+                raise sqlite3.OperationalError('database is locked')
+
+    def release(self):
+        """Передает запись следующему потоку в очереди"""
+        with self._cond:
+            self._serving += 1
+            while self._serving in self._abandoned:
+                self._abandoned.discard(self._serving)
+                self._serving += 1
+            self._cond.notify_all()
+
+class ConnectionPool:
+    """Пул долгоживущих соединений: одно соединение на поток.
+
+    Каждый event loop живет в своем потоке, поэтому соединение на поток
+    является и соединением на event loop.
+    """
+
+    def __init__(self, db_path=DATABASE_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._write_turn = WriteTurn()
+
+    def _connect(self):
+        """Открывает соединение и применяет настройки"""
+        conn = sqlite3.connect(
+            self.db_path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def get_connection(self):
+        """Возвращает соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.depth = 0
+            self._local.on_commit = []
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция на соединении потока.
+
+        Вложенные вызовы превращаются в SAVEPOINT, поэтому функции,
+        открывающие свою транзакцию, можно группировать в одну общую.
+        """
+        conn = self.get_connection()
+        depth = self._local.depth
+        pending = len(self._local.on_commit)
+        if depth == 0:
+            self._write_turn.acquire()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+            except BaseException:
+                self._write_turn.release()
+                raise
+        else:
+            conn.execute(f'SAVEPOINT sp_{depth}')
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = depth
+            # Действия откаченной части транзакции не выполняются
+            del self._local.on_commit[pending:]
+            if depth == 0:
+                try:
+                    conn.execute('ROLLBACK')
+                finally:
+                    self._write_turn.release()
+            else:
+                conn.execute(f'ROLLBACK TO sp_{depth}')
+                conn.execute(f'RELEASE sp_{depth}')
+            raise
+        else:
+            self._local.depth = depth
+            if depth == 0:
+                try:
+                    conn.execute('COMMIT')
+                finally:
+                    self._write_turn.release()
+                callbacks, self._local.on_commit = self._local.on_commit, []
+                for callback in callbacks:
+                    callback()
+            else:
+                conn.execute(f'RELEASE sp_{depth}')
+
+    def on_commit(self, callback):
+        """Выполняет callback после фиксации текущей транзакции (сразу, если ее нет)"""
+        self.get_connection()
+        if self._local.depth == 0:
+            callback()
+        else:
+            self._local.on_commit.append(callback)
+
+    def close_all(self):
+        """Закрывает все открытые соединения"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Ошибка закрытия соединения: {e}")
+        self._local = threading.local()
+
+# Глобальный пул
+pool = ConnectionPool()
+atexit.register(pool.close_all)
+
+def get_connection():
+    """Возвращает соединение текущего потока из глобального пула"""
+    return pool.get_connection()
+
+def transaction():
+    """Открывает транзакцию в глобальном пуле"""
+    return pool.transaction()
+
+def on_commit(callback):
+    """Откладывает callback до фиксации текущей транзакции глобального пула"""
+    pool.on_commit(callback)
+
+def configure(db_path):
+    """Переключает глобальный пул на другой файл базы данных"""
+    pool.close_all()
+    pool.db_path = db_path
+
+def ensure_columns(conn, table, columns):
+    """Добавляет в существующую таблицу недостающие колонки"""
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for name, definition in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+            logger.info(f"🔧 Добавлена колонка {table}.{name}")
@@ -0,0 +1,194 @@
+import logging
+import numpy as np
+from scipy import sparse
+from text_processing import tokenizer, split_sentences, stem
+from near_duplicates import representatives
+
+logger = logging.getLogger(__name__)
+
+# Короче - не мысль, а обрывок; длиннее - не пункт поста, а пересказ
+MIN_SENTENCE_WORDS = 4
+MAX_SENTENCE_CHARS = 300
+
+# TextRank считается только по лучшим по центроиду кандидатам: граф на
+# тысячи предложений плотный и дорогой, а в итог все равно идут единицы
+TEXTRANK_CANDIDATES = 200
+TEXTRANK_DAMPING = 0.85
+TEXTRANK_ITERATIONS = 30
+
+# Предложения, похожие на уже выбранные сильнее этого, пропускаются
+REDUNDANCY_THRESHOLD = 0.5
+
+# Основы слов-маркеров для разделов "Важно" и "Советы"
+IMPORTANT_CUES = frozenset(stem(word) for word in '''
+важно обязательно обязательный штраф запрет запрещено изменение изменения вступает новые правила
+срок сроки до внимание блокировка повышение увеличение комиссия тариф
+'''.split())
+TIP_CUES = frozenset(stem(word) for word in '''
+рекомендуем рекомендация совет советуем стоит нужно лучше проверьте используйте попробуйте
+следите настройте подключите успейте можно
+'''.split())
+
+def extract_sentences(texts, labels, token_arrays=None):
+    """Предложения текстов, их основы и метки, без обрывков, пересказов и повторов.
+
+    token_arrays - уже готовые массивы номеров слов текстов (колонка
+    tokens сообщений); без них тексты кодируются токенизатором.
+    """
+    if token_arrays is None:
+        token_arrays = tokenizer.encode_many(texts)
+    sentences, tokens, sentence_labels = [], [], []
+    seen = set()
+    for text, label, text_tokens in zip(texts, labels, token_arrays):
+        for sentence, sentence_tokens in zip(split_sentences(text or ''), tokenizer.sentences(text_tokens)):
+            if len(sentence) > MAX_SENTENCE_CHARS:
+                continue
+            stems = tokenizer.stem_list(sentence_tokens)
+            if len(stems) < MIN_SENTENCE_WORDS:
+                continue
+            key = (label, ' '.join(stems))
+            if key in seen:
+                continue
+            seen.add(key)
+            sentences.append(sentence)
+            tokens.append(stems)
+            sentence_labels.append(label)
+    return sentences, tokens, sentence_labels
+
+class Summarizer:
+    """Извлекающее реферирование сообщений для поста.
+
+    Все предложения пачки один раз превращаются в разреженную матрицу
+    TF-IDF (scipy.sparse, строки нормированы), дальше все считается
+    матричными операциями: для маркетплейса берется центроид его
+    предложений, лучшие по близости к центроиду кандидаты ранжируются
+    TextRank по графу косинусной близости, повторы отсекаются.
+    """
+
+    def __init__(self, candidates=TEXTRANK_CANDIDATES):
+        self.candidates = candidates
+
+    @staticmethod
+    def _tfidf(tokens):
+        """Матрица TF-IDF (предложения x основы) с нормой строк 1"""
+        vocabulary = {}
+        indices = []
+        indptr = [0]
+        for stems in tokens:
+            for word in stems:
+                indices.append(vocabulary.setdefault(word, len(vocabulary)))
+            indptr.append(len(indices))
+
+        data = np.ones(len(indices), dtype=np.float32)
+        matrix = sparse.csr_matrix(
+            (data, np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int32)),
+            shape=(len(tokens), len(vocabulary))
+        )
+        matrix.sum_duplicates()
+
+        # Сублинейная частота и сглаженная обратная документная частота
+        matrix.data = 1 + np.log(matrix.data)
+        document_frequency = np.bincount(matrix.indices, minlength=len(vocabulary))
+        idf = np.log((1 + matrix.shape[0]) / (1 + document_frequency)) + 1
+        matrix = matrix @ sparse.diags(idf.astype(np.float32))
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+    def _rank(self, matrix):
+        """Кандидаты в порядке убывания важности и их попарная близость.
+
+        Кандидаты - лучшие по близости к центроиду, порядок среди них
+        задает TextRank. Близость (плотная, кандидатов немного) нужна и
+        для отсечения повторов.
+        """
+        centroid = np.asarray(matrix.mean(axis=0)).ravel()
+        scores = matrix @ centroid
+        candidates = np.argsort(-scores)[:self.candidates]
+
+        block = matrix[candidates]
+        similarity = (block @ block.T).toarray()
+        if len(candidates) < 3:
+            return candidates, similarity
+
+        np.fill_diagonal(similarity, 0)
+        weights = similarity.sum(axis=1)
+        weights[weights == 0] = 1
+        transition = similarity / weights[:, None]
+
+        rank = np.full(len(candidates), 1 / len(candidates))
+        for _ in range(TEXTRANK_ITERATIONS):
+            updated = (1 - TEXTRANK_DAMPING) / len(candidates) + TEXTRANK_DAMPING * (transition.T @ rank)
+            if np.abs(updated - rank).sum() < 1e-6:
+                rank = updated
+                break
+            rank = updated
+
+        order = np.argsort(-rank)
+        return candidates[order], similarity[np.ix_(order, order)]
+
+    @staticmethod
+    def _pick(similarity, count, accept=None, taken=()):
+        """До count позиций кандидатов по порядку, без уже взятых и без повторов по смыслу - и друг друга, и взятых"""
+        picked = []
+        chosen = list(taken)
+        for position in range(len(similarity)):
+            if position in taken or (accept and not accept(position)):
+                continue
+            if chosen and similarity[position, chosen].max() > REDUNDANCY_THRESHOLD:
+                continue
+            picked.append(position)
+            chosen.append(position)
+            if len(picked) == count:
+                break
+        return picked
+
+    def summarize(self, texts, labels, clusters=None, key_points=3, important=2, tips=2, token_arrays=None):
+        """Разделы поста по маркетплейсам из самых показательных предложений.
+
+        labels - метки маркетплейса для texts в том же порядке, clusters -
+        кластеры почти одинаковых сообщений: от каждого берется один
+        представитель, чтобы перепост одной новости не занял весь раздел.
+        Возвращает {'OZON': {'key_points': [...], 'important': [...],
+        'tips': [...]}, ...} только для маркетплейсов, по которым нашлись
+        предложения. token_arrays - массивы номеров слов texts, если они
+        уже есть (см. extract_sentences).
+        """
+        if clusters is not None:
+            keep = representatives(texts, clusters)
+            texts = [texts[i] for i in keep]
+            labels = [labels[i] for i in keep]
+            if token_arrays is not None:
+                token_arrays = [token_arrays[i] for i in keep]
+
+        sentences, tokens, sentence_labels = extract_sentences(texts, labels, token_arrays)
+        if not sentences:
+            return {}
+
+        matrix = self._tfidf(tokens)
+        sentence_labels = np.array(sentence_labels)
+        cue_sets = [set(stems) for stems in tokens]
+
+        sections = {}
+        for label in dict.fromkeys(sentence_labels.tolist()):
+            rows = np.flatnonzero(sentence_labels == label)
+            order, similarity = self._rank(matrix[rows])
+            order = rows[order]
+
+            main = self._pick(similarity, key_points)
+            taken = set(main)
+            notes = self._pick(similarity, important, lambda i: cue_sets[order[i]] & IMPORTANT_CUES, taken)
+            taken.update(notes)
+            advice = self._pick(similarity, tips, lambda i: cue_sets[order[i]] & TIP_CUES, taken)
+
+            sections[label] = {
+                'key_points': [sentences[order[i]] for i in main],
+                'important': [sentences[order[i]] for i in notes],
+                'tips': [sentences[order[i]] for i in advice]
+            }
+
+        return sections
+
+# Глобальный экземпляр
+summarizer = Summarizer()
@@ -1,48 +1,142 @@
+import time
 import asyncio
 import logging
 from pyrogram import Client
-from config import API_ID, API_HASH, BOT_TOKEN, TARGET_CHANNEL
+from config import (
+    API_ID, API_HASH, BOT_TOKEN, TARGET_CHANNEL,
+    USER_SESSIONS, CLIENT_HEALTH_CHECK_INTERVAL, CLIENT_HEALTH_CHECK_TIMEOUT
+)
+from rate_limiter import rate_limiter
 
 logger = logging.getLogger(__name__)
 
+# Имя сессии бота
+BOT_SESSION = "telegram_bot"
+
 class TelegramManager:
+    """Держит пользовательских и бот клиентов запущенными между запусками.
+
+    Клиент каждой сессии создается один раз; при следующих обращениях
+    соединение не чаще раза в CLIENT_HEALTH_CHECK_INTERVAL секунд
+    проверяется через get_me и при сбое переподключается. Клиенты
+    Pyrogram привязаны к event loop, в котором созданы, поэтому
+    менеджером пользуются только из одного loop (см. telegram_runtime).
+    """
+
     def __init__(self):
-        self.user_client = None
-        self.bot_client = None
-    
-    async def get_user_client(self):
-        """Возвращает пользовательского клиента для парсинга"""
-        if self.user_client is None:
-            self.user_client = Client(
-                "telegram_parser",
-                api_id=API_ID,
-                api_hash=API_HASH,
-                workdir="/opt/render/project/src"
-            )
-            await self.user_client.start()
-            
-            me = await self.user_client.get_me()
-            logger.info(f"🔐 ПОЛЬЗОВАТЕЛЬ: {me.first_name} - Бот: {me.is_bot}")
-            
-        return self.user_client
-    
+        self.clients = {}
+        self._checked_at = {}
+        self._locks = {}
+
+    @property
+    def user_client(self):
+        return self.clients.get(USER_SESSIONS[0])
+
+    @property
+    def bot_client(self):
+        return self.clients.get(BOT_SESSION)
+
+    def _lock(self, name):
+        if name not in self._locks:
+            self._locks[name] = asyncio.Lock()
+        return self._locks[name]
+
+    async def get_user_client(self, session=None):
+        """Возвращает пользовательского клиента для парсинга (по умолчанию - основную сессию)"""
+        return await self._get_client(session or USER_SESSIONS[0])
+
     async def get_bot_client(self):
         """Возвращает бот клиента для отправки"""
-        if self.bot_client is None and BOT_TOKEN:
-            self.bot_client = Client(
-                "telegram_bot",
-                api_id=API_ID,
-                api_hash=API_HASH,
-                bot_token=BOT_TOKEN,
-                workdir="/opt/render/project/src"
-            )
-            await self.bot_client.start()
-            
-            me = await self.bot_client.get_me()
-            logger.info(f"🤖 БОТ: {me.username} - Бот: {me.is_bot}")
-            
-        return self.bot_client
-    
+        if not BOT_TOKEN:
+            return None
+        return await self._get_client(BOT_SESSION, bot_token=BOT_TOKEN)
+
+    async def _get_client(self, name, bot_token=None):
+        async with self._lock(name):
+            if name not in self.clients:
+                client = Client(
+                    name,
+                    api_id=API_ID,
+                    api_hash=API_HASH,
+                    bot_token=bot_token,
+                    workdir="/opt/render/project/src"
+                )
+                await client.start()
+
+                try:
+                    me = await client.get_me()
+                except Exception:
+                    # Запущенный клиент держит соединение и файл сессии
+                    await self._stop(name, client)
+                    raise
+                if me.is_bot:
+                    logger.info(f"🤖 БОТ: {me.username} - Бот: {me.is_bot}")
+                else:
+                    logger.info(f"🔐 ПОЛЬЗОВАТЕЛЬ ({name}): {me.first_name} - Бот: {me.is_bot}")
+                self.clients[name] = client
+                self._checked_at[name] = time.monotonic()
+            else:
+                await self._ensure_healthy(name)
+
+            return self.clients[name]
+
+    async def _ensure_healthy(self, name):
+        """Проверяет соединение клиента и переподключает его при сбое"""
+        if time.monotonic() - self._checked_at.get(name, 0) < CLIENT_HEALTH_CHECK_INTERVAL:
+            return
+
+        client = self.clients[name]
+        try:
+            if not client.is_connected:
+                raise ConnectionError("клиент отключен")
+            await asyncio.wait_for(client.get_me(), CLIENT_HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"⚠️ Клиент {name} не отвечает ({e}), переподключаемся...")
+            await self._reconnect(name, client)
+
+        self._checked_at[name] = time.monotonic()
+
+    @staticmethod
+    async def _stop(name, client):
+        """Останавливает клиента в любом состоянии, освобождая соединение и файл сессии.
+
+        client.stop() требует и инициализации, и соединения, поэтому
+        отключенный, но инициализированный клиент останавливается по шагам.
+        """
+        try:
+            if client.is_initialized:
+                await client.terminate()
+            if client.is_connected:
+                await client.disconnect()
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка остановки клиента {name}: {e}")
+
+    async def _reconnect(self, name, client):
+        """Перезапускает клиента; если не удалось, он будет создан заново"""
+        await self._stop(name, client)
+
+        try:
+            await client.start()
+            logger.info(f"✅ Клиент {name} переподключен")
+        except Exception as e:
+            logger.error(f"❌ Не удалось переподключить клиента {name}: {e}")
+            await self._stop(name, client)
+            del self.clients[name]
+            raise
+
+    def get_status(self):
+        """Состояние клиентов для страницы проверки"""
+        status = {}
+        for name in list(USER_SESSIONS) + [BOT_SESSION]:
+            client = self.clients.get(name)
+            checked_at = self._checked_at.get(name)
+            status[name] = {
+                'started': client is not None,
+                'connected': bool(client and client.is_connected),
+                'checked_ago': time.monotonic() - checked_at if checked_at else None
+            }
+        return status
+
     async def send_message(self, text):
         """Отправляет сообщение через бота"""
         try:
@@ -52,8 +146,8 @@ class TelegramManager:
                 max_length = 4096
                 if len(text) > max_length:
                     text = text[:max_length-100] + "\n\n... (пост сокращен)"
-                
-                await bot.send_message(TARGET_CHANNEL, text)
+
+                await rate_limiter.call('send', bot.send_message, TARGET_CHANNEL, text)
                 logger.info(f"✅ Сообщение отправлено в {TARGET_CHANNEL}")
                 return True
             else:
@@ -62,13 +156,17 @@ class TelegramManager:
         except Exception as e:
             logger.error(f"❌ Ошибка отправки: {e}")
             return False
-    
+
     async def cleanup(self):
         """Очистка клиентов"""
-        if self.user_client:
-            await self.user_client.stop()
-        if self.bot_client:
-            await self.bot_client.stop()
+        for client in self.clients.values():
+            if client.is_connected:
+                try:
+                    await client.stop()
+                except Exception as e:
+                    logger.warning(f"⚠️ Ошибка остановки клиента: {e}")
+        self.clients = {}
+        self._checked_at = {}
 
 # Глобальный экземпляр
-telegram_manager = TelegramManager()
\ No newline at end of file
+telegram_manager = TelegramManager()
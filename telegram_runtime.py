@@ -0,0 +1,94 @@
+import atexit
+import asyncio
+import logging
+import threading
+from telegram_manager import telegram_manager
+from config import RUNTIME_TASK_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class TelegramRuntime:
+    """Фоновый event loop, в котором живут клиенты Telegram.
+
+    Один поток на процесс крутит asyncio loop, а Flask-обработчики и
+    задачи планировщика отправляют в него корутины через submit/run.
+    Клиенты telegram_manager создаются внутри этого loop и остаются
+    подключенными между запусками, поэтому повторный парсинг не тратит
+    время на соединение, загрузку сессии и get_me.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запускает поток с event loop, если он еще не запущен"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+
+            ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, args=(ready,), name='telegram-runtime', daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+            logger.info("✅ Фоновый event loop Telegram запущен")
+
+    def _run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, coro):
+        """Ставит корутину в фоновый loop и возвращает concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=RUNTIME_TASK_TIMEOUT):
+        """Выполняет корутину в фоновом loop и дожидается результата"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def health_check(self):
+        """Проверяет (и при необходимости переподключает) клиентов"""
+        return self.run(self._health_check(), timeout=30)
+
+    async def _health_check(self):
+        try:
+            await telegram_manager.get_user_client()
+        except Exception as e:
+            logger.error(f"❌ Пользовательский клиент недоступен: {e}")
+        try:
+            await telegram_manager.get_bot_client()
+        except Exception as e:
+            logger.error(f"❌ Бот клиент недоступен: {e}")
+        return telegram_manager.get_status()
+
+    def stop(self):
+        """Останавливает клиентов и фоновый loop"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if not thread or not thread.is_alive():
+            return
+
+        try:
+            asyncio.run_coroutine_threadsafe(telegram_manager.cleanup(), self.loop).result(15)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка остановки клиентов: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        thread.join(5)
+
+# Глобальный экземпляр
+telegram_runtime = TelegramRuntime()
+atexit.register(telegram_runtime.stop)
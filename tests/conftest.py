@@ -0,0 +1,55 @@
+import os
+import sys
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+
+@pytest.fixture
+def db(tmp_path):
+    """Чистая база во временном каталоге со всеми таблицами"""
+    storage.configure(str(tmp_path / 'test.db'))
+    from database import init_db
+    init_db()
+    yield storage.get_connection()
+    storage.pool.close_all()
+
+class FakeClient:
+    """Клиент Pyrogram с историей одного канала в памяти"""
+
+    name = 'test'
+
+    def __init__(self, peer_id, message_ids, date=None):
+        date = date or datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.messages = {
+            message_id: SimpleNamespace(
+                id=message_id,
+                text=f'Озон меняет правила для продавцов, новость {message_id}',
+                chat=SimpleNamespace(id=peer_id),
+                date=date,
+                edit_date=None
+            )
+            for message_id in message_ids
+        }
+        self.history_calls = 0
+
+    async def get_chat_history(self, chat_id, limit=0, offset_id=0):
+        """Сообщения от новых к старым, строго ниже offset_id"""
+        self.history_calls += 1
+        ids = sorted((i for i in self.messages if not offset_id or i < offset_id), reverse=True)
+        for message_id in ids[:limit or None]:
+            yield self.messages[message_id]
+
+@pytest.fixture
+def fast_limits(monkeypatch):
+    """Ограничитель без ожидания токенов для модулей, ходящих в Telegram"""
+    from rate_limiter import RateLimiter
+    from config import RATE_LIMITS
+    limiter = RateLimiter({method: (1000.0, 1000) for method in RATE_LIMITS})
+    for module in ('backfill', 'history_fetcher'):
+        monkeypatch.setattr(f'{module}.rate_limiter', limiter)
+    return limiter
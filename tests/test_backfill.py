@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import backfill
+from backfill import Backfiller
+from conftest import FakeClient
+from parsing_state import get_channel_state, update_channel_state
+
+CHANNEL = 'https://t.me/gaps'
+PEER_ID = -100600
+
+@pytest.fixture
+def backfiller(db, fast_limits, monkeypatch):
+    async def resolve(client, channel_url):
+        return {'peer_id': PEER_ID}
+
+    monkeypatch.setattr(backfill, 'resolve_channel', resolve)
+    monkeypatch.setattr(backfill, 'post_ingest', SimpleNamespace(submit=lambda: None))
+    # Парсер взял последние сообщения 61..100, а 41..60 не влезли в лимит
+    update_channel_state(CHANNEL, 100, 40, gap=(41, 60))
+    return Backfiller()
+
+def stored_ids(db):
+    return {row[0] for row in db.execute('SELECT message_id FROM messages WHERE channel_url = ?', (CHANNEL,))}
+
+def test_run_closes_gap(db, backfiller):
+    client = FakeClient(PEER_ID, range(1, 101))
+
+    asyncio.run(backfiller.run(client))
+
+    state = get_channel_state(CHANNEL)
+    assert state['gap'] is None
+    # Водяной знак разрыв не трогает
+    assert state['last_message_id'] == 100
+    assert stored_ids(db) == set(range(41, 61))
+
+def test_each_gap_page_narrows_stored_gap(db, backfiller, monkeypatch):
+    monkeypatch.setattr(backfill, 'BACKFILL_PAGE_SIZE', 5)
+    client = FakeClient(PEER_ID, range(1, 101))
+    state = {'channel_url': CHANNEL, 'gap': (41, 60), 'offset_id': 61, 'peer_id': PEER_ID, 'loaded': 0}
+
+    done = asyncio.run(backfiller._gap_page(client, state))
+
+    # После падения догрузка продолжится с 55, загруженное не повторится
+    assert not done
+    assert get_channel_state(CHANNEL)['gap'] == (41, 55)
+    assert stored_ids(db) == set(range(56, 61))
+
+def test_gap_merged_by_parser_is_left_for_next_pass(db, backfiller):
+    client = FakeClient(PEER_ID, range(1, 101))
+    state = {'channel_url': CHANNEL, 'gap': (41, 60), 'offset_id': 61, 'peer_id': PEER_ID, 'loaded': 0}
+    # Пока страница грузилась, парсер записал новый разрыв, и они объединились
+    update_channel_state(CHANNEL, 200, 0, gap=(101, 150))
+
+    asyncio.run(backfiller._gap_page(client, state))
+
+    assert get_channel_state(CHANNEL)['gap'] == (41, 150)
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+from database import save_messages_batch
+
+CHANNEL = 'https://t.me/db'
+
+def record(text, message_id=1):
+    return {
+        'text': text,
+        'marketplace': 'OZON',
+        'peer_id': -100700,
+        'message_id': message_id,
+        'date': datetime(2026, 1, 1, tzinfo=timezone.utc),
+        'edit_date': None
+    }
+
+def stored_sentiment(db, message_id):
+    return db.execute('SELECT sentiment FROM messages WHERE message_id = ?', (message_id,)).fetchone()[0]
+
+def test_caller_dicts_are_not_modified(db):
+    message = record('Озон отлично ускорили доставку')
+    original = dict(message)
+
+    saved = save_messages_batch([message], CHANNEL)
+
+    assert message == original
+    assert saved[0] is not message
+    assert saved[0]['sentiment'] > 0
+    assert 'cluster_id' in saved[0]
+
+def test_reused_dict_is_scored_again_after_edit(db):
+    message = record('Озон отлично ускорили доставку')
+    save_messages_batch([message], CHANNEL)
+    assert stored_sentiment(db, 1) > 0
+
+    # Тот же словарь с новым текстом - правка поста: оценка считается заново
+    message['text'] = 'Озон ужасно плохо доставляет'
+    message['edit_date'] = datetime(2026, 1, 2, tzinfo=timezone.utc)
+    save_messages_batch([message], CHANNEL)
+
+    assert stored_sentiment(db, 1) < 0
@@ -0,0 +1,53 @@
+import asyncio
+
+from conftest import FakeClient
+from history_fetcher import IncrementalHistory
+
+PEER_ID = -100800
+
+def fetch(client, last_message_id, max_messages, known_top_id=None):
+    history = IncrementalHistory(client, PEER_ID, last_message_id, max_messages, known_top_id)
+
+    async def run():
+        return [message.id async for message in history]
+    return asyncio.run(run()), history
+
+def test_known_top_at_watermark_skips_history(fast_limits):
+    client = FakeClient(PEER_ID, range(1, 21))
+
+    ids, history = fetch(client, 20, 50, known_top_id=20)
+
+    # Список диалогов показал, что новых нет: история не запрашивается
+    assert ids == []
+    assert client.history_calls == 0
+    assert history.top_message_id == 20
+    assert history.gap is None
+
+def test_known_top_above_watermark_reads_down_to_it(fast_limits):
+    client = FakeClient(PEER_ID, range(1, 26))
+
+    ids, history = fetch(client, 20, 50, known_top_id=24)
+
+    # Сообщение 25 пришло после списка диалогов и тоже загружается
+    assert ids == [25, 24, 23, 22, 21]
+    assert client.history_calls == 1
+    assert history.top_message_id == 25
+    assert history.gap is None
+
+def test_known_top_beyond_limit_records_gap(fast_limits):
+    client = FakeClient(PEER_ID, range(1, 41))
+
+    ids, history = fetch(client, 20, 5, known_top_id=40)
+
+    assert ids == [40, 39, 38, 37, 36]
+    assert history.top_message_id == 40
+    assert history.gap == (21, 35)
+
+def test_without_known_top_probes_last_message(fast_limits):
+    client = FakeClient(PEER_ID, range(1, 21))
+
+    ids, history = fetch(client, 20, 50)
+
+    assert ids == []
+    assert client.history_calls == 1
+    assert history.top_message_id == 20
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from inference_client import InferenceClient, HTTPBackend, top_prediction
+from inference_server import start_server
+from database import content_hash
+
+FALLBACK = 'FALLBACK'
+
+TEXTS = [
+    'Озон снижает комиссию для продавцов электроники',
+    'Wildberries меняет правила приемки на складах',
+    'Яндекс Маркет запускает новую программу лояльности',
+]
+
+def fallback(texts):
+    return [FALLBACK] * len(texts)
+
+def parse(output):
+    return top_prediction(output)[0]
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(**kwargs):
+        server, model, url = start_server(**kwargs)
+        servers.append(server)
+        return model, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+def make_client(url, timeout=5, **kwargs):
+    return InferenceClient(
+        'test', fallback, parse, backend=HTTPBackend(url, timeout=timeout), timeout=timeout, **kwargs
+    )
+
+def test_batches_and_deduplicates_texts(db, server):
+    model, url = server(delay=0.05, per_text_delay=0)
+    client = make_client(url, batch_size=32, max_wait=0.2)
+    texts = [f'{TEXTS[i % 3]} #{i % 6}' for i in range(20)]
+
+    results = client.predict_many(texts)
+
+    assert results[:3] == ['OZON', 'WB', 'YANDEX']
+    assert FALLBACK not in results
+    # 6 разных текстов уходят в модель одной пачкой, повторы - один раз
+    assert model.stats['texts'] == 6
+    assert model.stats['requests'] == 1
+
+def test_repeated_texts_come_from_cache(db, server):
+    model, url = server(delay=0.01, per_text_delay=0)
+    client = make_client(url, max_wait=0.02)
+
+    first = client.predict_many(TEXTS)
+    requests = model.stats['requests']
+    second = client.predict_many(TEXTS)
+
+    assert second == first
+    assert model.stats['requests'] == requests
+    assert client.stats['cache_hits'] == len(TEXTS)
+
+    # Кэш в базе переживает новый клиент
+    fresh = make_client(url, max_wait=0.02)
+    assert fresh.predict_many(TEXTS) == first
+    assert model.stats['requests'] == requests
+
+def test_model_timeout_falls_back_to_local_rules(db, server):
+    _, url = server(delay=1.0, per_text_delay=0)
+    client = make_client(url, timeout=0.2, max_wait=0.02)
+
+    assert client.predict_many(TEXTS[:1]) == [FALLBACK]
+    assert client.stats['errors'] == 1
+    # Ответы правил не кэшируются
+    assert client.cache.get_many([content_hash(TEXTS[0])]) == {}
+
+def test_cancelled_caller_does_not_break_batch(db, server):
+    _, url = server(delay=0.3, per_text_delay=0)
+    client = make_client(url, max_wait=0.05)
+
+    async def run():
+        # Оба запроса попадают в одну пачку; первый вызывающий перестает ждать
+        impatient = asyncio.ensure_future(asyncio.wait_for(client.apredict(TEXTS[0]), 0.1))
+        patient = asyncio.ensure_future(asyncio.wait_for(client.apredict(TEXTS[1]), 5))
+        with pytest.raises(asyncio.TimeoutError):
+            await impatient
+        return await patient
+
+    assert asyncio.run(run()) == 'WB'
+    assert client.stats['errors'] == 0
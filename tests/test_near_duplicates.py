@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+
+from config import NEAR_DUPLICATE_WINDOW_DAYS
+from database import save_messages_batch
+from near_duplicates import NearDuplicateIndex
+
+CHANNEL = 'https://t.me/dups'
+TEXT = 'Озон снижает комиссию для продавцов электроники с первого марта {}'
+
+def record(message_id, days_ago, text=None):
+    return {
+        'text': text or TEXT.format(message_id),
+        'peer_id': -100900,
+        'message_id': message_id,
+        'date': datetime.now(timezone.utc) - timedelta(days=days_ago),
+        'edit_date': None
+    }
+
+def test_backfilled_messages_stay_out_of_memory_index(db, monkeypatch):
+    index = NearDuplicateIndex()
+    monkeypatch.setattr('near_duplicates.near_duplicate_index', index)
+
+    old = NEAR_DUPLICATE_WINDOW_DAYS + 5
+    saved = save_messages_batch([record(1, old), record(2, old, TEXT.format(1) + '!')], CHANNEL)
+
+    # Внутри одной записи старые сообщения сверяются друг с другом
+    assert saved[1]['cluster_id'] == saved[0]['cluster_id']
+    # Но ни в память, ни в таблицу корзин не попадают
+    assert not index.entries
+    assert db.execute('SELECT COUNT(*) FROM lsh_buckets').fetchone()[0] == 0
+
+    saved = save_messages_batch([record(3, 1)], CHANNEL)
+    assert list(index.entries) == [saved[0]['cluster_id']]
+
+def test_memory_index_evicts_by_date(db, monkeypatch):
+    index = NearDuplicateIndex()
+    monkeypatch.setattr('near_duplicates.near_duplicate_index', index)
+    saved = save_messages_batch([record(1, NEAR_DUPLICATE_WINDOW_DAYS - 1)], CHANNEL)
+    first_id = saved[0]['cluster_id']
+    assert first_id in index.entries
+
+    # Через пару дней первое сообщение выходит из окна и вытесняется, хотя место есть
+    later = datetime.utcnow() + timedelta(days=2)
+    monkeypatch.setattr('near_duplicates._window_start', lambda: (
+        later - timedelta(days=NEAR_DUPLICATE_WINDOW_DAYS)
+    ).strftime('%Y-%m-%d %H:%M:%S'))
+    saved = save_messages_batch([record(2, 0, TEXT.format(1) + '!')], CHANNEL)
+
+    assert first_id not in index.entries
+    assert not any(first_id in bucket for bucket in index.buckets.values())
+    # Похожее сообщение вне окна кластер не продолжает
+    assert saved[0]['cluster_id'] != first_id
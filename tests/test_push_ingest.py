@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import push_ingest
+from async_storage import async_storage
+from parsing_state import get_channel_state, update_channel_state
+from push_ingest import PushIngestor
+
+CHANNEL = 'https://t.me/push'
+PEER_ID = -100500
+
+def message(message_id, text=None):
+    return SimpleNamespace(
+        id=message_id,
+        text=text or f'Озон меняет комиссию, новость {message_id}',
+        chat=SimpleNamespace(id=PEER_ID),
+        date=datetime(2026, 1, 1, tzinfo=timezone.utc),
+        edit_date=None
+    )
+
+@pytest.fixture
+def ingestor(db, monkeypatch):
+    monkeypatch.setattr(push_ingest, 'post_ingest', SimpleNamespace(submit=lambda: None))
+    update_channel_state(CHANNEL, 10, 0)
+    ingestor = PushIngestor()
+    ingestor.channels = {PEER_ID: CHANNEL}
+    ingestor.watermarks = {CHANNEL: 10}
+    return ingestor
+
+def persist(ingestor, messages, edited=False):
+    async def run():
+        ingestor._gap_fill_needed = asyncio.Event()
+        await ingestor._persist([(item, edited) for item in messages])
+        return ingestor._gap_fill_needed.is_set()
+    return asyncio.run(run())
+
+def test_contiguous_ids_advance_watermark(ingestor):
+    gap = persist(ingestor, [message(12), message(11)])
+
+    assert not gap
+    assert ingestor.watermarks[CHANNEL] == 12
+    assert get_channel_state(CHANNEL)['last_message_id'] == 12
+    assert ingestor.stats['saved'] == 2
+
+def test_gap_keeps_watermark_and_requests_poll(ingestor):
+    gap = persist(ingestor, [message(11), message(13)])
+
+    assert gap
+    # Сохраняется все, но знак стоит перед пропуском: 12 догрузит опрос
+    assert ingestor.stats['saved'] == 2
+    assert ingestor.watermarks[CHANNEL] == 11
+    assert get_channel_state(CHANNEL)['last_message_id'] == 11
+
+def test_edits_do_not_move_watermark(ingestor):
+    persist(ingestor, [message(11)], edited=True)
+
+    assert ingestor.watermarks[CHANNEL] == 10
+    assert get_channel_state(CHANNEL)['last_message_id'] == 10
+
+def test_failed_write_keeps_watermark(ingestor, monkeypatch):
+    async def failing(*args):
+        raise RuntimeError('disk full')
+    monkeypatch.setattr(async_storage, 'save_channel_batch', failing)
+
+    with pytest.raises(RuntimeError):
+        persist(ingestor, [message(11)])
+    assert ingestor.watermarks[CHANNEL] == 10
+
+    # После сбоя следующий номер по-прежнему не продолжает цепочку
+    monkeypatch.undo()
+    monkeypatch.setattr(push_ingest, 'post_ingest', SimpleNamespace(submit=lambda: None))
+    assert persist(ingestor, [message(12)])
+    assert ingestor.watermarks[CHANNEL] == 10
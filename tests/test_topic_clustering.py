@@ -0,0 +1,30 @@
+import numpy as np
+
+from summarizer import Summarizer
+from topic_clustering import _drop_repeats
+
+NEWS = 'Озон с первого марта снижает комиссию для продавцов электроники и бытовой техники'
+
+def test_repeated_points_are_dropped_across_sections():
+    sections = {
+        'комиссия озон': {'key_points': [NEWS], 'important': [NEWS + '!'], 'tips': []},
+        'электроника': {'key_points': [NEWS.replace('Озон', 'OZON')], 'important': [], 'tips': []},
+        'склады wb': {'key_points': ['Wildberries меняет правила приемки товаров на складах'], 'important': [], 'tips': []}
+    }
+
+    kept = _drop_repeats(sections)
+
+    assert kept['комиссия озон'] == {'key_points': [NEWS], 'important': [], 'tips': []}
+    # Раздел, в котором остался только повтор, выпадает
+    assert 'электроника' not in kept
+    assert kept['склады wb']['key_points'] == sections['склады wb']['key_points']
+
+def test_pick_skips_sentences_close_to_already_taken():
+    similarity = np.array([
+        [1.0, 0.9, 0.1],
+        [0.9, 1.0, 0.1],
+        [0.1, 0.1, 1.0]
+    ])
+
+    # Позиция 1 почти повторяет взятую в другом разделе позицию 0
+    assert Summarizer._pick(similarity, 2, taken={0}) == [2]
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+from database import save_messages_batch
+from trends import TrendDetector
+
+CHANNEL = 'https://t.me/trends'
+
+def save(texts, days_ago=0, start_id=1):
+    date = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    save_messages_batch([
+        {'text': text, 'marketplace': 'OZON', 'peer_id': -100400, 'message_id': start_id + i, 'date': date, 'edit_date': None}
+        for i, text in enumerate(texts)
+    ], CHANNEL)
+
+def terms(trends):
+    return [item['term'] for item in trends.get('OZON', [])]
+
+def test_without_baseline_frequent_window_terms_rise(db):
+    save([f'Озон вводит обязательную маркировку обуви, выпуск {i}' for i in range(5)])
+
+    detector = TrendDetector()
+    detector.update()
+
+    assert any('маркировк' in term for term in terms(detector.top_rising('OZON')))
+
+def test_rising_term_is_measured_against_baseline(db):
+    # База: доставку обсуждают постоянно
+    save([f'Озон ускоряет доставку в регионы, выпуск {i}' for i in range(20)], days_ago=20)
+    # Окно: доставка с прежней частотой, маркировка - впервые
+    save([f'Озон ускоряет доставку в регионы, выпуск {i}' for i in range(20, 24)], start_id=100)
+    save([f'Озон ускоряет доставку в регионы. Маркировку обуви продлили, выпуск {i}' for i in range(6)], start_id=200)
+
+    detector = TrendDetector()
+    detector.update()
+    rising = detector.top_rising('OZON')
+
+    assert any('маркировк' in term for term in terms(rising))
+    assert not any('доставк' in term for term in terms(rising))
+    top = rising['OZON'][0]
+    assert top['count'] >= 6 and top['expected'] < 1
+
+def test_top_rising_reloads_after_foreign_update(db):
+    # Два экземпляра - как парсер и веб-приложение в разных процессах
+    writer, reader = TrendDetector(), TrendDetector()
+    assert reader.top_rising('OZON') == {}
+
+    save([f'Озон вводит обязательную маркировку обуви, выпуск {i}' for i in range(5)])
+    writer.update()
+
+    assert any('маркировк' in term for term in terms(reader.top_rising('OZON')))
+    assert reader._progress == writer._progress
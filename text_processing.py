@@ -0,0 +1,348 @@
+import re
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from storage import get_connection, transaction, on_commit, ensure_columns
+from config import TOKEN_CACHE_SIZE, STEM_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Слова и предложения: буквы и цифры, конец предложения - знак препинания или перенос строки
+WORD_RE = re.compile(r'[0-9a-zа-яё]+')
+SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+STOP_WORDS = frozenset('''
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до
+его ее ей если есть еще же за здесь и из или им их к как ко когда кто ли либо между меня мне может
+мы на над надо наш не него нее нет ни них но ну о об однако он она они оно от очень по под после
+при про с со так также такой там те тем то того тоже той только том ты у уже хотя чего чей чем что
+чтобы чье чья эта эти это этот я свой свои своих сейчас будет будут который которая которые которых
+the a an and or of to in on for is are be with by at from this that it as
+'''.split())
+
+VOWELS = 'аеиоуыэюя'
+
+def _endings(*words):
+    return tuple(sorted(words, key=len, reverse=True))
+
+# Окончания русского стеммера Snowball (Портера)
+PERFECTIVE_GERUND_1 = _endings('в', 'вши', 'вшись')
+PERFECTIVE_GERUND_2 = _endings('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись')
+REFLEXIVE = _endings('ся', 'сь')
+ADJECTIVE = _endings(
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'
+)
+PARTICIPLE_1 = _endings('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE_2 = _endings('ивш', 'ывш', 'ующ')
+VERB_1 = _endings('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно')
+VERB_2 = _endings(
+    'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым',
+    'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'
+)
+NOUN = _endings(
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий',
+    'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю',
+    'ия', 'ья', 'я'
+)
+SUPERLATIVE = _endings('ейш', 'ейше')
+DERIVATIONAL = _endings('ост', 'ость')
+
+def _strip(word, endings, after_a=False):
+    """Отрезает самое длинное окончание; after_a - только после а/я. None, если не подошло"""
+    for ending in endings:
+        if word.endswith(ending):
+            stem = word[:-len(ending)]
+            if after_a and not stem.endswith(('а', 'я')):
+                continue
+            return stem
+    return None
+
+def _region(word, start=0):
+    """Начало области после первого сочетания гласная-согласная (R1/R2 в Snowball)"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+    """Основа русского слова по алгоритму Snowball; латиница возвращается как есть"""
+    word = word.replace('ё', 'е')
+    rv_start = next((i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    if rv_start >= len(word):
+        return word
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1: деепричастие, иначе возвратность и прилагательное/глагол/существительное
+    stripped = _strip(rv, PERFECTIVE_GERUND_2)
+    if stripped is None:
+        stripped = _strip(rv, PERFECTIVE_GERUND_1, after_a=True)
+    if stripped is None:
+        reflexive = _strip(rv, REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        adjective = _strip(rv, ADJECTIVE)
+        if adjective is not None:
+            participle = _strip(adjective, PARTICIPLE_2)
+            if participle is None:
+                participle = _strip(adjective, PARTICIPLE_1, after_a=True)
+            stripped = participle if participle is not None else adjective
+        else:
+            stripped = _strip(rv, VERB_2)
+            if stripped is None:
+                stripped = _strip(rv, VERB_1, after_a=True)
+            if stripped is None:
+                stripped = _strip(rv, NOUN)
+    if stripped is not None:
+        rv = stripped
+
+    # Шаг 2: конечное "и"
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс в R2
+    r2_start = _region(word, _region(word)) - rv_start
+    for ending in DERIVATIONAL:
+        if rv.endswith(ending) and len(rv) - len(ending) >= r2_start:
+            rv = rv[:-len(ending)]
+            break
+
+    # Шаг 4: превосходная степень, двойное "н", мягкий знак
+    superlative = _strip(rv, SUPERLATIVE)
+    if superlative is not None:
+        rv = superlative
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif rv.endswith('ь'):
+        rv = rv[:-1]
+
+    return prefix + rv
+
+def normalize_text(text):
+    """Нормализует текст для сравнения: регистр и пробелы"""
+    return ' '.join(text.lower().split())
+
+def split_sentences(text):
+    """Делит текст на предложения по знакам конца предложения и переносам строк"""
+    return [sentence.strip() for sentence in SENTENCE_RE.split(text) if sentence and sentence.strip()]
+
+def init_tokens():
+    """Таблица словаря и колонка массивов номеров слов у сообщений"""
+    with transaction() as conn:
+        ensure_columns(conn, 'messages', [
+            ('tokens', 'BLOB')
+        ])
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS vocabulary (
+                id INTEGER PRIMARY KEY,
+                word TEXT NOT NULL UNIQUE
+            )
+        ''')
+
+    tokenizer.load()
+    logger.info(f"✅ Словарь токенов инициализирован: {len(tokenizer.words) - 1} слов")
+
+class Tokenizer:
+    """Общая токенизация текстов для всех стадий разбора.
+
+    Текст один раз приводится к нижнему регистру и делится на
+    предложения и слова; слова интернируются в словарь, и сообщение
+    превращается в компактный массив номеров (uint32, 0 - конец
+    предложения), который хранится рядом с сообщением как BLOB. Основа и
+    "значимость" (не стоп-слово, длиннее буквы) считаются один раз на
+    слово словаря, поэтому стадии работают с массивами номеров и не
+    разбирают строки заново. Последние TOKEN_CACHE_SIZE текстов держатся
+    в LRU, так что стадии одного прохода токенизируют текст один раз.
+
+    Словарь хранится в таблице vocabulary и поднимается в init_tokens:
+    номера в BLOB остаются верными после перезапуска. Новые слова
+    записываются вместе с сообщениями, которые на них ссылаются
+    (persist), а расхождение с другим процессом, пишущим в ту же базу,
+    снимается перечитыванием словаря. Без init_tokens словарь живет
+    только в памяти.
+    """
+
+    BOUNDARY = 0
+
+    def __init__(self, cache_size=TOKEN_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._loaded = False
+        self._cache = OrderedDict()
+        # Растет при каждой загрузке словаря: таблицы по номерам слов
+        # в других модулях по нему понимают, что их пора пересобрать
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        self.words = ['']
+        self.ids = {}
+        self.stems = ['']
+        self._stem_ids = {'': 0}
+        self.stem_of = [0]
+        self.significant = [False]
+        self._persisted = 0
+
+    def load(self, conn=None):
+        """Поднимает словарь из базы; номера, выданные до этого, недействительны"""
+        rows = (conn or get_connection()).execute('SELECT id, word FROM vocabulary ORDER BY id').fetchall()
+        with self._lock, self._cache_lock:
+            self._cache.clear()
+            self._reset()
+            for word_id, word in rows:
+                if word_id != len(self.words):
+                    logger.warning("⚠️ Пропуск в словаре токенов, номера продолжаются после него")
+                    while len(self.words) < word_id:
+                        self._add('')
+                self._add(word)
+            self._persisted = len(self.words) - 1
+            self._loaded = True
+            self.generation += 1
+
+    def _add(self, word):
+        """Добавляет слово в словарь; вызывать под self._lock"""
+        word_id = len(self.words)
+        self.words.append(word)
+        if word:
+            self.ids[word] = word_id
+        word_stem = stem(word) if word else ''
+        if word_stem not in self._stem_ids:
+            self._stem_ids[word_stem] = len(self.stems)
+            self.stems.append(word_stem)
+        self.stem_of.append(self._stem_ids[word_stem])
+        self.significant.append(len(word) > 1 and word not in STOP_WORDS)
+        return word_id
+
+    def _word_ids(self, words):
+        ids = self.ids
+        missing = [word for word in words if word not in ids]
+        if missing:
+            with self._lock:
+                for word in missing:
+                    if word not in ids:
+                        self._add(word)
+        return [ids[word] for word in words]
+
+    def encode(self, text):
+        """Массив номеров слов текста (uint32), предложения разделены нулем"""
+        text = text or ''
+        with self._cache_lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+
+        ids = []
+        for sentence in split_sentences(text):
+            ids.extend(self._word_ids(WORD_RE.findall(sentence.lower())))
+            ids.append(self.BOUNDARY)
+        tokens = np.array(ids, dtype=np.uint32)
+
+        with self._cache_lock:
+            self._cache[text] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def encode_many(self, texts):
+        return [self.encode(text) for text in texts]
+
+    def persist(self, conn):
+        """Записывает новые слова словаря в текущей транзакции.
+
+        Вызывать перед сохранением массивов, которые на них ссылаются;
+        слова считаются записанными только после фиксации транзакции.
+        Номера новых слов раздаются в памяти процесса, а в ту же базу
+        пишут и другие процессы (веб-приложение, парсеры): если словарь в
+        базе ушел вперед, он перечитывается под блокировкой записи, и
+        generation меняется - выданные раньше массивы надо закодировать
+        заново (см. encode_persisted). Возвращает False, если словарь не
+        связан с базой (не было init_tokens) - тогда массивы сохранять нельзя.
+        """
+        if not self._loaded:
+            return False
+        stored = conn.execute('SELECT MAX(id) FROM vocabulary').fetchone()[0] or 0
+        if stored != self._persisted:
+            logger.info("🔄 Словарь токенов пополнен другим процессом, перечитываем")
+            self.load(conn)
+        with self._lock:
+            start, end = self._persisted + 1, len(self.words)
+            new_words = [(word_id, self.words[word_id]) for word_id in range(start, end)]
+        if not new_words:
+            return True
+        conn.executemany('INSERT INTO vocabulary (id, word) VALUES (?, ?)', new_words)
+
+        def committed():
+            with self._lock:
+                self._persisted = max(self._persisted, end - 1)
+        on_commit(committed)
+        return True
+
+    def encode_persisted(self, conn, texts):
+        """Массивы номеров текстов, слова которых записаны в текущей транзакции.
+
+        Возвращает (массивы, записаны ли слова); если словарь перечитан
+        при записи, тексты кодируются заново.
+        """
+        while True:
+            generation = self.generation
+            tokens = self.encode_many(texts)
+            if not self.persist(conn):
+                return tokens, False
+            if self.generation == generation:
+                return tokens, True
+
+    @staticmethod
+    def to_blob(tokens):
+        return np.asarray(tokens, dtype=np.uint32).tobytes()
+
+    def from_blob(self, blob):
+        """Массив номеров из BLOB; None, если массива нет (старые сообщения)"""
+        if blob is None:
+            return None
+        tokens = np.frombuffer(blob, dtype=np.uint32)
+        # Номер за пределами записанного словаря - слово другого процесса
+        if not self._loaded or (tokens.size and tokens.max() > self._persisted):
+            self.load()
+        return tokens
+
+    def tokens_for(self, text, blob=None):
+        """Массив из BLOB сообщения, а для старых сообщений без него - из текста"""
+        tokens = self.from_blob(blob)
+        return self.encode(text) if tokens is None else tokens
+
+    def sentences(self, tokens):
+        """Массивы номеров по предложениям (в порядке split_sentences)"""
+        ends = np.flatnonzero(tokens == self.BOUNDARY)
+        starts = np.concatenate([[0], ends[:-1] + 1]) if len(ends) else np.zeros(0, dtype=np.int64)
+        return [tokens[start:end] for start, end in zip(starts, ends)]
+
+    def significant_ids(self, tokens):
+        """Номера значимых слов: без стоп-слов, однобуквенных и границ предложений"""
+        significant = self.significant
+        return [word_id for word_id in tokens.tolist() if significant[word_id]]
+
+    def word_list(self, tokens):
+        """Значимые слова массива"""
+        words = self.words
+        return [words[word_id] for word_id in self.significant_ids(tokens)]
+
+    def stem_list(self, tokens):
+        """Основы значимых слов массива"""
+        stems, stem_of = self.stems, self.stem_of
+        return [stems[stem_of[word_id]] for word_id in self.significant_ids(tokens)]
+
+def tokenize(text):
+    """Слова текста в нижнем регистре без стоп-слов и однобуквенных"""
+    return tokenizer.word_list(tokenizer.encode(text))
+
+def stem_tokens(text):
+    """Основы значимых слов текста"""
+    return tokenizer.stem_list(tokenizer.encode(text))
+
+# Глобальный экземпляр
+tokenizer = Tokenizer()
@@ -0,0 +1,414 @@
+import zlib
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import lru_cache
+import numpy as np
+from scipy import sparse
+from storage import get_connection, transaction, ensure_columns, on_commit
+from text_processing import tokenizer
+from summarizer import summarizer
+from near_duplicates import minhash, similarity
+from config import (
+    TOPIC_COUNT, TOPIC_HASH_FEATURES, TOPIC_BATCH_SIZE, TOPIC_WINDOW_DAYS,
+    TOPIC_FORGETTING, TOPIC_SECTIONS, TOPIC_MIN_MESSAGES, NEAR_DUPLICATE_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз пройти по первой пачке, пока центров еще нет
+INITIAL_PASSES = 3
+
+# Сколько непомеченных сообщений читать из базы за раз
+UPDATE_CHUNK = 2000
+
+# Сколько слов в названии темы
+LABEL_WORDS = 2
+
+def init_topics():
+    """Колонка темы у сообщений и таблица состояния модели"""
+    with transaction() as conn:
+        ensure_columns(conn, 'messages', [
+            ('topic_id', 'INTEGER')
+        ])
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS topic_model (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                features INTEGER NOT NULL,
+                centroids BLOB NOT NULL,
+                counts BLOB NOT NULL,
+                document_frequency BLOB NOT NULL,
+                documents INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    logger.info("✅ Тематическая модель инициализирована")
+
+@lru_cache(maxsize=100000)
+def _feature(word):
+    """Номер признака и знак для основы слова (хеширование признаков)"""
+    value = zlib.crc32(word.encode('utf-8'))
+    return value % TOPIC_HASH_FEATURES, 1.0 if value & 0x80000000 else -1.0
+
+class _WordFeatures:
+    """Признак и знак для каждого номера слова словаря токенизатора.
+
+    Таблица достраивается по мере роста словаря; незначимые слова и
+    границы предложений получают признак -1.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.features = np.zeros(0, dtype=np.int32)
+        self.signs = np.zeros(0, dtype=np.float32)
+        self.generation = tokenizer.generation
+
+    def tables(self):
+        if self.generation != tokenizer.generation:
+            self._reset()
+        features, signs = self.features, self.signs
+        known, total = len(features), len(tokenizer.words)
+        if known < total:
+            stems, stem_of, significant = tokenizer.stems, tokenizer.stem_of, tokenizer.significant
+            pairs = [
+                _feature(stems[stem_of[word_id]]) if significant[word_id] else (-1, 0.0)
+                for word_id in range(known, total)
+            ]
+            features = np.concatenate([features, np.array([pair[0] for pair in pairs], dtype=np.int32)])
+            signs = np.concatenate([signs, np.array([pair[1] for pair in pairs], dtype=np.float32)])
+            self.features, self.signs = features, signs
+        return features, signs
+
+_word_features = _WordFeatures()
+
+def hashed_counts(token_arrays):
+    """Матрица частот основ (сообщения x признаки) по массивам номеров слов"""
+    features, signs = _word_features.tables()
+    lengths = np.fromiter((len(tokens) for tokens in token_arrays), dtype=np.int64, count=len(token_arrays))
+    flat = np.concatenate(token_arrays) if len(token_arrays) else np.zeros(0, dtype=np.uint32)
+
+    hit = features[flat]
+    found = hit >= 0
+    rows = np.repeat(np.arange(len(token_arrays)), lengths)[found]
+    matrix = sparse.csr_matrix(
+        (signs[flat][found], (rows, hit[found])),
+        shape=(len(token_arrays), TOPIC_HASH_FEATURES)
+    )
+    matrix.sum_duplicates()
+    return matrix
+
+def _normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+class TopicModel:
+    """Инкрементальная кластеризация сообщений по темам.
+
+    Сообщение - хешированный мешок основ слов (TF-IDF, строки
+    нормированы), темы - центры мини-пакетного сферического k-means.
+    Каждое обновление берет только сообщения без темы, подстраивает
+    центры под них и сохраняет им topic_id; уже размеченная история не
+    пересчитывается. Вес старых сообщений в центрах понемногу забывается
+    (TOPIC_FORGETTING), чтобы темы следовали за новостями. Состояние
+    модели лежит в таблице topic_model и переживает перезапуск.
+    """
+
+    def __init__(self, topics=TOPIC_COUNT, batch_size=TOPIC_BATCH_SIZE):
+        self.topics = topics
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.state = self._empty_state()
+
+    @staticmethod
+    def _empty_state():
+        return {
+            'centroids': np.zeros((0, TOPIC_HASH_FEATURES), dtype=np.float32),
+            'counts': np.zeros(0),
+            'document_frequency': np.zeros(TOPIC_HASH_FEATURES),
+            'documents': 0
+        }
+
+    def load(self):
+        """Поднимает состояние модели из базы"""
+        row = get_connection().execute('''
+            SELECT features, centroids, counts, document_frequency, documents
+            FROM topic_model WHERE id = 1
+        ''').fetchone()
+
+        state = self._empty_state()
+        if row and row[0] == TOPIC_HASH_FEATURES:
+            state = {
+                'centroids': np.frombuffer(row[1], dtype=np.float32).reshape(-1, TOPIC_HASH_FEATURES).copy(),
+                'counts': np.frombuffer(row[2], dtype=np.float64).copy(),
+                'document_frequency': np.frombuffer(row[3], dtype=np.float64).copy(),
+                'documents': row[4]
+            }
+        elif row:
+            logger.warning("⚠️ Размерность признаков изменилась, темы строятся заново")
+
+        self.state = state
+        self._loaded = True
+
+    @staticmethod
+    def _weigh(counts, state):
+        """Частоты -> нормированный TF-IDF по накопленной документной частоте"""
+        matrix = counts.copy()
+        matrix.data = np.sign(matrix.data) * (1 + np.log(np.abs(matrix.data)))
+        idf = np.log((1 + state['documents']) / (1 + state['document_frequency'])) + 1
+        return _normalize_rows(matrix @ sparse.diags(idf.astype(np.float32)))
+
+    def _seed(self, matrix, state, rnd):
+        """Добавляет недостающие центры по схеме k-means++ из сообщений пачки"""
+        centroids = state['centroids']
+        missing = min(self.topics - len(centroids), matrix.shape[0])
+        if missing <= 0:
+            return
+
+        rows = matrix[np.flatnonzero(np.diff(matrix.indptr))]
+        if not rows.shape[0]:
+            return
+
+        distance = np.ones(rows.shape[0])
+        if len(centroids):
+            distance = 1 - np.asarray((rows @ centroids.T)).max(axis=1)
+        new_centers = []
+        for _ in range(min(missing, rows.shape[0])):
+            weights = np.clip(distance, 0, None) ** 2
+            if weights.sum() <= 0:
+                break
+            index = rnd.choice(rows.shape[0], p=weights / weights.sum())
+            center = rows[index].toarray().ravel().astype(np.float32)
+            new_centers.append(center)
+            distance = np.minimum(distance, 1 - rows @ center)
+
+        if new_centers:
+            state['centroids'] = np.vstack([centroids, np.array(new_centers, dtype=np.float32)])
+            state['counts'] = np.concatenate([state['counts'], np.ones(len(new_centers))])
+
+    def _fit_batch(self, batch, state):
+        """Шаг мини-пакетного k-means: сдвиг центров к среднему их сообщений"""
+        centroids, counts = state['centroids'], state['counts']
+        assigned = np.asarray(batch @ centroids.T).argmax(axis=1)
+
+        counts *= TOPIC_FORGETTING ** batch.shape[0]
+        for topic in np.unique(assigned):
+            members = np.flatnonzero(assigned == topic)
+            counts[topic] += len(members)
+            total = np.asarray(batch[members].sum(axis=0)).ravel()
+            centroids[topic] += (total - len(members) * centroids[topic]) / counts[topic]
+            norm = np.linalg.norm(centroids[topic])
+            if norm:
+                centroids[topic] /= norm
+
+    def partial_fit(self, token_arrays, state):
+        """Обучает копию состояния на новых текстах (массивах номеров слов) и возвращает их темы"""
+        counts = hashed_counts(token_arrays)
+        state['document_frequency'] += np.bincount(counts.indices, minlength=TOPIC_HASH_FEATURES)
+        state['documents'] += len(token_arrays)
+        matrix = self._weigh(counts, state)
+
+        rnd = np.random.RandomState(state['documents'])
+        fresh = len(state['centroids']) == 0
+        self._seed(matrix, state, rnd)
+        if not len(state['centroids']):
+            return [None] * len(token_arrays)
+
+        for _ in range(INITIAL_PASSES if fresh else 1):
+            order = rnd.permutation(matrix.shape[0])
+            for start in range(0, len(order), self.batch_size):
+                self._fit_batch(matrix[order[start:start + self.batch_size]], state)
+
+        topics = np.asarray(matrix @ state['centroids'].T).argmax(axis=1)
+        empty = np.diff(matrix.indptr) == 0
+        return [None if is_empty else int(topic) for topic, is_empty in zip(topics, empty)]
+
+    def update(self, days=TOPIC_WINDOW_DAYS):
+        """Размечает темами сообщения за окно, у которых темы еще нет.
+
+        Каждая пачка из UPDATE_CHUNK сообщений пишет темы и новые центры
+        своей транзакцией, в память модель попадает только после ее
+        фиксации. Возвращает {'assigned': ..., 'topics': ...}.
+        """
+        since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        assigned = 0
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            state = self.state
+
+            last_id = 0
+            while True:
+                # Пачка за транзакцией: запись новых сообщений не ждет всю историю
+                with transaction() as conn:
+                    rows = conn.execute('''
+                        SELECT id, message_text, tokens FROM messages
+                        WHERE topic_id IS NULL AND message_date >= ? AND id > ?
+                        ORDER BY id LIMIT ?
+                    ''', (since, last_id, UPDATE_CHUNK)).fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+
+                    # Опубликованное состояние не меняется до фиксации пачки
+                    state = {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in state.items()}
+                    topics = self.partial_fit([tokenizer.tokens_for(text, tokens) for _, text, tokens in rows], state)
+                    # Тексты без значимых слов помечаются -1, чтобы не брать их снова
+                    conn.executemany('UPDATE messages SET topic_id = ? WHERE id = ?', [
+                        (-1 if topic is None else topic, row_id) for (row_id, _, _), topic in zip(rows, topics)
+                    ])
+                    conn.execute('''
+                        INSERT OR REPLACE INTO topic_model
+                        (id, features, centroids, counts, document_frequency, documents, updated_at)
+                        VALUES (1, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ''', (
+                        TOPIC_HASH_FEATURES, state['centroids'].tobytes(), state['counts'].tobytes(),
+                        state['document_frequency'].tobytes(), state['documents']
+                    ))
+
+                    def publish(state=state):
+                        self.state = state
+                    on_commit(publish)
+
+                assigned += len(rows)
+
+        if assigned:
+            logger.info(f"🗂️ Темы назначены {assigned} сообщениям, тем: {len(state['centroids'])}")
+        return {'assigned': assigned, 'topics': len(state['centroids'])}
+
+    def get_stats(self):
+        """Число тем и размер каждой с учетом забывания"""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            return {
+                'topics': len(self.state['centroids']),
+                'documents': self.state['documents'],
+                'weights': [round(float(count), 1) for count in self.state['counts']]
+            }
+
+def label_topics(token_arrays, topics, words=LABEL_WORDS):
+    """Названия тем по самым характерным для них словам.
+
+    Слово характерно, если часто встречается в сообщениях темы и редко в
+    остальных (c-TF-IDF); в названии стоит самая частая форма слова.
+    token_arrays - массивы номеров слов сообщений.
+    Возвращает {topic_id: 'Комиссия, тарифы'}.
+    """
+    words_of, stems, stem_of = tokenizer.words, tokenizer.stems, tokenizer.stem_of
+    stem_counts, forms = {}, {}
+    overall = Counter()
+    for tokens, topic in zip(token_arrays, topics):
+        if topic is None or topic < 0:
+            continue
+        counts = stem_counts.setdefault(topic, Counter())
+        for word_id in tokenizer.significant_ids(tokens):
+            word = words_of[word_id]
+            if word.isdigit():
+                continue
+            word_stem = stems[stem_of[word_id]]
+            counts[word_stem] += 1
+            overall[word_stem] += 1
+            forms.setdefault(word_stem, Counter())[word] += 1
+
+    if not stem_counts:
+        return {}
+
+    average = sum(overall.values()) / len(stem_counts)
+    labels, used = {}, set()
+    for topic, counts in sorted(stem_counts.items(), key=lambda item: -sum(item[1].values())):
+        size = sum(counts.values())
+        scored = sorted(
+            counts, key=lambda word_stem: -(counts[word_stem] / size) * np.log(1 + average / overall[word_stem])
+        )
+        # Совпавшее с другой темой название удлиняется следующим словом
+        count = words
+        label = None
+        while label is None or (label in used and count <= len(scored)):
+            label = ', '.join(forms[word_stem].most_common(1)[0][0] for word_stem in scored[:count]).capitalize()
+            count += 1
+        if label in used:
+            label = f'{label} ({topic})'
+        used.add(label)
+        labels[topic] = label
+    return labels
+
+def _drop_repeats(sections):
+    """Убирает пункты, почти повторяющие уже взятые в этом или в разделах выше.
+
+    Разделы считаются независимо, и одна новость, пересказанная в
+    сообщениях разных тем, попадала в дайджест несколько раз. Все пункты
+    сверяются по подписям MinHash с одним общим набором взятых; разделы
+    без пунктов выпадают.
+    """
+    used = []
+    kept = {}
+    for name, section in sections.items():
+        section = {key: list(items) for key, items in section.items()}
+        for key in ('key_points', 'important', 'tips'):
+            items = []
+            for sentence in section.get(key, []):
+                signature = minhash(sentence)
+                if signature is not None:
+                    if any(similarity(signature, other) >= NEAR_DUPLICATE_THRESHOLD for other in used):
+                        continue
+                    used.append(signature)
+                items.append(sentence)
+            section[key] = items
+        if section.get('key_points') or section.get('important') or section.get('tips'):
+            kept[name] = section
+    return kept
+
+def build_topic_digest(days=TOPIC_WINDOW_DAYS, sections_limit=TOPIC_SECTIONS):
+    """Дайджест за период, разбитый на разделы по темам.
+
+    Сначала размечаются сообщения, пришедшие с прошлого обновления,
+    затем самые крупные темы становятся разделами, а их пункты выбирает
+    summarizer. Возвращает структуру для PostFormatter.format_structured_post
+    или None, если сообщений за период нет.
+    """
+    topic_model.update(days)
+
+    since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    rows = get_connection().execute('''
+        SELECT message_text, topic_id, cluster_id, tokens FROM messages
+        WHERE message_date >= ? AND topic_id >= 0
+        ORDER BY message_date
+    ''', (since,)).fetchall()
+    if not rows:
+        return None
+
+    texts = [row[0] for row in rows]
+    topics = [row[1] for row in rows]
+    clusters = [row[2] for row in rows]
+    token_arrays = [tokenizer.tokens_for(row[0], row[3]) for row in rows]
+
+    sizes = Counter(topics)
+    chosen = [topic for topic, size in sizes.most_common(sections_limit) if size >= TOPIC_MIN_MESSAGES]
+    if not chosen:
+        return None
+
+    names = label_topics(token_arrays, topics)
+    keep = [i for i, topic in enumerate(topics) if topic in chosen]
+    section_labels = [names[topics[i]] for i in keep]
+    picked = summarizer.summarize(
+        [texts[i] for i in keep], section_labels, [clusters[i] for i in keep],
+        token_arrays=[token_arrays[i] for i in keep]
+    )
+
+    sections = _drop_repeats({names[topic]: picked[names[topic]] for topic in chosen if names[topic] in picked})
+    tips = [tip for section in sections.values() for tip in section.get('tips', [])]
+    return {
+        'title': '📊 Темы недели на маркетплейсах',
+        'summary': f'Проанализировано {len(texts)} сообщений за {days} дн., главных тем: {len(sections)}',
+        'sections': sections,
+        'recommendations': tips[0] if tips else 'Следите за официальными объявлениями'
+    }
+
+# Глобальный экземпляр
+topic_model = TopicModel()
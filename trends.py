@@ -0,0 +1,407 @@
+import json
+import zlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+import numpy as np
+from storage import get_connection, transaction, on_commit
+from text_processing import tokenizer
+from marketplace_classifier import OTHER
+from config import (
+    TREND_WINDOW_DAYS, TREND_BASELINE_DAYS, TREND_SKETCH_WIDTH, TREND_SKETCH_DEPTH,
+    TREND_CANDIDATES, TREND_MIN_COUNT, TREND_MIN_GROWTH, TREND_TOP
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько новых сообщений читать из базы за раз
+UPDATE_CHUNK = 2000
+
+# Маркетплейсы, по которым считаются тренды
+MARKETPLACES = ('OZON', 'WB', 'YANDEX')
+
+# Рост меньше трех корней из ожидаемой частоты - обычный разброс
+MIN_SCORE = 3.0
+
+# Хеши строк эскиза: ((a * h + b) mod P) mod ширина, P - простое Мерсенна 2^31 - 1
+PRIME = (1 << 31) - 1
+_rnd = np.random.RandomState(1313)
+HASH_A = _rnd.randint(1, PRIME, size=TREND_SKETCH_DEPTH).astype(np.uint64)
+HASH_B = _rnd.randint(0, PRIME, size=TREND_SKETCH_DEPTH).astype(np.uint64)
+
+def init_trends():
+    """Таблицы эскизов по дням и водяного знака обработанных сообщений"""
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS trend_buckets (
+                marketplace TEXT NOT NULL,
+                day TEXT NOT NULL,
+                sketch BLOB NOT NULL,
+                messages INTEGER NOT NULL,
+                candidates TEXT NOT NULL,
+                PRIMARY KEY (marketplace, day)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS trend_progress (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_message_id INTEGER NOT NULL
+            )
+        ''')
+
+    logger.info("✅ Тренды инициализированы")
+
+@lru_cache(maxsize=100000)
+def _stem_hash(word_stem):
+    return zlib.crc32(word_stem.encode('utf-8')) & 0x7fffffff
+
+def _pair_hash(first, second):
+    """Хеш биграммы из хешей ее основ (работает и для массивов numpy)"""
+    return (first * 0x9E3779B1 + second) % PRIME
+
+def term_hash(key):
+    """Хеш терма по ключу: 'основа' или 'основа основа'"""
+    stems = key.split(' ')
+    if len(stems) == 1:
+        return _stem_hash(stems[0])
+    return _pair_hash(_stem_hash(stems[0]), _stem_hash(stems[1]))
+
+def sketch_cells(hashes):
+    """Номера ячеек терма в каждой строке эскиза: (глубина x термы)"""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    return ((HASH_A[:, None] * hashes[None, :] + HASH_B[:, None]) % PRIME % TREND_SKETCH_WIDTH).astype(np.int64)
+
+def estimate(sketch, cells):
+    """Оценка частот по эскизу (count-mean-min).
+
+    Из каждой ячейки вычитается ожидаемый вклад чужих термов, берется
+    медиана по строкам; так оценка не растет вместе с объемом
+    сообщений. Сверху она ограничена обычной оценкой count-min.
+    """
+    if not cells.shape[1]:
+        return np.zeros(0)
+    counts = np.take_along_axis(sketch, cells, axis=1).astype(np.float64)
+    totals = sketch.sum(axis=1, dtype=np.float64)[:, None]
+    noise = (totals - counts) / (TREND_SKETCH_WIDTH - 1)
+    return np.clip(np.median(counts - noise, axis=0), 0, counts.min(axis=0))
+
+class _WordHashes:
+    """Хеш основы для каждого номера слова словаря токенизатора.
+
+    Стоп-слова, числа и границы предложений получают -1: они не
+    становятся термами и разрывают биграммы.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.hashes = np.zeros(0, dtype=np.int64)
+        self.generation = tokenizer.generation
+
+    def table(self):
+        if self.generation != tokenizer.generation:
+            self._reset()
+        hashes = self.hashes
+        known, total = len(hashes), len(tokenizer.words)
+        if known < total:
+            words, stems, stem_of, significant = tokenizer.words, tokenizer.stems, tokenizer.stem_of, tokenizer.significant
+            hashes = np.concatenate([hashes, np.fromiter(
+                (_stem_hash(stems[stem_of[word_id]]) if significant[word_id] and not words[word_id].isdigit() else -1
+                 for word_id in range(known, total)),
+                dtype=np.int64, count=total - known
+            )])
+            self.hashes = hashes
+        return hashes
+
+_word_hashes = _WordHashes()
+
+def extract_terms(token_arrays):
+    """Термы пачки сообщений: слова и биграммы соседних значимых слов.
+
+    Терм считается один раз на сообщение. Возвращает (хеши термов по
+    сообщениям, [(ключ из основ, форма из слов), ...] для разных термов).
+    """
+    hashes = _word_hashes.table()
+    lengths = np.fromiter((len(tokens) for tokens in token_arrays), dtype=np.int64, count=len(token_arrays))
+    flat = np.concatenate(token_arrays).astype(np.int64) if len(token_arrays) else np.zeros(0, dtype=np.int64)
+    rows = np.repeat(np.arange(len(token_arrays)), lengths)
+    # Номер предложения: биграмма не переходит через его границу
+    sentence = np.cumsum(flat == tokenizer.BOUNDARY)
+
+    word_hashes = hashes[flat]
+    keep = word_hashes >= 0
+    ids, rows, sentence, word_hashes = flat[keep], rows[keep], sentence[keep], word_hashes[keep]
+
+    pairs = np.flatnonzero(sentence[1:] == sentence[:-1])
+    term_hashes = np.concatenate([word_hashes, _pair_hash(word_hashes[pairs], word_hashes[pairs + 1])])
+    term_rows = np.concatenate([rows, rows[pairs]])
+    first = np.concatenate([ids, ids[pairs]])
+    second = np.concatenate([np.full(len(ids), -1), ids[pairs + 1]])
+
+    # Один раз на сообщение: уникальные пары (сообщение, терм)
+    _, unique = np.unique(term_rows * (PRIME + 1) + term_hashes, return_index=True)
+    term_hashes = term_hashes[unique]
+
+    words, stems, stem_of = tokenizer.words, tokenizer.stems, tokenizer.stem_of
+    names = []
+    _, distinct = np.unique(term_hashes, return_index=True)
+    for position in unique[distinct].tolist():
+        left, right = int(first[position]), int(second[position])
+        if right < 0:
+            names.append((stems[stem_of[left]], words[left]))
+        else:
+            names.append((f'{stems[stem_of[left]]} {stems[stem_of[right]]}', f'{words[left]} {words[right]}'))
+    return term_hashes, names
+
+class TrendDetector:
+    """Растущие термы по маркетплейсам на эскизах count-min.
+
+    Для каждого маркетплейса и дня хранится эскиз частот слов и биграмм
+    (глубина x ширина счетчиков, сколько бы сообщений ни пришло), число
+    сообщений и ограниченный список термов-кандидатов с формой для
+    показа. Дни старше окна и базы удаляются, так что память
+    фиксирована: маркетплейсы x (TREND_WINDOW_DAYS + TREND_BASELINE_DAYS)
+    эскизов. Обновление берет только сообщения после водяного знака.
+    Тренд - кандидат окна, которого в окне заметно больше, чем ожидается
+    по базе с поправкой на объем сообщений; запрос складывает эскизы
+    дней и оценивает кандидатов матричными операциями.
+    """
+
+    def __init__(self, window_days=TREND_WINDOW_DAYS, baseline_days=TREND_BASELINE_DAYS,
+                 candidates=TREND_CANDIDATES):
+        self.window_days = window_days
+        self.baseline_days = baseline_days
+        self.candidates = candidates
+        self._lock = threading.Lock()
+        # Водяной знак, до которого загружены эскизы (None - не загружены)
+        self._progress = None
+        self.buckets = {}
+        self._merged = (None, {})
+
+    @staticmethod
+    def _empty_bucket():
+        return {
+            'sketch': np.zeros((TREND_SKETCH_DEPTH, TREND_SKETCH_WIDTH), dtype=np.int32),
+            'messages': 0,
+            'candidates': {}
+        }
+
+    def _oldest_day(self, today=None):
+        today = today or datetime.utcnow()
+        return (today - timedelta(days=self.window_days + self.baseline_days - 1)).strftime('%Y-%m-%d')
+
+    @staticmethod
+    def _stored_progress(conn):
+        row = conn.execute('SELECT last_message_id FROM trend_progress WHERE id = 1').fetchone()
+        return row[0] if row else 0
+
+    def load(self, conn=None):
+        """Поднимает эскизы из базы.
+
+        Водяной знак читается до эскизов: если между чтениями другой
+        процесс обновит эскизы, знак окажется старее и вызовет повторную
+        загрузку, а не потерю обновления.
+        """
+        conn = conn or get_connection()
+        progress = self._stored_progress(conn)
+        buckets = {}
+        rows = conn.execute('''
+            SELECT marketplace, day, sketch, messages, candidates FROM trend_buckets
+        ''').fetchall()
+        for marketplace, day, sketch, messages, candidates in rows:
+            sketch = np.frombuffer(sketch, dtype=np.int32)
+            if sketch.size != TREND_SKETCH_DEPTH * TREND_SKETCH_WIDTH:
+                logger.warning("⚠️ Размер эскиза трендов изменился, эскизы начинаются заново")
+                buckets = {}
+                break
+            buckets[(marketplace, day)] = {
+                'sketch': sketch.reshape(TREND_SKETCH_DEPTH, TREND_SKETCH_WIDTH),
+                'messages': messages,
+                'candidates': json.loads(candidates)
+            }
+        self.buckets = buckets
+        self._progress = progress
+
+    def _add(self, bucket, token_arrays):
+        """Добавляет сообщения одного маркетплейса и дня в копию эскиза дня"""
+        term_hashes, names = extract_terms(token_arrays)
+        sketch = bucket['sketch'].copy()
+        for depth, cells in enumerate(sketch_cells(term_hashes)):
+            sketch[depth] += np.bincount(cells, minlength=TREND_SKETCH_WIDTH).astype(np.int32)
+
+        candidates = dict(bucket['candidates'])
+        for key, form in names:
+            candidates.setdefault(key, form)
+        if len(candidates) > self.candidates:
+            keys = list(candidates)
+            counts = estimate(sketch, sketch_cells([term_hash(key) for key in keys]))
+            best = np.argsort(-counts, kind='stable')[:self.candidates]
+            candidates = {keys[i]: candidates[keys[i]] for i in sorted(best.tolist())}
+
+        return {'sketch': sketch, 'messages': bucket['messages'] + len(token_arrays), 'candidates': candidates}
+
+    def update(self):
+        """Добавляет в эскизы сообщения, сохраненные после прошлого обновления.
+
+        Сообщения старше окна и базы пропускаются, старые дни удаляются.
+        Возвращает {'messages': ..., 'buckets': ...} - сколько сообщений
+        обработано и сколько эскизов дней изменилось.
+        """
+        processed = 0
+        touched = set()
+        with self._lock:
+            oldest = self._oldest_day()
+            # Внутри общей транзакции публикация ждет ее фиксации, поэтому
+            # следующие пачки читают эскизы, измененные предыдущими
+            working = {}
+            while True:
+                # Пачка за транзакцией: запись новых сообщений не ждет всю историю
+                with transaction() as conn:
+                    last_id = self._stored_progress(conn)
+                    if last_id != self._progress:
+                        # Эскизы обновил другой процесс: продолжаем с его состояния
+                        self.load(conn)
+                        working = {}
+                    rows = conn.execute('''
+                        SELECT id, message_text, COALESCE(marketplace, ?), message_date, tokens
+                        FROM messages WHERE id > ? ORDER BY id LIMIT ?
+                    ''', (OTHER, last_id, UPDATE_CHUNK)).fetchall()
+                    if not rows:
+                        break
+
+                    groups = {}
+                    for _, text, marketplace, message_date, tokens in rows:
+                        day = str(message_date or '')[:10]
+                        if marketplace not in MARKETPLACES or day < oldest:
+                            continue
+                        groups.setdefault((marketplace, day), []).append(tokenizer.tokens_for(text, tokens))
+
+                    updated = {}
+                    for key, token_arrays in groups.items():
+                        bucket = working.get(key) or self.buckets.get(key) or self._empty_bucket()
+                        updated[key] = working[key] = self._add(bucket, token_arrays)
+                        conn.execute('''
+                            INSERT OR REPLACE INTO trend_buckets (marketplace, day, sketch, messages, candidates)
+                            VALUES (?, ?, ?, ?, ?)
+                        ''', (
+                            *key, updated[key]['sketch'].tobytes(), updated[key]['messages'],
+                            json.dumps(updated[key]['candidates'], ensure_ascii=False)
+                        ))
+
+                    conn.execute('DELETE FROM trend_buckets WHERE day < ?', (oldest,))
+                    conn.execute(
+                        'INSERT OR REPLACE INTO trend_progress (id, last_message_id) VALUES (1, ?)', (rows[-1][0],)
+                    )
+
+                    def publish(updated=updated, progress=rows[-1][0]):
+                        buckets = {key: bucket for key, bucket in self.buckets.items() if key[1] >= oldest}
+                        buckets.update(updated)
+                        self.buckets = buckets
+                        self._progress = progress
+                    on_commit(publish)
+
+                processed += len(rows)
+                touched.update(updated)
+
+        if processed:
+            logger.info(f"📈 Тренды обновлены: {processed} сообщений, эскизов дней: {len(touched)}")
+        return {'messages': processed, 'buckets': len(touched)}
+
+    def _merge(self, marketplace, days):
+        """Сумма эскизов, число сообщений и кандидаты маркетплейса за дни.
+
+        Суммы кэшируются до следующей публикации эскизов, так что
+        повторные запросы между загрузками не складывают дни заново.
+        """
+        buckets = self.buckets
+        cached, merged = self._merged
+        if cached is not buckets:
+            merged = {}
+            self._merged = (buckets, merged)
+        key = (marketplace, days[0], len(days))
+        if key not in merged:
+            sketch = np.zeros((TREND_SKETCH_DEPTH, TREND_SKETCH_WIDTH), dtype=np.int64)
+            messages, candidates = 0, {}
+            for day in reversed(days):
+                bucket = buckets.get((marketplace, day))
+                if bucket:
+                    sketch += bucket['sketch']
+                    messages += bucket['messages']
+                    candidates.update(bucket['candidates'])
+            keys = list(candidates)
+            merged[key] = (sketch, messages, candidates, keys, sketch_cells([term_hash(k) for k in keys]))
+        return merged[key]
+
+    def top_rising(self, marketplace=None, limit=TREND_TOP, today=None):
+        """Самые растущие термы окна относительно базы.
+
+        Ожидаемая частота - частота в базе, пересчитанная на число
+        сообщений окна; оценка - превышение над ней в единицах корня из
+        ожидания, так что новые термы с парой упоминаний не обгоняют
+        заметный рост частых. В тренды попадают термы с оценкой от
+        MIN_SCORE, ростом от TREND_MIN_GROWTH раз и не реже
+        TREND_MIN_COUNT сообщений. Без базы растущими считаются самые
+        частые термы окна. Возвращает {'OZON': [{'term', 'count', 'expected',
+        'growth', 'score'}, ...], ...}.
+        """
+        # Эскизы могли обновиться в другом процессе (парсер и веб-приложение);
+        # пока идет обновление в этом процессе, отвечаем уже опубликованными
+        if self._stored_progress(get_connection()) != self._progress:
+            if self._lock.acquire(blocking=self._progress is None):
+                try:
+                    self.load()
+                finally:
+                    self._lock.release()
+
+        today = today or datetime.utcnow()
+        days = [(today - timedelta(days=offset)).strftime('%Y-%m-%d')
+                for offset in range(self.window_days + self.baseline_days)]
+        window, baseline = days[:self.window_days], days[self.window_days:]
+
+        trends = {}
+        for name in [marketplace] if marketplace else MARKETPLACES:
+            sketch, messages, candidates, keys, cells = self._merge(name, window)
+            if not keys:
+                continue
+            base_sketch, base_messages, _, _, _ = self._merge(name, baseline)
+
+            counts = estimate(sketch, cells)
+            expected = estimate(base_sketch, cells) * messages / base_messages if base_messages else np.zeros(len(keys))
+            scores = (counts - expected) / np.sqrt(expected + 1)
+            growth = (counts + 1) / (expected + 1)
+            rising = np.flatnonzero((counts >= TREND_MIN_COUNT) & (scores >= MIN_SCORE) & (growth >= TREND_MIN_GROWTH))
+            rising = rising[np.argsort(-scores[rising], kind='stable')]
+
+            picked, used = [], set()
+            for i in rising.tolist():
+                # Слово, уже вошедшее в выбранную биграмму, и наоборот - повтор
+                stems = set(keys[i].split(' '))
+                if stems & used:
+                    continue
+                used.update(stems)
+                picked.append({
+                    'term': candidates[keys[i]],
+                    'count': int(round(counts[i])),
+                    'expected': round(float(expected[i]), 1),
+                    'growth': round(float(growth[i]), 2),
+                    'score': round(float(scores[i]), 2)
+                })
+                if len(picked) == limit:
+                    break
+            if picked:
+                trends[name] = picked
+        return trends
+
+    def get_stats(self):
+        """Число эскизов дней и занимаемая ими память"""
+        buckets = self.buckets
+        return {
+            'buckets': len(buckets),
+            'messages': sum(bucket['messages'] for bucket in buckets.values()),
+            'memory_kb': round(sum(bucket['sketch'].nbytes for bucket in buckets.values()) / 1024)
+        }
+
+# Глобальный экземпляр
+trend_detector = TrendDetector()